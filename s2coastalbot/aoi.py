@@ -0,0 +1,133 @@
+"""
+Compiled AOI tile catalogues, loaded without parsing GeoJSON files on each search.
+Usage: python s2coastalbot/aoi.py compile-aoi aoi_file [-o output_file]
+"""
+
+# standard library
+import argparse
+import logging
+from pathlib import Path
+
+# third party
+import geopandas as gpd
+import numpy as np
+
+# Tile identifier, and tile centroid coordinates, of compiled AOI catalogues
+AOI_DTYPE = np.dtype([("tile_id", "U5"), ("lon", "f8"), ("lat", "f8")])
+
+# Attributes of AOI files holding tile identifiers, by order of preference
+TILE_ID_COLUMNS = ("Name", "name", "tile_id", "tileId", "TILE_ID")
+
+# MGRS tile identifiers of Sentinel-2 products, such as '31TCJ'
+TILE_ID_REGEX = r"\d{2}[A-Z]{3}"
+
+
+def compile_aoi(aoi_file, output_file=None):
+    """Convert AOI file of Sentinel-2 tiles to a compiled AOI catalogue.
+
+    Args:
+        aoi_file (Path): File readable by geopandas, with tile centroids or footprints
+        output_file (Path or None): '.npy' file, defaults to AOI file with '.npy' suffix
+
+    Returns:
+        output_file (Path)
+    """
+    logger = logging.getLogger()
+
+    if output_file is None:
+        output_file = aoi_file.with_suffix(".npy")
+    tiles = read_aoi(aoi_file)
+    output_file.parent.mkdir(exist_ok=True, parents=True)
+    np.save(output_file, tiles, allow_pickle=False)
+    logger.info(f"Compiled {len(tiles)} tiles of {aoi_file} to {output_file}")
+    return output_file
+
+
+def read_aoi(aoi_file):
+    """Read tile identifiers and centroids of an AOI file.
+
+    Tile identifiers are read from the first of TILE_ID_COLUMNS found in the AOI file, with or
+    without their 'T' prefix. Values that aren't MGRS tile identifiers are left empty.
+
+    Args:
+        aoi_file (Path): File readable by geopandas, with tile centroids or footprints
+
+    Returns:
+        tiles (np.ndarray): Structured array of AOI_DTYPE, with empty tile identifiers if the
+            AOI file doesn't hold any
+    """
+    logger = logging.getLogger()
+
+    gdf = gpd.read_file(aoi_file)
+    points = gdf.geometry if (gdf.geom_type == "Point").all() else gdf.geometry.centroid
+    tiles = np.zeros(len(gdf), dtype=AOI_DTYPE)
+    tiles["lon"] = points.x
+    tiles["lat"] = points.y
+    tile_id_column = next((c for c in TILE_ID_COLUMNS if c in gdf.columns), None)
+    if tile_id_column is not None:
+        tile_ids = gdf[tile_id_column].fillna("").astype(str).str.strip().str.removeprefix("T")
+        is_tile_id = tile_ids.str.fullmatch(TILE_ID_REGEX)
+        if not is_tile_id.all():
+            logger.warning(
+                f"Ignoring {(~is_tile_id).sum()} values of '{tile_id_column}' in {aoi_file} "
+                "that aren't tile identifiers"
+            )
+        tiles["tile_id"] = tile_ids.where(is_tile_id, "")
+    return tiles
+
+
+def load_aoi(aoi_file):
+    """Load AOI tiles, memory-mapping compiled AOI catalogue if any.
+
+    The compiled catalogue is either the AOI file itself, or a '.npy' file next to it that is more
+    recent. Other AOI files are read with geopandas.
+
+    Args:
+        aoi_file (Path)
+
+    Returns:
+        tiles (np.ndarray): Structured array of AOI_DTYPE
+    """
+    compiled_file = aoi_file.with_suffix(".npy")
+    if aoi_file.suffix != ".npy" and (
+        not compiled_file.exists() or compiled_file.stat().st_mtime < aoi_file.stat().st_mtime
+    ):
+        return read_aoi(aoi_file)
+    tiles = np.load(compiled_file, mmap_mode="r", allow_pickle=False)
+    if tiles.dtype != AOI_DTYPE:
+        raise Exception(f"Unexpected compiled AOI file format: {tiles.dtype}")
+    return tiles
+
+
+def get_weighted_permutation(rng, weights):
+    """Draw a random order of tiles, where tiles with higher weights tend to come first.
+
+    Each tile gets a key u ** (1 / weight) with u uniform in [0, 1), and tiles are sorted by
+    decreasing keys, which amounts to weighted sampling without replacement.
+
+    Args:
+        rng (np.random.Generator)
+        weights (np.ndarray): Positive weights of tiles
+
+    Returns:
+        (np.ndarray): Indices of tiles
+    """
+    keys = rng.random(len(weights)) ** (1 / weights)
+    return np.argsort(-keys, kind="stable")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compile_parser = subparsers.add_parser(
+        "compile-aoi", help="Compile AOI file to a memory-mappable tile catalogue"
+    )
+    compile_parser.add_argument("aoi_file", help="Typically 'aoi_file_downloading' of config")
+    compile_parser.add_argument(
+        "-o", "--output_file", help="Default: AOI file with '.npy' suffix, loaded automatically"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    compile_aoi(Path(args.aoi_file), None if args.output_file is None else Path(args.output_file))
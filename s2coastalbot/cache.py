@@ -0,0 +1,239 @@
+"""Local caches reducing requests to CDSE."""
+
+# standard library
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from urllib.parse import quote
+from urllib.parse import unquote
+
+logger = logging.getLogger()
+
+# Delay after which cached product node trees expire, in seconds
+DEFAULT_NODES_CACHE_TTL = 7 * 24 * 3600.0
+
+# Node metadata kept in cache, other keys returned by CDSE OData API are dropped
+CACHED_NODE_KEYS = ("Name", "ContentLength", "Nodes", "Checksum")
+
+# Delay after which cached query results expire, in seconds, also used as date bucket size
+DEFAULT_QUERY_CACHE_TTL = 3600.0
+
+# Disk space that downloaded products can use before least recently used ones are evicted, in bytes
+DEFAULT_DOWNLOAD_CACHE_SIZE = 10 * 1024**3
+
+
+class NodeCache:
+    """On-disk cache of flattened product node trees, with one JSON file per product.
+
+    Products are immutable once published, so entries only expire to bound the cache size.
+
+    Args:
+        cache_dir (Path)
+        ttl (float): Delay after which entries expire, in seconds
+    """
+
+    def __init__(self, cache_dir: Path, ttl: float = DEFAULT_NODES_CACHE_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """Get cached file nodes of a product.
+
+        Args:
+            key (str): Product identifier, typically its feature ID
+
+        Returns:
+            nodes (list[dict[str, Any]] or None): None if product is not cached or expired
+        """
+        cache_file = self._get_cache_file(key)
+        try:
+            with open(cache_file) as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if entry["created"] + self.ttl < time.time():
+            cache_file.unlink(missing_ok=True)
+            return None
+        logger.debug(f"Using cached node tree of product {key}")
+        return entry["nodes"]
+
+    def set(self, key: str, nodes: List[Dict[str, Any]]) -> None:
+        """Store file nodes of a product.
+
+        Args:
+            key (str): Product identifier, typically its feature ID
+            nodes (list[dict[str, Any]])
+        """
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+        entry = {
+            "created": time.time(),
+            "nodes": [{k: node[k] for k in CACHED_NODE_KEYS if k in node} for node in nodes],
+        }
+
+        # Write to temporary file first so that concurrent readers never see partial entries
+        cache_file = self._get_cache_file(key)
+        tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        with open(tmp_file, "w") as file:
+            json.dump(entry, file)
+        os.replace(tmp_file, cache_file)
+
+    def _get_cache_file(self, key: str) -> Path:
+        return self.cache_dir / f"{quote(key, safe='')}.json"
+
+
+class DownloadCache:
+    """On-disk cache of downloaded product files, with one folder per product.
+
+    Files are stored under the folder of their product, keyed by feature ID, at their path in the
+    product tree, so that files already downloaded are found again by later runs. Products are
+    evicted in least recently used order once the cache exceeds its size budget.
+
+    Args:
+        cache_dir (Path)
+        max_size (int): Size budget of the cache, in bytes
+    """
+
+    def __init__(self, cache_dir: Path, max_size: int = DEFAULT_DOWNLOAD_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def get_product_path(self, key: str) -> Path:
+        """Get folder of a product, marking it as most recently used.
+
+        Args:
+            key (str): Product identifier, typically its feature ID
+
+        Returns:
+            product_path (Path): Folder in which the product tree is reproduced
+        """
+        product_path = self.cache_dir / quote(key, safe="")
+        product_path.mkdir(exist_ok=True, parents=True)
+        os.utime(product_path)
+        return product_path
+
+    def evict(self, keep: Sequence[str] = ()) -> List[str]:
+        """Remove least recently used products until the cache fits in its size budget.
+
+        Args:
+            keep (list[str]): Keys of products that should not be evicted, such as products in use
+
+        Returns:
+            evicted_keys (list[str])
+        """
+        if not self.cache_dir.exists():
+            return []
+        products = sorted(
+            (path for path in self.cache_dir.iterdir() if path.is_dir()),
+            key=lambda path: path.stat().st_mtime,
+        )
+        sizes = {path: _get_folder_size(path) for path in products}
+        total_size = sum(sizes.values())
+
+        evicted_keys = []
+        for product_path in products:
+            if total_size <= self.max_size:
+                break
+            key = unquote(product_path.name)
+            if key in keep:
+                continue
+            logger.info(f"Evicting product {key} from download cache")
+            shutil.rmtree(product_path, ignore_errors=True)
+            total_size -= sizes[product_path]
+            evicted_keys.append(key)
+        return evicted_keys
+
+
+def _get_folder_size(path: Path) -> int:
+    """Compute total size of files in a folder and its subfolders, in bytes."""
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+
+class QueryCache:
+    """SQLite cache of product query results, shared by concurrent queries and bot processes.
+
+    Queries are keyed by their parameters, where the time range of the query is replaced by a date
+    bucket as long as the TTL, so that queries of a sliding time range sent within the same bucket
+    share their results.
+
+    Args:
+        cache_file (Path)
+        ttl (float): Delay after which entries expire, in seconds
+    """
+
+    def __init__(self, cache_file: Path, ttl: float = DEFAULT_QUERY_CACHE_TTL):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.cache_file.parent.mkdir(exist_ok=True, parents=True)
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS queries "
+                "(key TEXT PRIMARY KEY, created REAL NOT NULL, features TEXT NOT NULL)"
+            )
+
+    def get_date_bucket(self) -> int:
+        """Get current date bucket, which changes every TTL.
+
+        Returns:
+            (int)
+        """
+        return int(time.time() // self.ttl)
+
+    def get_key(self, *params: Any) -> str:
+        """Build key of a query in the current date bucket.
+
+        Args:
+            *params: JSON serializable query parameters, excluding its time range
+
+        Returns:
+            (str)
+        """
+        content = json.dumps([self.get_date_bucket(), *params], default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """Get cached results of a query.
+
+        Args:
+            key (str)
+
+        Returns:
+            features (list[dict[str, Any]] or None): None if query is not cached or expired
+        """
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT features FROM queries WHERE key = ? AND created > ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+        if row is None:
+            return None
+        logger.debug("Using cached query results")
+        return json.loads(row[0])
+
+    def set(self, key: str, features: List[Dict[str, Any]]) -> None:
+        """Store results of a query, dropping expired entries.
+
+        Args:
+            key (str)
+            features (list[dict[str, Any]])
+        """
+        now = time.time()
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM queries WHERE created <= ?", (now - self.ttl,))
+            connection.execute(
+                "INSERT OR REPLACE INTO queries VALUES (?, ?, ?)",
+                (key, now, json.dumps(features, default=str)),
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.cache_file, timeout=30.0)
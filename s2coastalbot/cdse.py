@@ -2,95 +2,1255 @@
 
 # standard library
 import fnmatch
+import hashlib
 import json
 import logging
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any
+from typing import BinaryIO
 from typing import Dict
+from typing import Iterator
 from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
 from typing import Union
+from urllib.parse import quote
 
 # third party
+import rasterio.shutil
 import requests
-from cdsetool.credentials import Credentials
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+# current project
+from s2coastalbot.cache import NodeCache
+from s2coastalbot.governor import THROTTLING_STATUSES
+from s2coastalbot.governor import Governor
+from s2coastalbot.governor import get_governor
+from s2coastalbot.governor import parse_retry_after
 
 logger = logging.getLogger()
 
 
-def search_nodes(node_url: str, pattern: str, exclude: bool = False) -> List[Dict[str, Any]]:
+# Maximum number of directory nodes listed concurrently while traversing a product node tree
+DEFAULT_MAX_WORKERS = 8
+
+# Strategies available to list file nodes of a product: recursive traversal of its node tree,
+# or lookup of its SAFE manifest, falling back to traversal if manifest can't be used
+NODE_STRATEGIES = ("traversal", "manifest")
+
+# Maximum number of keep-alive connections kept open per host by a CDSE client
+DEFAULT_POOL_MAXSIZE = 16
+
+# Connect and read timeouts of CDSE requests, in seconds
+DEFAULT_TIMEOUT = (10.0, 60.0)
+
+# Maximum number of attempts to download a file, each new attempt resuming the previous one
+DEFAULT_MAX_ATTEMPTS = 5
+
+# Size of chunks written to disk while streaming a download, in bytes
+DOWNLOAD_CHUNK_SIZE = 65536
+
+# Number of concurrent connections used to download a file in segmented mode
+DEFAULT_SEGMENTS = 1
+
+# Size of byte ranges downloaded by each connection in segmented mode, in bytes
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+
+# CDSE identity provider token endpoint
+TOKEN_URL = (
+    "https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token"
+)
+
+# Delay before expiry at which tokens are considered expired and refreshed, in seconds
+TOKEN_REFRESH_MARGIN = 60.0
+
+
+class TokenExchangeError(Exception):
+    """Raised when CDSE identity provider refuses to deliver a token."""
+
+
+class TokenManager:
+    """Cache CDSE access token and refresh it shortly before it expires.
+
+    The access token is kept in memory and optionally in a cache file readable only by the current
+    user, so that consecutive runs reuse it. Once expired, it is renewed using the refresh token,
+    and only falls back to logging in with username and password once the refresh token expired.
+
+    Args:
+        username (str)
+        password (str)
+        cache_file (Path or None)
+        session (requests.Session or None): Session used for token requests
+        refresh_margin (float): Delay before expiry at which tokens are refreshed, in seconds
+    """
+
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        cache_file: Optional[Path] = None,
+        session: Optional[requests.Session] = None,
+        refresh_margin: float = TOKEN_REFRESH_MARGIN,
+    ):
+        self.username = username
+        self.password = password
+        self.cache_file = cache_file
+        self.session = requests.Session() if session is None else session
+        self.refresh_margin = refresh_margin
+        self._tokens: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        if self.cache_file is not None:
+            self._load()
+
+    def get_token(self) -> str:
+        """Get a valid access token, refreshing it if necessary.
+
+        Returns:
+            access_token (str)
+        """
+        with self._lock:
+            now = time.time()
+            if self._tokens.get("access_expires", 0) - self.refresh_margin > now:
+                return self._tokens["access_token"]
+
+            if self._tokens.get("refresh_expires", 0) - self.refresh_margin > now:
+                logger.debug("Refreshing CDSE access token")
+                try:
+                    self._exchange(
+                        {
+                            "grant_type": "refresh_token",
+                            "refresh_token": self._tokens["refresh_token"],
+                        }
+                    )
+                except TokenExchangeError as error_msg:
+                    logger.warning(f"Failed to refresh CDSE access token: {error_msg}")
+                    self._tokens = {}
+
+            if not self._tokens.get("access_expires", 0) - self.refresh_margin > now:
+                logger.debug("Logging in to CDSE")
+                self._exchange(
+                    {"grant_type": "password", "username": self.username, "password": self.password}
+                )
+
+            if self.cache_file is not None:
+                self._save()
+            return self._tokens["access_token"]
+
+    def _exchange(self, data: Dict[str, str]) -> None:
+        """Request new tokens from CDSE identity provider."""
+        response = self.session.post(
+            TOKEN_URL, data={**data, "client_id": "cdse-public"}, timeout=DEFAULT_TIMEOUT
+        )
+        if response.status_code != 200:
+            raise TokenExchangeError(f"Status code: {response.status_code}, {response.text}")
+        tokens = response.json()
+        now = time.time()
+        self._tokens = {
+            "username": self.username,
+            "access_token": tokens["access_token"],
+            "access_expires": now + tokens["expires_in"],
+            "refresh_token": tokens.get("refresh_token"),
+            "refresh_expires": now + tokens.get("refresh_expires_in", 0),
+        }
+
+    def _load(self) -> None:
+        """Read tokens from cache file, ignoring tokens of another user."""
+        try:
+            with open(self.cache_file) as file:
+                tokens = json.load(file)
+        except (OSError, ValueError):
+            return
+        if tokens.get("username") == self.username:
+            self._tokens = tokens
+
+    def _save(self) -> None:
+        """Write tokens to cache file, with permissions restricted to the current user."""
+        _write_private_file(self.cache_file, json.dumps(self._tokens))
+
+
+def _write_private_file(path: Path, text: str) -> None:
+    """Write text to a file readable only by the current user."""
+    path.parent.mkdir(exist_ok=True, parents=True)
+    file_descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.chmod(path, 0o600)  # in case file already existed with other permissions
+    with os.fdopen(file_descriptor, "w") as file:
+        file.write(text)
+
+
+class CDSEClient:
+    """HTTP client sharing one keep-alive connection pool for all CDSE requests.
+
+    Authenticated requests share a single token manager, so that the access token is only
+    renewed when it is about to expire.
+
+    Args:
+        username (str or None): Only required for authenticated requests
+        password (str or None): Only required for authenticated requests
+        pool_maxsize (int): Maximum number of connections kept open per host, should be at least
+            the number of concurrent requests
+        timeout (float or (float, float)): Connect and read timeouts, in seconds
+        token_cache_file (Path or None): File where access tokens are cached between runs
+        governor (Governor or None): Limits applied to requests, the process-wide governor is
+            used if None is given
+    """
+
+    RETRIES = Retry(total=5, backoff_factor=0.5, status_forcelist=[500, 502, 504])
+
+    def __init__(
+        self,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT,
+        token_cache_file: Optional[Path] = None,
+        governor: Optional[Governor] = None,
+    ):
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.governor = get_governor() if governor is None else governor
+
+        # Create session with a single connection pool shared by all threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4, pool_maxsize=pool_maxsize, max_retries=self.RETRIES
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        self.token_manager = TokenManager(username, password, token_cache_file, self.session)
+
+    def __enter__(self) -> "CDSEClient":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close all connections of the pool."""
+        self.session.close()
+
+    def get(self, url: str, authenticated: bool = False, **kwargs) -> requests.Response:
+        """Send a GET request through the shared session, within limits of the governor.
+
+        Throttling responses are retried after the delay given in their 'Retry-After' header,
+        which also delays all other requests going through the same governor.
+
+        Args:
+            url (str)
+            authenticated (bool): If set to True, add CDSE authorization header to the request
+            **kwargs: Passed to requests.Session.get
+
+        Returns:
+            response (requests.Response)
+        """
+        return self._send(self.session.get, url, authenticated, **kwargs)
+
+    def post(self, url: str, authenticated: bool = False, **kwargs) -> requests.Response:
+        """Send a POST request through the shared session, within limits of the governor.
+
+        Args:
+            url (str)
+            authenticated (bool): If set to True, add CDSE authorization header to the request
+            **kwargs: Passed to requests.Session.post
+
+        Returns:
+            response (requests.Response)
+        """
+        return self._send(self.session.post, url, authenticated, **kwargs)
+
+    def _send(self, send: Any, url: str, authenticated: bool, **kwargs) -> requests.Response:
+        """Send a request with a session method, retrying throttling responses."""
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(1, DEFAULT_MAX_ATTEMPTS + 1):
+            if authenticated:
+                kwargs["headers"] = {
+                    **kwargs.get("headers", {}),
+                    "Authorization": f"Bearer {self.token_manager.get_token()}",
+                }
+            self.governor.acquire_request()
+            response = send(url, **kwargs)
+            if response.status_code not in THROTTLING_STATUSES or attempt == DEFAULT_MAX_ATTEMPTS:
+                return response
+            delay = parse_retry_after(response.headers.get("Retry-After"))
+            delay = 2.0**attempt if delay is None else delay
+            logger.warning(
+                f"Throttled by CDSE (status {response.status_code}), retrying in {delay}s"
+            )
+            response.close()
+            self.governor.pause(delay)
+
+    def get_json(self, url: str) -> Dict[str, Any]:
+        """Send a GET request and decode its JSON response.
+
+        Args:
+            url (str)
+
+        Returns:
+            (dict[str, Any])
+        """
+        response = self.get(url, headers={"Accept": "application/json"})
+        response.raise_for_status()
+        return response.json()
+
+    def post_json(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Send a POST request with a JSON body and decode its JSON response.
+
+        Args:
+            url (str)
+            payload (dict[str, Any])
+
+        Returns:
+            (dict[str, Any])
+        """
+        response = self.post(url, json=payload, headers={"Accept": "application/json"})
+        response.raise_for_status()
+        return response.json()
+
+
+class NodeFilter:
+    """Match node names against several glob patterns at once.
+
+    Include and exclude patterns are each compiled once into a single regular expression, so that
+    a single traversal of a product node tree can select files for all patterns.
+
+    Args:
+        patterns (str or list[str] or None): Nodes must match one of these patterns, all nodes
+            match if None is given
+        exclude_patterns (str or list[str] or None): Nodes must not match any of these patterns
+    """
+
+    def __init__(
+        self,
+        patterns: Union[str, Sequence[str], None] = None,
+        exclude_patterns: Union[str, Sequence[str], None] = None,
+    ):
+        self.patterns = [patterns] if isinstance(patterns, str) else list(patterns or [])
+        self.exclude_patterns = (
+            [exclude_patterns]
+            if isinstance(exclude_patterns, str)
+            else list(exclude_patterns or [])
+        )
+        self._include_regex = self._compile(self.patterns)
+        self._exclude_regex = self._compile(self.exclude_patterns)
+
+    @classmethod
+    def from_pattern(
+        cls, pattern: Union[str, Sequence[str], "NodeFilter", None], exclude: bool = False
+    ) -> "NodeFilter":
+        """Create node filter from patterns, or return given node filter as is.
+
+        Args:
+            pattern (str or list[str] or NodeFilter or None)
+            exclude (bool): If set to True, patterns are used as exclude patterns
+
+        Returns:
+            (NodeFilter)
+        """
+        if isinstance(pattern, NodeFilter):
+            return pattern
+        return cls(exclude_patterns=pattern) if exclude else cls(pattern)
+
+    @staticmethod
+    def _compile(patterns: List[str]) -> Optional[re.Pattern]:
+        """Compile glob patterns into a single regex with one named group per pattern."""
+        if not patterns:
+            return None
+        return re.compile(
+            "|".join(
+                f"(?P<p{i}>{fnmatch.translate(pattern)})" for i, pattern in enumerate(patterns)
+            )
+        )
+
+    def match(self, name: str) -> Optional[str]:
+        """Find pattern matched by a node name.
+
+        Args:
+            name (str)
+
+        Returns:
+            pattern (str or None): First matching include pattern, or "*" if there are no include
+                patterns, or None if name doesn't satisfy filter
+        """
+        if self._exclude_regex is not None and self._exclude_regex.match(name):
+            return None
+        if self._include_regex is None:
+            return "*"
+        match = self._include_regex.match(name)
+        return None if match is None else self.patterns[int(match.lastgroup[1:])]
+
+
+def list_nodes(node_url: str, client: CDSEClient) -> List[Dict[str, Any]]:
+    """List the children of a node obtained from a CDSE OData API url.
+
+    Args:
+        node_url (str)
+        client (CDSEClient)
+
+    Returns
+        nodes (list[dict[str, Any]])
+    """
+    return client.get_json(node_url)["result"]
+
+
+def list_file_nodes(
+    node_url: str, client: CDSEClient, max_workers: int = DEFAULT_MAX_WORKERS
+) -> List[Dict[str, Any]]:
+    """List all file nodes of a product node tree obtained from a CDSE OData API url.
+
+    The tree is traversed breadth-first: all directory nodes found at a given depth are listed
+    concurrently, so that the number of sequential requests follows the depth of the tree rather
+    than its size. Nodes are returned in depth-first order, as they appear in the product tree.
+
+    Args:
+        node_url (str)
+        client (CDSEClient)
+        max_workers (int): Maximum number of directory listings performed concurrently
+
+    Returns
+        file_nodes (list[dict[str, Any]])
+    """
+
+    # List node tree level by level, expanding sibling directories concurrently
+    listings = {node_url: list_nodes(node_url, client)}
+    pending_urls = _get_directory_urls(listings[node_url])
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending_urls:
+            responses = executor.map(lambda url: list_nodes(url, client), pending_urls)
+            for url, nodes in zip(pending_urls, responses):
+                listings[url] = nodes
+            pending_urls = [
+                child_url
+                for url in pending_urls
+                for child_url in _get_directory_urls(listings[url])
+            ]
+
+    return list(_walk_listings(listings, node_url))
+
+
+def list_manifest_file_nodes(node_url: str, client: CDSEClient) -> Optional[List[Dict[str, Any]]]:
+    """List all file nodes of a SAFE product from its manifest, obtained from CDSE OData API url.
+
+    The 'manifest.safe' file lists each data object of the product with its relative path, size
+    and checksum, from which file nodes are built, with a single listing request and a single
+    download request whatever the size of the product tree.
+
+    Args:
+        node_url (str): Url of product root nodes
+        client (CDSEClient)
+
+    Returns
+        file_nodes (list[dict[str, Any]] or None): None if product has no usable manifest
+    """
+
+    # Locate SAFE folder, which should be the single root node of the product
+    root_nodes = list_nodes(node_url, client)
+    if len(root_nodes) != 1 or root_nodes[0]["ContentLength"] != 0:
+        return None
+    safe_url = root_nodes[0]["Nodes"]["uri"][:-5]
+
+    # Download and parse manifest
+    response = client.get(f"{safe_url}Nodes(manifest.safe)/$value", authenticated=True)
+    if response.status_code != 200:
+        logger.warning(f"Failed to get product manifest. Status code: {response.status_code}")
+        return None
+    return parse_manifest_file_nodes(response.content, safe_url)
+
+
+def parse_manifest_file_nodes(
+    manifest_content: bytes, safe_url: str
+) -> Optional[List[Dict[str, Any]]]:
+    """Build file nodes from the contents of a SAFE product manifest.
+
+    Nodes have the same structure as nodes obtained from CDSE OData API.
+
+    Args:
+        manifest_content (bytes): Contents of 'manifest.safe' file
+        safe_url (str): Url of the product SAFE folder node, ending with '/'
+
+    Returns
+        file_nodes (list[dict[str, Any]] or None): None if manifest can't be parsed
+    """
+    try:
+        manifest = ET.fromstring(manifest_content)
+    except ET.ParseError as error_msg:
+        logger.warning(f"Failed to parse product manifest: {error_msg}")
+        return None
+
+    file_nodes = []
+    for byte_stream in manifest.iter():
+        if _get_local_tag(byte_stream) != "byteStream":
+            continue
+        try:
+            file_nodes.append(_get_byte_stream_node(byte_stream, safe_url))
+        except (StopIteration, TypeError, ValueError, AttributeError) as error_msg:
+            logger.warning(f"Unexpected byte stream in product manifest: {error_msg!r}")
+            return None
+
+    return file_nodes
+
+
+def _get_byte_stream_node(byte_stream: ET.Element, safe_url: str) -> Dict[str, Any]:
+    """Build a file node from a 'byteStream' element of a SAFE product manifest."""
+    file_location = next(e for e in byte_stream if _get_local_tag(e) == "fileLocation")
+    path = file_location.get("href").removeprefix("./").split("/")
+    node = {
+        "Name": path[-1],
+        "ContentLength": int(byte_stream.get("size")),
+        "Nodes": {"uri": safe_url + "".join(f"Nodes({part})/" for part in path) + "Nodes"},
+    }
+    checksums = [e for e in byte_stream if _get_local_tag(e) == "checksum"]
+    if checksums:
+        node["Checksum"] = [
+            {"Algorithm": e.get("checksumName"), "Value": e.text.strip()} for e in checksums
+        ]
+    return node
+
+
+def _get_local_tag(element: ET.Element) -> str:
+    """Get tag of XML element without its namespace."""
+    return element.tag.rsplit("}", 1)[-1]
+
+
+def search_nodes(
+    node_url: str,
+    pattern: Union[str, Sequence[str], NodeFilter, None],
+    exclude: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    client: Optional[CDSEClient] = None,
+    cache: Optional[NodeCache] = None,
+    cache_key: Optional[str] = None,
+    strategy: str = "traversal",
+) -> List[Dict[str, Any]]:
     """Search for a given pattern in product node tree obtained from a CDSE OData API url.
 
     Args:
         node_url (str)
-        pattern (str)
+        pattern (str or list[str] or NodeFilter or None): Glob pattern, or list of glob patterns
+            of which nodes should match any, or node filter
         exclude (bool): If set to False, return only nodes that match pattern, if set to True,
-            return only nodes that do not match pattern
+            return only nodes that do not match pattern, ignored for node filters
+        max_workers (int): Maximum number of directory listings performed concurrently
+        client (CDSEClient or None): Client used for listing requests, a new one is created if
+            None is given
+        cache (NodeCache or None): Cache of product node trees, looked up before any request
+        cache_key (str or None): Key of product node tree in cache, node_url is used if None is
+            given
+        strategy (str): Either "traversal" to list all product tree directories, or "manifest" to
+            read file nodes from the product SAFE manifest, which falls back to traversal if the
+            product has no manifest
 
     Returns
         output_nodes (list[dict[str, Any]])
     """
-    input_nodes = json.loads(requests.get(node_url).text)["result"]
-    output_nodes = []
-    for node in input_nodes:
+    if strategy not in NODE_STRATEGIES:
+        raise ValueError(f"Unknown node strategy '{strategy}', expected one of {NODE_STRATEGIES}")
+
+    cache_key = node_url if cache_key is None else cache_key
+    file_nodes = None if cache is None else cache.get(cache_key)
+
+    if file_nodes is None:
+        if client is None:
+            with CDSEClient() as client:
+                return search_nodes(
+                    node_url, pattern, exclude, max_workers, client, cache, cache_key, strategy
+                )
+        if strategy == "manifest":
+            file_nodes = list_manifest_file_nodes(node_url, client)
+            if file_nodes is None:
+                logger.info("Falling back to traversal of product node tree")
+        if file_nodes is None:
+            file_nodes = list_file_nodes(node_url, client, max_workers)
+        if cache is not None:
+            cache.set(cache_key, file_nodes)
+
+    # Keep only file nodes that satisfy pattern, in the order of the product tree
+    node_filter = NodeFilter.from_pattern(pattern, exclude)
+    return [node for node in file_nodes if node_filter.match(node["Name"]) is not None]
+
+
+def _get_directory_urls(nodes: List[Dict[str, Any]]) -> List[str]:
+    """Get children listing urls of directory nodes, which have a content length of 0."""
+    return [node["Nodes"]["uri"] for node in nodes if node["ContentLength"] == 0]
+
+
+def get_node_path(node: Dict[str, Any]) -> Path:
+    """Get path of a file node relative to the product root, reproducing the product tree.
+
+    The path is read from the node uri, in which each ancestor of the node appears as a
+    'Nodes(<name>)' segment, for nodes obtained from both the product tree and its manifest.
+
+    Args:
+        node (dict[str, Any]): File node obtained from CDSE OData API or product manifest
+
+    Returns:
+        (Path): Relative path, reduced to the node name if the uri doesn't hold the node path
+    """
+    parts = re.findall(r"Nodes\(([^/]*)\)", node["Nodes"]["uri"])
+    if not parts or parts[-1] != node["Name"] or any(part in ("", ".", "..") for part in parts):
+        return Path(node["Name"])
+    return Path(*parts)
 
-        # If this node is a dir, call 'search_nodes' recursively
-        if node["ContentLength"] == 0:
-            output_nodes.extend(search_nodes(node["Nodes"]["uri"], pattern))
 
-        # If this node is a file, check for pattern match and optionally append to results
+def _walk_listings(
+    listings: Dict[str, List[Dict[str, Any]]], node_url: str
+) -> Iterator[Dict[str, Any]]:
+    """Yield file nodes of a listed node tree in depth-first order."""
+    for node in listings[node_url]:
+        if node["ContentLength"] == 0:
+            yield from _walk_listings(listings, node["Nodes"]["uri"])
         elif node["ContentLength"] >= 0:
-            match = fnmatch.fnmatch(node["Name"], pattern)
-            if match and not exclude or exclude and not match:
-                output_nodes.append(node)
+            yield node
 
-    return output_nodes
 
+class PartialDownload:
+    """Local files of a file node being downloaded, shared by the download engines.
 
-def odata_download_with_nodefilter(
+    Bytes are written into a '.part' file next to the output file, which is checked against the
+    node checksum if any and renamed once complete. Byte ranges written by segmented downloads
+    are listed in a '.segments' file next to it, so that interrupted downloads are resumed.
+
+    Engines send requests and pass received bytes to this class, whose methods only do local file
+    I/O and may therefore block.
+
+    Args:
+        node (dict[str, Any]): File node obtained from CDSE OData API
+        output_file (Path)
+    """
+
+    def __init__(self, node: Dict[str, Any], output_file: Path):
+        self.output_file = output_file
+        self.expected_size = node["ContentLength"]
+        self.url = f"{node['Nodes']['uri'][:-5]}$value"
+        self.part_file = output_file.with_name(f"{output_file.name}.part")
+        self.segments_file = self.part_file.with_suffix(".segments")
+        self.algorithm, self.expected_checksum = get_node_checksum(node)
+        self._hasher: Any = None
+        self._hashed_size = 0
+        self._file_descriptor: Optional[int] = None
+        self._segments_lock = threading.Lock()
+
+    def is_downloaded(self) -> bool:
+        """Check if output file was already downloaded.
+
+        Returns:
+            (bool)
+        """
+        if self.output_file.exists() and self.output_file.stat().st_size == self.expected_size:
+            logger.info(f"File already downloaded: {self.output_file.name}")
+            return True
+        return False
+
+    def get_headers(self, start: int = 0, end: Optional[int] = None) -> Dict[str, str]:
+        """Get headers of a request for bytes from start to end included, or to the end of file.
+
+        Args:
+            start (int)
+            end (int or None)
+
+        Returns:
+            (dict[str, str])
+        """
+        # Request file contents as is, compression of JP2 files doesn't reduce their size
+        headers = {"Accept-Encoding": "identity"}
+        if start > 0 or end is not None:
+            headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+        return headers
+
+    def get_offset(self) -> int:
+        """Get offset from which a sequential download resumes, from the partial file if any.
+
+        Bytes already in the partial file are hashed, following bytes are hashed as they are
+        written.
+
+        Returns:
+            (int)
+        """
+        _truncate_segmented_part_file(self.part_file, self.expected_size)
+        offset = self.part_file.stat().st_size if self.part_file.exists() else 0
+        if offset > self.expected_size:
+            self.part_file.unlink()
+            offset = 0
+        if self.algorithm is not None and (self._hasher is None or self._hashed_size != offset):
+            self._hasher = (
+                _hash_file(self.part_file, self.algorithm)
+                if offset > 0
+                else hashlib.new(self.algorithm)
+            )
+            self._hashed_size = offset
+        if 0 < offset < self.expected_size:
+            logger.info(f"Resuming download of {self.output_file.name} from byte {offset}")
+        return offset
+
+    def open(self, status: int) -> BinaryIO:
+        """Open partial file to append a range response, or to overwrite it with a full response.
+
+        Args:
+            status (int): HTTP status of the response
+
+        Returns:
+            (BinaryIO)
+        """
+        mode = "ab" if status == 206 else "wb"
+        if mode == "wb" and self._hasher is not None:
+            self._hasher, self._hashed_size = hashlib.new(self.algorithm), 0
+        return open(self.part_file, mode)
+
+    def write(self, file: BinaryIO, chunk: bytes) -> None:
+        """Append bytes of a sequential download to the opened partial file.
+
+        Args:
+            file (BinaryIO): Obtained from 'open'
+            chunk (bytes)
+        """
+        file.write(chunk)
+        if self._hasher is not None:
+            self._hasher.update(chunk)
+            self._hashed_size += len(chunk)
+
+    def finish(self, attempt: int, max_attempts: int) -> bool:
+        """Rename partial file once complete, discarding it if its checksum doesn't match.
+
+        Args:
+            attempt (int): Number of the sequential download attempt, for logging
+            max_attempts (int)
+
+        Returns:
+            (bool): True if output file was written
+        """
+        size = self.part_file.stat().st_size
+        if size != self.expected_size:
+            logger.warning(
+                f"Incomplete download ({attempt}/{max_attempts}): "
+                f"{size} / {self.expected_size} bytes"
+            )
+            return False
+        if self._hasher is not None and self._hasher.hexdigest() != self.expected_checksum:
+            logger.warning(
+                f"Checksum mismatch ({attempt}/{max_attempts}) for {self.output_file.name}, "
+                f"discarding downloaded file"
+            )
+            self.part_file.unlink()
+            return False
+        os.replace(self.part_file, self.output_file)
+        return True
+
+    def start_segments(self, segment_size: int) -> List[Tuple[int, int]]:
+        """Preallocate partial file of a segmented download, and get byte ranges missing from it.
+
+        A partial file left by a sequential download is kept as its first downloaded range.
+
+        Args:
+            segment_size (int): Size of byte ranges, in bytes
+
+        Returns:
+            (list[(int, int)]): Inclusive byte ranges
+        """
+        downloaded_ranges = _read_downloaded_ranges(self.part_file, self.expected_size)
+        ranges = _get_missing_ranges(downloaded_ranges, self.expected_size, segment_size)
+        name = self.output_file.name
+        if downloaded_ranges:
+            logger.info(f"Resuming download of {name}, {len(ranges)} segments missing")
+        else:
+            logger.info(f"Downloading {name} in {len(ranges)} segments")
+
+        # List downloaded ranges first, as preallocated partial file then holds unwritten bytes
+        self.segments_file.write_text(
+            "".join(f"{start}-{end}\n" for start, end in downloaded_ranges)
+        )
+        self._file_descriptor = os.open(self.part_file, os.O_RDWR | os.O_CREAT, 0o644)
+        os.ftruncate(self._file_descriptor, self.expected_size)
+        return ranges
+
+    def write_at(self, chunk: bytes, position: int) -> None:
+        """Write bytes of a segmented download in place into the partial file.
+
+        Args:
+            chunk (bytes)
+            position (int): Offset of chunk in file
+        """
+        os.pwrite(self._file_descriptor, chunk, position)
+
+    def add_segment(self, byte_range: Tuple[int, int]) -> None:
+        """List a completely written byte range of a segmented download.
+
+        Args:
+            byte_range ((int, int)): Inclusive byte range
+        """
+        with self._segments_lock, open(self.segments_file, "a") as file:
+            file.write(f"{byte_range[0]}-{byte_range[1]}\n")
+
+    def close(self) -> None:
+        """Close partial file of a segmented download, if open."""
+        if self._file_descriptor is not None:
+            os.close(self._file_descriptor)
+            self._file_descriptor = None
+
+    def finish_segments(self, results: Sequence[Optional[bool]]) -> Optional[bool]:
+        """Check and rename partial file of a segmented download once all ranges are written.
+
+        Byte ranges are written out of order, so checksum is only computed once file is complete.
+
+        Args:
+            results (list[bool or None]): Results of range downloads, None meaning that server
+                ignored the range request
+
+        Returns:
+            (bool or None): True if output file was written, None if the file should be
+                downloaded sequentially instead
+        """
+        self.close()
+        if None in results:
+            logger.warning(
+                f"Range requests ignored, downloading {self.output_file.name} sequentially"
+            )
+            self.part_file.unlink()
+            self.segments_file.unlink()
+            return None
+        if not all(results):
+            logger.error(f"Failed to download {self.output_file.name} in segments")
+            return False
+        hasher = None if self.algorithm is None else _hash_file(self.part_file, self.algorithm)
+        if hasher is not None and hasher.hexdigest() != self.expected_checksum:
+            logger.error(
+                f"Checksum mismatch for {self.output_file.name}, discarding downloaded file"
+            )
+            self.part_file.unlink()
+            self.segments_file.unlink()
+            return False
+        os.replace(self.part_file, self.output_file)
+        self.segments_file.unlink()
+        return True
+
+
+def download_node(
+    node: Dict[str, Any],
+    output_file: Path,
+    client: CDSEClient,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+) -> bool:
+    """Download a file node, resuming interrupted transfers using HTTP range requests.
+
+    The file is streamed into a '.part' file next to the output file, which is renamed once its
+    size matches the node content length. After a failure, the next attempt only requests the
+    bytes missing from the '.part' file.
+
+    If the node advertises a checksum, it is computed while bytes are streamed, and a mismatching
+    file is discarded so that the next attempt downloads it again from scratch.
+
+    Args:
+        node (dict[str, Any]): File node obtained from CDSE OData API
+        output_file (Path)
+        client (CDSEClient)
+        max_attempts (int)
+
+    Returns:
+        (bool): True if file was downloaded
+    """
+    download = PartialDownload(node, output_file)
+    if download.is_downloaded():
+        return True
+
+    for attempt in range(1, max_attempts + 1):
+
+        # Resume from the end of partially downloaded file, if any
+        offset = download.get_offset()
+        if offset < download.expected_size:
+            try:
+                with client.governor.transfer():
+                    response = client.get(
+                        download.url,
+                        authenticated=True,
+                        stream=True,
+                        headers=download.get_headers(offset),
+                    )
+                    try:
+
+                        # Append to partial file, or overwrite it if server ignored range request
+                        if response.status_code not in (200, 206):
+                            logger.error(
+                                f"Failed to download file. Status code: {response.status_code}"
+                            )
+                            logger.error(response.text)
+                            return False
+                        with download.open(response.status_code) as file:
+                            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                                if chunk:
+                                    client.governor.consume(len(chunk))
+                                    download.write(file, chunk)
+                    finally:
+                        response.close()
+
+            except requests.exceptions.RequestException as error_msg:
+                logger.warning(f"Download interrupted ({attempt}/{max_attempts}): {error_msg}")
+                continue
+
+        # Check partial file once complete, and rename it or discard it
+        if download.finish(attempt, max_attempts):
+            return True
+
+    logger.error(f"Failed to download {output_file.name} after {max_attempts} attempts")
+    return False
+
+
+def get_node_checksum(node: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """Get first checksum advertised by a node that can be computed with hashlib.
+
+    Args:
+        node (dict[str, Any]): File node obtained from CDSE OData API or product manifest
+
+    Returns:
+        algorithm (str or None): Lowercase hashlib algorithm name
+        checksum (str or None): Lowercase hexadecimal checksum
+    """
+    for checksum in node.get("Checksum", []):
+        algorithm = checksum.get("Algorithm", "").lower()
+        if algorithm in hashlib.algorithms_available and checksum.get("Value"):
+            return algorithm, checksum["Value"].lower()
+    return None, None
+
+
+def _hash_file(path: Path, algorithm: str) -> Any:
+    """Compute hash of a local file, reading it by chunks."""
+    hasher = hashlib.new(algorithm)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher
+
+
+def download_node_segmented(
+    node: Dict[str, Any],
+    output_file: Path,
+    client: CDSEClient,
+    segments: int = DEFAULT_SEGMENTS,
+    segment_size: int = DEFAULT_SEGMENT_SIZE,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+) -> bool:
+    """Download a file node through several concurrent connections using HTTP range requests.
+
+    The file is split into byte ranges of segment_size, which are downloaded concurrently and
+    written in place into a '.part' file preallocated to the node content length, so that no
+    reassembly copy is needed. Each range is resumed from its last written byte after a failure.
+    If the node advertises a checksum, it is checked once all ranges are downloaded.
+
+    Downloaded ranges are listed in a '.segments' file next to the '.part' file, so that a later
+    call only downloads missing ranges. A '.part' file left by a sequential download is kept as
+    its first downloaded range. If the server ignores range requests, the file is downloaded
+    sequentially instead.
+
+    Args:
+        node (dict[str, Any]): File node obtained from CDSE OData API
+        output_file (Path)
+        client (CDSEClient): Its connection pool should hold at least 'segments' connections
+        segments (int): Number of concurrent connections
+        segment_size (int): Size of downloaded byte ranges, in bytes
+        max_attempts (int): Maximum number of attempts to download each byte range
+
+    Returns:
+        (bool): True if file was downloaded
+    """
+    download = PartialDownload(node, output_file)
+    if download.is_downloaded():
+        return True
+
+    def download_segment(byte_range: Tuple[int, int]) -> Optional[bool]:
+        success = _download_range(client, download, byte_range, max_attempts)
+        if success:
+            download.add_segment(byte_range)
+        return success
+
+    # Preallocate partial file and download missing byte ranges into it
+    try:
+        ranges = download.start_segments(segment_size)
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            results = list(executor.map(download_segment, ranges))
+    finally:
+        download.close()
+
+    success = download.finish_segments(results)
+    if success is None:
+        return download_node(node, output_file, client, max_attempts)
+    return success
+
+
+def _read_downloaded_ranges(part_file: Path, expected_size: int) -> List[Tuple[int, int]]:
+    """Get sorted inclusive byte ranges already written into a partial file.
+
+    Ranges written by a segmented download are listed in its '.segments' file, one 'start-end'
+    line per range, where an unterminated last line is ignored. Without such file, the partial
+    file was written sequentially, and all its bytes are kept.
+    """
+    segments_file = part_file.with_suffix(".segments")
+    if segments_file.exists() and part_file.exists():
+        ranges = re.findall(r"(\d+)-(\d+)\n", segments_file.read_text())
+        return sorted((int(start), int(end)) for start, end in ranges)
+    size = part_file.stat().st_size if part_file.exists() and not segments_file.exists() else 0
+    return [(0, size - 1)] if 0 < size <= expected_size else []
+
+
+def _get_missing_ranges(
+    downloaded_ranges: List[Tuple[int, int]], size: int, segment_size: int
+) -> List[Tuple[int, int]]:
+    """Split bytes of a file missing from sorted downloaded ranges into ranges of segment_size."""
+    ranges, position = [], 0
+    for start, end in downloaded_ranges + [(size, size)]:
+        for range_start in range(position, min(start, size), segment_size):
+            ranges.append((range_start, min(range_start + segment_size, start, size) - 1))
+        position = max(position, end + 1)
+    return ranges
+
+
+def _truncate_segmented_part_file(part_file: Path, expected_size: int) -> None:
+    """Reduce a partial file written in segments to its leading downloaded bytes, if any."""
+    segments_file = part_file.with_suffix(".segments")
+    if not segments_file.exists():
+        return
+    size = 0
+    for start, end in _read_downloaded_ranges(part_file, expected_size):
+        if start > size:
+            break
+        size = max(size, end + 1)
+    if part_file.exists():
+        os.truncate(part_file, size)
+    segments_file.unlink()
+
+
+def _download_range(
+    client: CDSEClient,
+    download: PartialDownload,
+    byte_range: Tuple[int, int],
+    max_attempts: int,
+) -> Optional[bool]:
+    """Download an inclusive byte range of a file and write it in place into its partial file.
+
+    Returns True if range was downloaded, and None if server ignored the range request.
+    """
+    position, end = byte_range
+    for attempt in range(1, max_attempts + 1):
+        try:
+            with client.governor.transfer():
+                response = client.get(
+                    download.url,
+                    authenticated=True,
+                    stream=True,
+                    headers=download.get_headers(position, end),
+                )
+                try:
+                    if response.status_code == 200:
+                        return None
+                    if response.status_code != 206:
+                        logger.error(
+                            f"Failed to download range. Status code: {response.status_code}"
+                        )
+                        return False
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        if chunk:
+                            client.governor.consume(len(chunk))
+                            download.write_at(chunk, position)
+                            position += len(chunk)
+                finally:
+                    response.close()
+        except requests.exceptions.RequestException as error_msg:
+            logger.warning(f"Range download interrupted ({attempt}/{max_attempts}): {error_msg}")
+        if position > end:
+            return True
+    return False
+
+
+def write_remote_vrt(url: str, vrt_file: Path, headers: Optional[Dict[str, str]] = None) -> Path:
+    """Write a VRT file referencing a remote raster through GDAL's /vsicurl/ virtual filesystem.
+
+    Only the remote raster header is read here. Reading windows of the VRT file then only fetches
+    the parts of the remote file covering these windows, using HTTP range requests.
+
+    Args:
+        url (str)
+        vrt_file (Path)
+        headers (dict[str, str] or None): Headers sent with each request, such as authorization,
+            written to a '.headers' file next to the VRT file readable only by the current user
+
+    Returns:
+        vrt_file (Path)
+    """
+    vrt_file.parent.mkdir(exist_ok=True, parents=True)
+
+    # Skip listing of remote directory and lookup of sidecar files, which don't exist on CDSE
+    options = "empty_dir=yes"
+    if headers:
+        header_file = vrt_file.with_suffix(".headers")
+        _write_private_file(header_file, "".join(f"{k}: {v}\n" for k, v in headers.items()))
+        options += f"&header_file={quote(str(header_file), safe='')}"
+
+    rasterio.shutil.copy(f"/vsicurl?{options}&url={quote(url, safe='')}", vrt_file, driver="VRT")
+    return vrt_file
+
+
+def odata_vrt_with_nodefilter(
     feature_id: str,
     output_path: Path,
     username: str,
     password: str,
-    nodefilter_pattern: Union[str, None] = None,
+    nodefilter_pattern: Union[str, Sequence[str], NodeFilter, None] = None,
     exclude: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    client: Optional[CDSEClient] = None,
+    node_cache: Optional[NodeCache] = None,
+    node_strategy: str = "traversal",
 ) -> Union[str, None]:
-    """Download files from CDSE using OData API with node filtering pattern.
+    """Write VRT files reading CDSE product files remotely, using OData API with node filtering.
+
+    Instead of downloading matching files, write a VRT file per matching file, that reads it
+    through HTTP range requests authenticated with the current access token. VRT files should
+    therefore be read before this token expires.
 
     Args:
         feature_id (str): Product features ID, typically obtained from CDSE OpenSearch API for
             example through CDSETool
-        output_path (Path)
+        output_path (Path): Folder where the product tree is reproduced, starting with its SAFE
+            folder
         username (str)
         password (str)
-        nodefilter_pattern (str)
+        nodefilter_pattern (str or list[str] or NodeFilter or None): Glob pattern, or list of
+            glob patterns, or node filter, see 'search_nodes'
         exclude (bool): If set to False, return only nodes that match pattern, if set to True,
             return only nodes that do not match pattern
+        max_workers (int): Maximum number of directory listings performed concurrently
+        client (CDSEClient or None): Client used for all requests, a new one is created from
+            username and password if None is given
+        node_cache (NodeCache or None): Cache of product node trees, keyed by feature ID
+        node_strategy (str): Either "traversal" or "manifest", see 'search_nodes'
 
     Returns:
         feature_id (str)
     """
-    output_path.mkdir(exist_ok=True, parents=True)
+    if client is None:
+        with CDSEClient(username, password) as client:
+            return odata_vrt_with_nodefilter(
+                feature_id,
+                output_path,
+                username,
+                password,
+                nodefilter_pattern,
+                exclude,
+                max_workers,
+                client,
+                node_cache,
+                node_strategy,
+            )
+
     url = f"https://download.dataspace.copernicus.eu/odata/v1/Products({feature_id})/Nodes"
-    nodes = search_nodes(url, nodefilter_pattern, exclude)
+    nodes = search_nodes(
+        url,
+        nodefilter_pattern,
+        exclude,
+        max_workers,
+        client,
+        node_cache,
+        feature_id,
+        node_strategy,
+    )
 
+    headers = {"Authorization": f"Bearer {client.token_manager.get_token()}"}
     for node in nodes:
+        write_remote_vrt(
+            f"{node['Nodes']['uri'][:-5]}$value",
+            output_path / get_node_path(node).with_suffix(".vrt"),
+            headers,
+        )
+
+    return feature_id
+
+
+def odata_download_with_nodefilter(
+    feature_id: str,
+    output_path: Path,
+    username: str,
+    password: str,
+    nodefilter_pattern: Union[str, Sequence[str], NodeFilter, None] = None,
+    exclude: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    client: Optional[CDSEClient] = None,
+    node_cache: Optional[NodeCache] = None,
+    node_strategy: str = "traversal",
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    segments: int = DEFAULT_SEGMENTS,
+    segment_size: int = DEFAULT_SEGMENT_SIZE,
+) -> Union[str, None]:
+    """Download files from CDSE using OData API with node filtering pattern.
+
+    Args:
+        feature_id (str): Product features ID, typically obtained from CDSE OpenSearch API for
+            example through CDSETool
+        output_path (Path): Folder where the product tree is reproduced, starting with its SAFE
+            folder
+        username (str)
+        password (str)
+        nodefilter_pattern (str or list[str] or NodeFilter or None): Glob pattern, or list of
+            glob patterns, or node filter, see 'search_nodes'
+        exclude (bool): If set to False, return only nodes that match pattern, if set to True,
+            return only nodes that do not match pattern
+        max_workers (int): Maximum number of directory listings performed concurrently
+        client (CDSEClient or None): Client used for all requests, a new one is created from
+            username and password if None is given
+        node_cache (NodeCache or None): Cache of product node trees, keyed by feature ID
+        node_strategy (str): Either "traversal" or "manifest", see 'search_nodes'
+        max_attempts (int): Maximum number of attempts to download each file
+        segments (int): If greater than 1, download files larger than segment_size through this
+            number of concurrent connections
+        segment_size (int): Size of byte ranges downloaded in segmented mode, in bytes
 
-        # Authenticate to CDSE using CDSETool
-        session = Credentials(username, password).get_session()
+    Returns:
+        feature_id (str or None): None if any file couldn't be downloaded
+    """
+    if client is None:
+        with CDSEClient(username, password) as client:
+            return odata_download_with_nodefilter(
+                feature_id,
+                output_path,
+                username,
+                password,
+                nodefilter_pattern,
+                exclude,
+                max_workers,
+                client,
+                node_cache,
+                node_strategy,
+                max_attempts,
+                segments,
+                segment_size,
+            )
 
-        url = f"{node['Nodes']['uri'][:-5]}$value"
-        response = session.get(url, stream=True)
+    output_path.mkdir(exist_ok=True, parents=True)
+    url = f"https://download.dataspace.copernicus.eu/odata/v1/Products({feature_id})/Nodes"
+    nodes = search_nodes(
+        url,
+        nodefilter_pattern,
+        exclude,
+        max_workers,
+        client,
+        node_cache,
+        feature_id,
+        node_strategy,
+    )
 
-        # Download file if request was successful
-        if response.status_code == 200:
-            with open(
-                output_path / node["Name"], "wb"  # TODO: Reproduce directories tree structure
-            ) as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        file.write(chunk)
+    success = True
+    for node in nodes:
+        output_file = output_path / get_node_path(node)
+        output_file.parent.mkdir(exist_ok=True, parents=True)
+        if segments > 1 and node["ContentLength"] > segment_size:
+            success &= download_node_segmented(
+                node, output_file, client, segments, segment_size, max_attempts
+            )
         else:
-            logger.error(f"Failed to download file. Status code: {response.status_code}")
-            logger.error(response.text)
+            success &= download_node(node, output_file, client, max_attempts)
 
-    return feature_id
+    return feature_id if success else None
@@ -0,0 +1,508 @@
+"""Download products from CDSE using OData API with node filtering, on an asyncio event loop.
+
+Counterpart of the 'cdse' module, where listing requests, token handling and file transfers
+of a product are all interleaved on a single event loop instead of threads.
+"""
+
+# standard library
+import asyncio
+import contextlib
+import logging
+from pathlib import Path
+from typing import Any
+from typing import AsyncIterator
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+# third party
+import aiohttp
+
+# current project
+from s2coastalbot.cache import NodeCache
+from s2coastalbot.cdse import DEFAULT_MAX_ATTEMPTS
+from s2coastalbot.cdse import DEFAULT_MAX_WORKERS
+from s2coastalbot.cdse import DEFAULT_POOL_MAXSIZE
+from s2coastalbot.cdse import DEFAULT_SEGMENT_SIZE
+from s2coastalbot.cdse import DEFAULT_SEGMENTS
+from s2coastalbot.cdse import DEFAULT_TIMEOUT
+from s2coastalbot.cdse import DOWNLOAD_CHUNK_SIZE
+from s2coastalbot.cdse import NODE_STRATEGIES
+from s2coastalbot.cdse import NodeFilter
+from s2coastalbot.cdse import PartialDownload
+from s2coastalbot.cdse import TokenManager
+from s2coastalbot.cdse import get_node_path
+from s2coastalbot.cdse import parse_manifest_file_nodes
+from s2coastalbot.governor import THROTTLING_STATUSES
+from s2coastalbot.governor import Governor
+from s2coastalbot.governor import get_governor
+from s2coastalbot.governor import parse_retry_after
+
+logger = logging.getLogger()
+
+
+class AsyncCDSEClient:
+    """Asynchronous HTTP client sharing one keep-alive connection pool for all CDSE requests.
+
+    The underlying session is opened when entering the client as an async context manager.
+
+    Args:
+        username (str or None): Only required for authenticated requests
+        password (str or None): Only required for authenticated requests
+        pool_maxsize (int): Maximum number of simultaneous connections
+        timeout (float or (float, float)): Connect and read timeouts, in seconds
+        token_cache_file (Path or None): File where access tokens are cached between runs
+        governor (Governor or None): Limits applied to requests, the process-wide governor is
+            used if None is given
+    """
+
+    def __init__(
+        self,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT,
+        token_cache_file: Optional[Path] = None,
+        governor: Optional[Governor] = None,
+    ):
+        self.pool_maxsize = pool_maxsize
+        self.governor = get_governor() if governor is None else governor
+        self.timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        self.token_manager = TokenManager(username, password, token_cache_file)
+        self.session = None
+
+    async def __aenter__(self) -> "AsyncCDSEClient":
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_maxsize),
+            timeout=aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1]),
+            headers={"Accept-Encoding": "gzip, deflate"},
+        )
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.session.close()
+        self.token_manager.session.close()
+
+    async def get_auth_headers(self) -> Dict[str, str]:
+        """Get authorization header, with an access token that is only renewed when expired.
+
+        Returns:
+            (dict[str, str])
+        """
+        # Token exchanges are rare and serialized by the token manager, run them in a thread
+        token = await asyncio.to_thread(self.token_manager.get_token)
+        return {"Authorization": f"Bearer {token}"}
+
+    @contextlib.asynccontextmanager
+    async def get(
+        self, url: str, authenticated: bool = False, headers: Optional[Dict[str, str]] = None
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """Send a GET request through the shared session, within limits of the governor.
+
+        Throttling responses are retried after the delay given in their 'Retry-After' header,
+        which also delays all other requests going through the same governor.
+
+        Args:
+            url (str)
+            authenticated (bool): If set to True, add CDSE authorization header to the request
+            headers (dict[str, str] or None)
+
+        Yields:
+            response (aiohttp.ClientResponse)
+        """
+        headers = {} if headers is None else headers
+        for attempt in range(1, DEFAULT_MAX_ATTEMPTS + 1):
+            if authenticated:
+                headers = {**headers, **await self.get_auth_headers()}
+            await self.governor.async_acquire_request()
+            async with self.session.get(url, headers=headers) as response:
+                if response.status not in THROTTLING_STATUSES or attempt == DEFAULT_MAX_ATTEMPTS:
+                    yield response
+                    return
+                delay = parse_retry_after(response.headers.get("Retry-After"))
+                delay = 2.0**attempt if delay is None else delay
+                logger.warning(
+                    f"Throttled by CDSE (status {response.status}), retrying in {delay}s"
+                )
+            self.governor.pause(delay)
+
+    async def get_json(self, url: str) -> Dict[str, Any]:
+        """Send a GET request and decode its JSON response.
+
+        Args:
+            url (str)
+
+        Returns:
+            (dict[str, Any])
+        """
+        async with self.get(url, headers={"Accept": "application/json"}) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+
+async def async_list_file_nodes(
+    node_url: str, client: AsyncCDSEClient, max_workers: int = DEFAULT_MAX_WORKERS
+) -> List[Dict[str, Any]]:
+    """List all file nodes of a product node tree obtained from a CDSE OData API url.
+
+    Sibling directories are listed concurrently, with at most max_workers listings at a time.
+    Nodes are returned in depth-first order, as they appear in the product tree.
+
+    Args:
+        node_url (str)
+        client (AsyncCDSEClient)
+        max_workers (int): Maximum number of directory listings performed concurrently
+
+    Returns
+        file_nodes (list[dict[str, Any]])
+    """
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def list_tree(url: str) -> List[Dict[str, Any]]:
+        async with semaphore:
+            nodes = (await client.get_json(url))["result"]
+        subtrees = await asyncio.gather(
+            *(list_tree(node["Nodes"]["uri"]) for node in nodes if node["ContentLength"] == 0)
+        )
+        subtrees = iter(subtrees)
+        file_nodes = []
+        for node in nodes:
+            if node["ContentLength"] == 0:
+                file_nodes.extend(next(subtrees))
+            elif node["ContentLength"] >= 0:
+                file_nodes.append(node)
+        return file_nodes
+
+    return await list_tree(node_url)
+
+
+async def async_list_manifest_file_nodes(
+    node_url: str, client: AsyncCDSEClient
+) -> Optional[List[Dict[str, Any]]]:
+    """List all file nodes of a SAFE product from its manifest, see 'list_manifest_file_nodes'.
+
+    Args:
+        node_url (str): Url of product root nodes
+        client (AsyncCDSEClient)
+
+    Returns
+        file_nodes (list[dict[str, Any]] or None): None if product has no usable manifest
+    """
+    root_nodes = (await client.get_json(node_url))["result"]
+    if len(root_nodes) != 1 or root_nodes[0]["ContentLength"] != 0:
+        return None
+    safe_url = root_nodes[0]["Nodes"]["uri"][:-5]
+
+    async with client.get(f"{safe_url}Nodes(manifest.safe)/$value", authenticated=True) as response:
+        if response.status != 200:
+            logger.warning(f"Failed to get product manifest. Status code: {response.status}")
+            return None
+        manifest_content = await response.read()
+    return parse_manifest_file_nodes(manifest_content, safe_url)
+
+
+async def async_search_nodes(
+    node_url: str,
+    pattern: Union[str, Sequence[str], NodeFilter, None],
+    exclude: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    client: Optional[AsyncCDSEClient] = None,
+    cache: Optional[NodeCache] = None,
+    cache_key: Optional[str] = None,
+    strategy: str = "traversal",
+) -> List[Dict[str, Any]]:
+    """Search for a given pattern in product node tree, see 'search_nodes'.
+
+    Args:
+        node_url (str)
+        pattern (str or list[str] or NodeFilter or None)
+        exclude (bool)
+        max_workers (int): Maximum number of directory listings performed concurrently
+        client (AsyncCDSEClient or None): Opened client, a new one is created if None is given
+        cache (NodeCache or None): Cache of product node trees, looked up before any request
+        cache_key (str or None): Key of product node tree in cache, node_url is used if None is
+            given
+        strategy (str): Either "traversal" or "manifest"
+
+    Returns
+        output_nodes (list[dict[str, Any]])
+    """
+    if strategy not in NODE_STRATEGIES:
+        raise ValueError(f"Unknown node strategy '{strategy}', expected one of {NODE_STRATEGIES}")
+
+    cache_key = node_url if cache_key is None else cache_key
+    file_nodes = None if cache is None else cache.get(cache_key)
+
+    if file_nodes is None:
+        if client is None:
+            async with AsyncCDSEClient() as client:
+                return await async_search_nodes(
+                    node_url, pattern, exclude, max_workers, client, cache, cache_key, strategy
+                )
+        if strategy == "manifest":
+            file_nodes = await async_list_manifest_file_nodes(node_url, client)
+            if file_nodes is None:
+                logger.info("Falling back to traversal of product node tree")
+        if file_nodes is None:
+            file_nodes = await async_list_file_nodes(node_url, client, max_workers)
+        if cache is not None:
+            cache.set(cache_key, file_nodes)
+
+    node_filter = NodeFilter.from_pattern(pattern, exclude)
+    return [node for node in file_nodes if node_filter.match(node["Name"]) is not None]
+
+
+async def async_download_node(
+    node: Dict[str, Any],
+    output_file: Path,
+    client: AsyncCDSEClient,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+) -> bool:
+    """Download a file node, resuming interrupted transfers, see 'download_node'.
+
+    Local file I/O, including hashing of resumed partial files, runs in worker threads.
+
+    Args:
+        node (dict[str, Any]): File node obtained from CDSE OData API
+        output_file (Path)
+        client (AsyncCDSEClient)
+        max_attempts (int)
+
+    Returns:
+        (bool): True if file was downloaded
+    """
+    download = PartialDownload(node, output_file)
+    if download.is_downloaded():
+        return True
+
+    for attempt in range(1, max_attempts + 1):
+
+        # Resume from the end of partially downloaded file, if any
+        offset = await asyncio.to_thread(download.get_offset)
+        if offset < download.expected_size:
+            try:
+                async with client.governor.async_transfer(), client.get(
+                    download.url, authenticated=True, headers=download.get_headers(offset)
+                ) as response:
+                    if response.status not in (200, 206):
+                        logger.error(f"Failed to download file. Status code: {response.status}")
+                        logger.error(await response.text())
+                        return False
+
+                    # Append to partial file, or overwrite it if server ignored the range request
+                    file = await asyncio.to_thread(download.open, response.status)
+                    try:
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            await client.governor.async_consume(len(chunk))
+                            await asyncio.to_thread(download.write, file, chunk)
+                    finally:
+                        await asyncio.to_thread(file.close)
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error_msg:
+                logger.warning(f"Download interrupted ({attempt}/{max_attempts}): {error_msg}")
+                continue
+
+        # Check partial file once complete, and rename it or discard it
+        if await asyncio.to_thread(download.finish, attempt, max_attempts):
+            return True
+
+    logger.error(f"Failed to download {output_file.name} after {max_attempts} attempts")
+    return False
+
+
+async def async_download_node_segmented(
+    node: Dict[str, Any],
+    output_file: Path,
+    client: AsyncCDSEClient,
+    segments: int = DEFAULT_SEGMENTS,
+    segment_size: int = DEFAULT_SEGMENT_SIZE,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+) -> bool:
+    """Download a file node through concurrent range requests, see 'download_node_segmented'.
+
+    Local file I/O, including the checksum pass over the complete file, runs in worker threads.
+
+    Args:
+        node (dict[str, Any]): File node obtained from CDSE OData API
+        output_file (Path)
+        client (AsyncCDSEClient)
+        segments (int): Number of concurrent connections
+        segment_size (int): Size of downloaded byte ranges, in bytes
+        max_attempts (int): Maximum number of attempts to download each byte range
+
+    Returns:
+        (bool): True if file was downloaded
+    """
+    download = PartialDownload(node, output_file)
+    if download.is_downloaded():
+        return True
+    semaphore = asyncio.Semaphore(segments)
+
+    async def download_range(byte_range: Tuple[int, int]) -> Optional[bool]:
+        position, end = byte_range
+        async with semaphore:
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    async with client.governor.async_transfer(), client.get(
+                        download.url,
+                        authenticated=True,
+                        headers=download.get_headers(position, end),
+                    ) as response:
+                        if response.status == 200:
+                            return None
+                        if response.status != 206:
+                            logger.error(
+                                f"Failed to download range. Status code: {response.status}"
+                            )
+                            return False
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            await client.governor.async_consume(len(chunk))
+                            await asyncio.to_thread(download.write_at, chunk, position)
+                            position += len(chunk)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error_msg:
+                    logger.warning(
+                        f"Range download interrupted ({attempt}/{max_attempts}): {error_msg}"
+                    )
+                if position > end:
+                    await asyncio.to_thread(download.add_segment, byte_range)
+                    return True
+            return False
+
+    # Preallocate partial file and download missing byte ranges into it
+    try:
+        ranges = await asyncio.to_thread(download.start_segments, segment_size)
+        results = await asyncio.gather(*(download_range(byte_range) for byte_range in ranges))
+    finally:
+        download.close()
+
+    success = await asyncio.to_thread(download.finish_segments, results)
+    if success is None:
+        return await async_download_node(node, output_file, client, max_attempts)
+    return success
+
+
+async def async_odata_download_with_nodefilter(
+    feature_id: str,
+    output_path: Path,
+    username: str,
+    password: str,
+    nodefilter_pattern: Union[str, Sequence[str], NodeFilter, None] = None,
+    exclude: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    client: Optional[AsyncCDSEClient] = None,
+    node_cache: Optional[NodeCache] = None,
+    node_strategy: str = "traversal",
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    segments: int = DEFAULT_SEGMENTS,
+    segment_size: int = DEFAULT_SEGMENT_SIZE,
+) -> Union[str, None]:
+    """Download files from CDSE using OData API with node filtering pattern, asynchronously.
+
+    Matching files are all downloaded concurrently, see 'odata_download_with_nodefilter' for
+    arguments.
+
+    Args:
+        client (AsyncCDSEClient or None): Opened client, a new one is created from username and
+            password if None is given
+
+    Returns:
+        feature_id (str or None): None if any file couldn't be downloaded
+    """
+    if client is None:
+        async with AsyncCDSEClient(username, password) as client:
+            return await async_odata_download_with_nodefilter(
+                feature_id,
+                output_path,
+                username,
+                password,
+                nodefilter_pattern,
+                exclude,
+                max_workers,
+                client,
+                node_cache,
+                node_strategy,
+                max_attempts,
+                segments,
+                segment_size,
+            )
+
+    output_path.mkdir(exist_ok=True, parents=True)
+    url = f"https://download.dataspace.copernicus.eu/odata/v1/Products({feature_id})/Nodes"
+    nodes = await async_search_nodes(
+        url,
+        nodefilter_pattern,
+        exclude,
+        max_workers,
+        client,
+        node_cache,
+        feature_id,
+        node_strategy,
+    )
+
+    downloads = []
+    for node in nodes:
+        output_file = output_path / get_node_path(node)
+        output_file.parent.mkdir(exist_ok=True, parents=True)
+        if segments > 1 and node["ContentLength"] > segment_size:
+            downloads.append(
+                async_download_node_segmented(
+                    node, output_file, client, segments, segment_size, max_attempts
+                )
+            )
+        else:
+            downloads.append(async_download_node(node, output_file, client, max_attempts))
+    results = await asyncio.gather(*downloads)
+
+    return feature_id if all(results) else None
+
+
+def asyncio_odata_download_with_nodefilter(
+    feature_id: str,
+    output_path: Path,
+    username: str,
+    password: str,
+    nodefilter_pattern: Union[str, Sequence[str], NodeFilter, None] = None,
+    exclude: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    client: Optional[AsyncCDSEClient] = None,
+    node_cache: Optional[NodeCache] = None,
+    node_strategy: str = "traversal",
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    segments: int = DEFAULT_SEGMENTS,
+    segment_size: int = DEFAULT_SEGMENT_SIZE,
+) -> Union[str, None]:
+    """Download files from CDSE using OData API with node filtering pattern, on an event loop.
+
+    Synchronous entry point of 'async_odata_download_with_nodefilter', with the same arguments
+    as 'odata_download_with_nodefilter', that runs its own event loop.
+
+    Args:
+        client (AsyncCDSEClient or None): Client that is not opened yet, a new one is created
+            from username and password if None is given
+
+    Returns:
+        feature_id (str or None): None if any file couldn't be downloaded
+    """
+
+    async def run() -> Union[str, None]:
+        async with client or AsyncCDSEClient(username, password) as opened_client:
+            return await async_odata_download_with_nodefilter(
+                feature_id,
+                output_path,
+                username,
+                password,
+                nodefilter_pattern,
+                exclude,
+                max_workers,
+                opened_client,
+                node_cache,
+                node_strategy,
+                max_attempts,
+                segments,
+                segment_size,
+            )
+
+    return asyncio.run(run())
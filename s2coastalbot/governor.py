@@ -0,0 +1,248 @@
+"""Process-wide limits on requests sent to CDSE, keeping usage within its per-user quotas."""
+
+# standard library
+import asyncio
+import contextlib
+import datetime
+import email.utils
+import logging
+import threading
+import time
+from typing import AsyncIterator
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+
+logger = logging.getLogger()
+
+# Statuses returned by CDSE when a quota is exceeded, along with a 'Retry-After' header
+THROTTLING_STATUSES = (429, 503)
+
+# Reasons for which requests are delayed by a governor
+THROTTLING_REASONS = ("requests", "transfers", "bandwidth", "retry_after")
+
+# Delay between attempts of coroutines to get a transfer slot, in seconds
+TRANSFER_POLL_INTERVAL = 0.01
+
+
+class TokenBucket:
+    """Token bucket letting through a sustained rate of units, with bursts up to its capacity.
+
+    Units are reserved even when the bucket is empty, the returned delay is then the time after
+    which the reserved units are available, so that concurrent callers are served in order.
+
+    Args:
+        rate (float): Units added to the bucket per second
+        capacity (float or None): Maximum units held by the bucket, rate if None is given
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Reserve units, not thread-safe.
+
+        Args:
+            amount (float)
+            now (float): Monotonic time, in seconds
+
+        Returns:
+            delay (float): Time to wait before using reserved units, in seconds
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return max(-self.tokens / self.rate, 0.0)
+
+
+class Governor:
+    """Limit request rate, concurrent transfers and bandwidth of all CDSE calls of a process.
+
+    Every limit is optional, a governor without any limit doesn't delay anything. Pauses
+    requested by CDSE through 'Retry-After' headers delay all following requests. Time spent
+    waiting is accumulated per reason, and downloaded bytes are counted.
+
+    Args:
+        requests_per_second (float or None): Sustained rate of requests
+        burst (int or None): Number of requests that can be sent at once after an idle period,
+            defaults to one second worth of requests
+        max_transfers (int or None): Maximum number of concurrent file transfers
+        bytes_per_second (float or None): Maximum total download bandwidth
+    """
+
+    def __init__(
+        self,
+        requests_per_second: Optional[float] = None,
+        burst: Optional[int] = None,
+        max_transfers: Optional[int] = None,
+        bytes_per_second: Optional[float] = None,
+    ):
+        self._lock = threading.Lock()
+        self._requests = (
+            None if requests_per_second is None else TokenBucket(requests_per_second, burst)
+        )
+        self._transfers = (
+            None if max_transfers is None else threading.BoundedSemaphore(max_transfers)
+        )
+        self._bandwidth = None if bytes_per_second is None else TokenBucket(bytes_per_second)
+        self._paused_until = 0.0
+        self.throttled_time = {reason: 0.0 for reason in THROTTLING_REASONS}
+        self.throttled_responses = 0
+        self.transferred_bytes = 0
+
+    def acquire_request(self) -> None:
+        """Wait until a request can be sent."""
+        time.sleep(self._reserve_request())
+
+    async def async_acquire_request(self) -> None:
+        """Wait until a request can be sent, without blocking the event loop."""
+        await asyncio.sleep(self._reserve_request())
+
+    @contextlib.contextmanager
+    def transfer(self) -> Iterator[None]:
+        """Hold one of the concurrent transfer slots."""
+        if self._transfers is None:
+            yield
+            return
+        start = time.monotonic()
+        self._transfers.acquire()
+        self._add_throttled_time("transfers", time.monotonic() - start)
+        try:
+            yield
+        finally:
+            self._transfers.release()
+
+    @contextlib.asynccontextmanager
+    async def async_transfer(self) -> AsyncIterator[None]:
+        """Hold one of the concurrent transfer slots, without blocking the event loop."""
+        if self._transfers is None:
+            yield
+            return
+
+        # Poll for a free slot instead of waiting in a worker thread, which could use up the
+        # threads needed by slot holders, and would take a slot after being cancelled
+        start = time.monotonic()
+        while not self._transfers.acquire(blocking=False):
+            await asyncio.sleep(TRANSFER_POLL_INTERVAL)
+        self._add_throttled_time("transfers", time.monotonic() - start)
+        try:
+            yield
+        finally:
+            self._transfers.release()
+
+    def consume(self, size: int) -> None:
+        """Account for downloaded bytes, waiting if bandwidth limit is exceeded.
+
+        Args:
+            size (int): Number of downloaded bytes
+        """
+        time.sleep(self._reserve_bytes(size))
+
+    async def async_consume(self, size: int) -> None:
+        """Account for downloaded bytes, without blocking the event loop.
+
+        Args:
+            size (int): Number of downloaded bytes
+        """
+        await asyncio.sleep(self._reserve_bytes(size))
+
+    def pause(self, delay: float) -> None:
+        """Delay all following requests, typically after a throttling response.
+
+        Args:
+            delay (float): In seconds
+        """
+        with self._lock:
+            self.throttled_responses += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def get_throttled_time(self) -> Dict[str, float]:
+        """Get time spent waiting for each throttling reason.
+
+        Returns:
+            (dict[str, float]): In seconds, summed over all waiting calls
+        """
+        with self._lock:
+            return dict(self.throttled_time)
+
+    def _reserve_request(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            pause_delay = max(self._paused_until - now, 0.0)
+            rate_delay = 0.0 if self._requests is None else self._requests.reserve(1, now)
+            if pause_delay > rate_delay:
+                self.throttled_time["retry_after"] += pause_delay
+            else:
+                self.throttled_time["requests"] += rate_delay
+            return max(pause_delay, rate_delay)
+
+    def get_transferred_bytes(self) -> int:
+        """Get number of bytes downloaded through transfers of the governor.
+
+        Returns:
+            (int)
+        """
+        with self._lock:
+            return self.transferred_bytes
+
+    def _reserve_bytes(self, size: int) -> float:
+        with self._lock:
+            self.transferred_bytes += size
+            if self._bandwidth is None:
+                return 0.0
+            delay = self._bandwidth.reserve(size, time.monotonic())
+            self.throttled_time["bandwidth"] += delay
+            return delay
+
+    def _add_throttled_time(self, reason: str, delay: float) -> None:
+        with self._lock:
+            self.throttled_time[reason] += delay
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse 'Retry-After' header value, given either as a number of seconds or an HTTP date.
+
+    Args:
+        value (str or None)
+
+    Returns:
+        delay (float or None): In seconds, None if value is missing or invalid
+    """
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return max((date - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+
+_governor = Governor()
+
+
+def get_governor() -> Governor:
+    """Get governor shared by all CDSE clients of the process, without limits by default.
+
+    Returns:
+        (Governor)
+    """
+    return _governor
+
+
+def set_governor(governor: Governor) -> None:
+    """Replace governor shared by all CDSE clients created afterwards.
+
+    Args:
+        governor (Governor)
+    """
+    global _governor
+    _governor = governor
@@ -0,0 +1,284 @@
+"""Ledgers of products processed by the bot, such as downloaded or posted images."""
+
+# standard library
+import csv
+import datetime
+import re
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+
+# third party
+import numpy as np
+
+# Database holding ledgers and tile statistics, in the bot data folder
+LEDGER_FILE_NAME = "ledger.sqlite"
+
+# Ledgers kept in the ledger database, each one in a table of the same name
+LEDGER_NAMES = ("downloaded_images", "posted_images")
+
+# Outcomes of products counted per tile, each one in a column of the tile statistics table
+TILE_OUTCOMES = ("downloaded", "no_intersection", "all_nodata", "posted")
+
+# Minimum sampling weight of tiles, relative to tiles whose products are always posted, so that
+# tiles with a poor history are still sampled from time to time
+DEFAULT_EXPLORATION_FLOOR = 0.1
+
+# Maximum number of products looked up in a single query, below SQLite variables limit
+LOOKUP_BATCH_SIZE = 500
+
+
+class Ledger:
+    """Ledger of processed products kept in a SQLite database, with one row per product.
+
+    The database is in WAL mode, so that several bot processes can read ledgers while another one
+    appends to them. Products are only ever inserted, and looked up through an index on product
+    names. The CSV file the ledger was formerly kept in, if any, is imported once, and left in
+    place afterwards.
+
+    Args:
+        ledger_file (Path): SQLite database, shared by all ledgers
+        name (str): One of LEDGER_NAMES
+        csv_file (Path or None): Former CSV file with 'date' and 'product' columns
+    """
+
+    def __init__(self, ledger_file: Path, name: str, csv_file: Optional[Path] = None):
+        if name not in LEDGER_NAMES:
+            raise Exception(f"Unknown ledger '{name}', expected one of {LEDGER_NAMES}")
+        self.ledger_file = ledger_file
+        self.name = name
+        self.ledger_file.parent.mkdir(exist_ok=True, parents=True)
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {name} (date TEXT NOT NULL, product TEXT NOT NULL)"
+                )
+                connection.execute(f"CREATE INDEX IF NOT EXISTS {name}_product ON {name} (product)")
+                connection.execute(f"CREATE INDEX IF NOT EXISTS {name}_date ON {name} (date)")
+                connection.execute("CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY)")
+            if csv_file is not None:
+                self._migrate(connection, csv_file)
+
+    def contains(self, title: str) -> bool:
+        """Check if a product is in ledger.
+
+        Args:
+            title (str): Product name, with or without '.SAFE' suffix
+
+        Returns:
+            (bool)
+        """
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                f"SELECT 1 FROM {self.name} WHERE product = ? LIMIT 1", (get_product_name(title),)
+            ).fetchone()
+        return row is not None
+
+    def filter_new(self, features: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Keep features of products that are not in ledger, looking up a whole page at once.
+
+        Args:
+            features (list[dict]): Query results, with a 'title' property
+
+        Returns:
+            (list[dict]): In the same order
+        """
+        products = [get_product_name(f["properties"]["title"]) for f in features]
+        known = set()
+        with closing(self._connect()) as connection:
+            for start in range(0, len(products), LOOKUP_BATCH_SIZE):
+                batch = products[start : start + LOOKUP_BATCH_SIZE]  # noqa E203
+                placeholders = ", ".join("?" * len(batch))
+                known.update(
+                    row[0]
+                    for row in connection.execute(
+                        f"SELECT product FROM {self.name} WHERE product IN ({placeholders})", batch
+                    )
+                )
+        return [f for f, product in zip(features, products) if product not in known]
+
+    def add(self, title: str, date: Optional[datetime.datetime] = None) -> None:
+        """Append a product to ledger.
+
+        Args:
+            title (str): Product name, with or without '.SAFE' suffix
+            date (datetime.datetime or None): Processing date, defaults to now
+        """
+        if date is None:
+            date = datetime.datetime.now()
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                f"INSERT INTO {self.name} VALUES (?, ?)",
+                (date.strftime("%Y-%m-%dT%H:%M:%S"), get_product_name(title)),
+            )
+
+    def get_products(self) -> List[str]:
+        """Get products of ledger, in insertion order.
+
+        Returns:
+            (list[str]): Product names, without '.SAFE' suffix
+        """
+        with closing(self._connect()) as connection:
+            rows = connection.execute(f"SELECT product FROM {self.name} ORDER BY rowid")
+            return [row[0] for row in rows]
+
+    def _migrate(self, connection: sqlite3.Connection, csv_file: Path) -> None:
+        # lock database while checking migration state, so that only one process imports rows
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            migrated = connection.execute(
+                "SELECT 1 FROM migrations WHERE name = ?", (self.name,)
+            ).fetchone()
+            if migrated is None:
+                if csv_file.exists():
+                    with csv_file.open(newline="") as f:
+                        rows = [(row["date"], row["product"]) for row in csv.DictReader(f)]
+                    connection.executemany(f"INSERT INTO {self.name} VALUES (?, ?)", rows)
+                connection.execute("INSERT INTO migrations VALUES (?)", (self.name,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.ledger_file, timeout=30.0)
+
+
+class TileStats:
+    """Outcomes of products of each Sentinel-2 tile, kept in the ledger database.
+
+    Outcome counters and downloaded bytes are incremented in place, with one row per tile. They
+    give the historical yield of tiles, the ratio of downloaded products that got posted, used to
+    favour tiles whose products are likely to be posted.
+
+    Args:
+        ledger_file (Path): SQLite database, shared with ledgers
+    """
+
+    def __init__(self, ledger_file: Path):
+        self.ledger_file = ledger_file
+        self.ledger_file.parent.mkdir(exist_ok=True, parents=True)
+        counters = ", ".join(f"{outcome} INTEGER NOT NULL DEFAULT 0" for outcome in TILE_OUTCOMES)
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS tile_stats (tile_id TEXT PRIMARY KEY, {counters}, "
+                    "bytes INTEGER NOT NULL DEFAULT 0)"
+                )
+
+    def record(self, tile_id: str, outcome: str, size: int = 0) -> None:
+        """Count an outcome of a product of a tile.
+
+        Args:
+            tile_id (str): MGRS tile identifier, such as '31TCJ'
+            outcome (str): One of TILE_OUTCOMES
+            size (int): Downloaded bytes
+        """
+        if outcome not in TILE_OUTCOMES:
+            raise Exception(f"Unknown tile outcome '{outcome}', expected one of {TILE_OUTCOMES}")
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                f"INSERT INTO tile_stats (tile_id, {outcome}, bytes) VALUES (?, 1, ?) "
+                f"ON CONFLICT (tile_id) DO UPDATE SET {outcome} = {outcome} + 1, "
+                "bytes = bytes + excluded.bytes",
+                (tile_id, size),
+            )
+
+    def get(self, tile_id: str) -> Dict[str, int]:
+        """Get outcome counters and downloaded bytes of a tile.
+
+        Args:
+            tile_id (str)
+
+        Returns:
+            (dict[str, int]): By outcome, and 'bytes', zero for tiles without products yet
+        """
+        columns = TILE_OUTCOMES + ("bytes",)
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                f"SELECT {', '.join(columns)} FROM tile_stats WHERE tile_id = ?", (tile_id,)
+            ).fetchone()
+        return dict(zip(columns, (0,) * len(columns) if row is None else row))
+
+    def get_weights(
+        self, tile_ids: Sequence[str], exploration_floor: float = DEFAULT_EXPLORATION_FLOOR
+    ) -> np.ndarray:
+        """Get sampling weights of tiles from their historical yield.
+
+        Yields are smoothed with one posted product out of two downloaded ones, so that tiles
+        without history get a yield of 0.5, and a single failure doesn't rule a tile out.
+
+        Args:
+            tile_ids (sequence of str)
+            exploration_floor (float): Minimum weight
+
+        Returns:
+            weights (np.ndarray): In the order of tile_ids, between exploration_floor and 1
+        """
+        with closing(self._connect()) as connection:
+            rows = connection.execute("SELECT tile_id, downloaded, posted FROM tile_stats")
+            stats = {tile_id: (downloaded, posted) for tile_id, downloaded, posted in rows}
+        counts = np.array([stats.get(tile_id, (0, 0)) for tile_id in tile_ids], dtype=float)
+        counts = counts.reshape(-1, 2)
+        yields = (counts[:, 1] + 1) / (counts[:, 0] + 2)
+        return np.clip(yields, exploration_floor, 1.0)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.ledger_file, timeout=30.0)
+
+
+def get_ledger(data_path: Path, name: str) -> Ledger:
+    """Open a ledger of the bot data folder, importing its former CSV file on first use.
+
+    Args:
+        data_path (Path): Folder holding 'ledger.sqlite' and former CSV ledgers
+        name (str): One of LEDGER_NAMES
+
+    Returns:
+        (Ledger)
+    """
+    return Ledger(data_path / LEDGER_FILE_NAME, name, data_path / f"{name}.csv")
+
+
+def get_tile_stats(data_path: Path) -> "TileStats":
+    """Open tile statistics of the bot data folder.
+
+    Args:
+        data_path (Path): Folder holding 'ledger.sqlite'
+
+    Returns:
+        (TileStats)
+    """
+    return TileStats(data_path / LEDGER_FILE_NAME)
+
+
+def get_product_name(title: str) -> str:
+    """Get name of a product as stored in ledgers.
+
+    Args:
+        title (str): Product name, with or without '.SAFE' suffix
+
+    Returns:
+        (str)
+    """
+    return title.removesuffix(".SAFE")
+
+
+def get_tile_id(title: str) -> Optional[str]:
+    """Get MGRS tile identifier of a Sentinel-2 product from its name.
+
+    Args:
+        title (str): Product name, such as 'S2A_MSIL2A_20240901T103021_N0511_R108_T31TCJ_...'
+
+    Returns:
+        (str or None): Such as '31TCJ', None if product name doesn't hold one
+    """
+    match = re.search(r"_T(\d{2}[A-Z]{3})_", title)
+    return None if match is None else match.group(1)
@@ -6,13 +6,11 @@ Bot that posts newly acquired Sentinel-2 images of coastal areas, on Twitter and
 # standard library
 import argparse
 import configparser
-import datetime
 import logging
 import shutil
 from pathlib import Path
 
 # third party
-import pandas as pd
 import tweepy
 from mastodon import Mastodon
 
@@ -20,8 +18,25 @@ from mastodon import Mastodon
 from s2coastalbot.custom_logger import get_custom_logger
 from s2coastalbot.geoutils import format_lon_lat
 from s2coastalbot.geoutils import get_location_name
+from s2coastalbot.ledger import get_ledger
+from s2coastalbot.ledger import get_tile_id
+from s2coastalbot.ledger import get_tile_stats
+from s2coastalbot.postprocessing import NoIntersectionError
 from s2coastalbot.postprocessing import postprocess_tci_image
 from s2coastalbot.sentinel2 import download_tci_image
+from s2coastalbot.sentinel2 import set_governor_from_config
+
+
+def get_product_path(tci_file_path):
+    """Find product's SAFE folder containing TCI file, or TCI file's folder if there is none.
+    Input:
+        - tci_file_path     Path
+    Output:
+        -                   Path
+    """
+    return next(
+        (path for path in tci_file_path.parents if path.suffix == ".SAFE"), tci_file_path.parent
+    )
 
 
 def clean_data_based_on_tci_file(tci_file_path):
@@ -31,10 +46,37 @@ def clean_data_based_on_tci_file(tci_file_path):
     """
     logger = logging.getLogger()
     logger.info("Cleaning data")
-    product_path = tci_file_path.parent
+    product_path = get_product_path(tci_file_path)
     shutil.rmtree(product_path)
 
 
+def is_in_download_cache(tci_file_path, config):
+    """Check if TCI file lives in the download cache set in config, if any.
+    Input:
+        - tci_file_path     Path
+        - config            configparser.ConfigParser
+    Output:
+        -                   bool
+    """
+    download_cache_dir = config.get("cache", "download_cache_dir", fallback=None)
+    if download_cache_dir is None:
+        return False
+    tci_folder = tci_file_path.parent.resolve()
+    return Path(download_cache_dir).resolve() in (tci_folder, *tci_folder.parents)
+
+
+def record_tile_outcome(tci_file_path, outcome):
+    """Count outcome of product in statistics of its tile, if product name holds a tile.
+    Input:
+        - tci_file_path     Path
+        - outcome           str     see 's2coastalbot.ledger.TILE_OUTCOMES'
+    """
+    tile_id = get_tile_id(get_product_path(tci_file_path).stem)
+    if tile_id is not None:
+        project_path = Path(__file__).parents[1]
+        get_tile_stats(project_path / "data").record(tile_id, outcome)
+
+
 def s2coastalbot_main(config):
     """
     Input:
@@ -42,7 +84,10 @@ def s2coastalbot_main(config):
             See contents in 'config/example_config.ini'
     """
     logger = logging.getLogger()
-    cleaning = config.getboolean("misc", "cleaning")
+    cleaning_enabled = config.getboolean("misc", "cleaning")
+
+    # apply CDSE quotas once, so that they hold across download attempts
+    set_governor_from_config(config)
 
     postprocessed_file_path = None
     while postprocessed_file_path is None:
@@ -50,6 +95,9 @@ def s2coastalbot_main(config):
         # download Sentinel-2 True Color Image
         logger.info("Downloading Sentinel-2 TCI image")
         tci_file_path, date = download_tci_image(config)
+        cleaning = cleaning_enabled and not is_in_download_cache(tci_file_path, config)
+        if cleaning_enabled and not cleaning:
+            logger.info("Product is in download cache, it is evicted from it instead of cleaned")
 
         try:
 
@@ -62,6 +110,7 @@ def s2coastalbot_main(config):
 
             if postprocessed_file_path is None:
                 # no subset found within this image, try downloading another image
+                record_tile_outcome(tci_file_path, "all_nodata")
                 if cleaning:
                     clean_data_based_on_tci_file(tci_file_path)
                 continue
@@ -73,6 +122,12 @@ def s2coastalbot_main(config):
                 date.strftime("%Y %b %d"),
             )
 
+        except NoIntersectionError as error_msg:
+            logger.error(f"Error postprocessing image: {error_msg}")
+            record_tile_outcome(tci_file_path, "no_intersection")
+            if cleaning:
+                clean_data_based_on_tci_file(tci_file_path)
+
         except Exception as error_msg:
             logger.error(f"Error postprocessing image: {error_msg}")
             if cleaning:
@@ -140,18 +195,10 @@ def s2coastalbot_main(config):
             clean_data_based_on_tci_file(tci_file_path)
         return
 
-    # update list of posted images
+    # update list of posted images and tile statistics
     project_path = Path(__file__).parents[1]
-    posted_images_file = project_path / "data" / "posted_images.csv"
-    if not posted_images_file.exists():  # initiate file if necessary
-        posted_images = pd.DataFrame(columns=["date", "product"])
-    else:
-        posted_images = pd.read_csv(posted_images_file)
-    posted_images.loc[len(posted_images)] = [
-        datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
-        tci_file_path.parent.stem,
-    ]
-    posted_images.to_csv(posted_images_file, index=False)
+    get_ledger(project_path / "data", "posted_images").add(get_product_path(tci_file_path).stem)
+    record_tile_outcome(tci_file_path, "posted")
 
     # clean data if necessary
     if cleaning:
@@ -20,6 +20,10 @@ INPUT_MAX_SIZE = 10980
 SUBSET_SIZE = 1000
 
 
+class NoIntersectionError(Exception):
+    """Raised when image footprint doesn't intersect coastline."""
+
+
 def get_window(window_center, window_width, window_height, image_width, image_height):
     """Find pixels window around a given center taking into account image bounds.
 
@@ -97,7 +101,7 @@ def postprocess_tci_image(input_file, aoi_file):
 
         # raise error if there are no intersection with coastline
         if coastline_subsets == []:
-            raise Exception("No intersection with coastline found")
+            raise NoIntersectionError("No intersection with coastline found")
 
         # list up to a hundred of potential subset centers randomly picked along coastline
         coastline_points = [
@@ -0,0 +1,91 @@
+"""Scoring of candidate products before download, from their footprint and metadata."""
+
+# standard library
+import functools
+import logging
+
+# third party
+import geopandas as gpd
+import pyproj
+from shapely import STRtree
+from shapely.geometry import shape
+
+# create some constants
+GEOD = pyproj.Geod(ellps="WGS84")
+
+# Margin kept inside product footprints, in degrees, about half the postprocessed subset size so
+# that subsets centered on coastline points are fully within valid data
+VALID_AREA_MARGIN = 0.05
+
+
+class CandidateScorer:
+    """Score candidate products by the length of coastline they are likely to show.
+
+    Scores are the length of coastline inside the valid data area of products, which is their
+    footprint shrunk by a margin, weighted by their cloud-free ratio. Footprints are the actual
+    areas covered by data, which for products at swath edges are only parts of their tile.
+
+    Args:
+        coastline_file (Path): Geojson file containing polyline shapes, as used in postprocessing
+        margin (float): Margin kept inside footprints, in degrees
+    """
+
+    def __init__(self, coastline_file, margin=VALID_AREA_MARGIN):
+        logger = logging.getLogger()
+        logger.info("Reading coastline for candidates scoring")
+        self.lines = gpd.read_file(coastline_file)["geometry"].to_numpy()
+        self.tree = STRtree(self.lines)
+        self.margin = margin
+
+    def score(self, feature):
+        """Estimate coastline length shown by a product.
+
+        Args:
+            feature (dict): With a GeoJSON 'geometry' and a 'cloudCover' property, in percent
+
+        Returns:
+            score (float or None): In meters, None if feature has no footprint
+        """
+        if feature.get("geometry") is None:
+            return None
+        valid_area = shape(feature["geometry"]).buffer(-self.margin)
+        if valid_area.is_empty:
+            return 0.0
+        length = sum(
+            GEOD.geometry_length(line.intersection(valid_area))
+            for line in self.lines[self.tree.query(valid_area, predicate="intersects")]
+        )
+        cloud_cover = feature["properties"].get("cloudCover") or 0.0
+        return length * (1 - cloud_cover / 100)
+
+    def rank(self, features):
+        """Sort features by decreasing score, dropping those without coastline in valid data.
+
+        Features without footprint are kept, after scored ones, in their original order.
+
+        Args:
+            features (list[dict])
+
+        Returns:
+            (list[dict])
+        """
+        scores = [self.score(feature) for feature in features]
+        ranked = sorted(
+            (item for item in zip(scores, range(len(features))) if item[0] != 0.0),
+            key=lambda item: (item[0] is None, -(item[0] or 0.0), item[1]),
+        )
+        return [features[index] for _, index in ranked]
+
+
+@functools.lru_cache(maxsize=1)
+def get_candidate_scorer(coastline_file, margin=VALID_AREA_MARGIN):
+    """Get candidate scorer of a coastline file, reading the file only once per process.
+
+    Args:
+        coastline_file (Path): Geojson file containing polyline shapes, as used in postprocessing
+        margin (float): Margin kept inside footprints, in degrees
+
+    Returns:
+        (CandidateScorer)
+    """
+    return CandidateScorer(coastline_file, margin)
@@ -3,18 +3,1234 @@ Sentinel-2 data handling module for s2coastalbot.
 """
 
 # standard library
+import abc
 import datetime
+import hashlib
+import itertools
+import json
 import logging
+import os
+import sqlite3
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from contextlib import closing
 from pathlib import Path
+from urllib.parse import urlencode
 
 # third party
-import geopandas as gpd
-import pandas as pd
+import numpy as np
 from cdsetool.query import query_features
 from shapely.geometry import MultiPoint
+from shapely.geometry import Polygon
+from shapely.geometry import mapping
 
 # current project
+from s2coastalbot.aoi import get_weighted_permutation
+from s2coastalbot.aoi import load_aoi
+from s2coastalbot.cache import DEFAULT_DOWNLOAD_CACHE_SIZE
+from s2coastalbot.cache import DEFAULT_NODES_CACHE_TTL
+from s2coastalbot.cache import DEFAULT_QUERY_CACHE_TTL
+from s2coastalbot.cache import DownloadCache
+from s2coastalbot.cache import NodeCache
+from s2coastalbot.cache import QueryCache
+from s2coastalbot.cdse import DEFAULT_MAX_ATTEMPTS
+from s2coastalbot.cdse import DEFAULT_MAX_WORKERS
+from s2coastalbot.cdse import DEFAULT_POOL_MAXSIZE
+from s2coastalbot.cdse import DEFAULT_SEGMENT_SIZE
+from s2coastalbot.cdse import DEFAULT_SEGMENTS
+from s2coastalbot.cdse import DEFAULT_TIMEOUT
+from s2coastalbot.cdse import CDSEClient
 from s2coastalbot.cdse import odata_download_with_nodefilter
+from s2coastalbot.cdse import odata_vrt_with_nodefilter
+from s2coastalbot.cdse import write_remote_vrt
+from s2coastalbot.cdse_async import AsyncCDSEClient
+from s2coastalbot.cdse_async import asyncio_odata_download_with_nodefilter
+from s2coastalbot.governor import Governor
+from s2coastalbot.governor import get_governor
+from s2coastalbot.governor import set_governor
+from s2coastalbot.ledger import DEFAULT_EXPLORATION_FLOOR
+from s2coastalbot.ledger import get_ledger
+from s2coastalbot.ledger import get_tile_id
+from s2coastalbot.ledger import get_tile_stats
+from s2coastalbot.scoring import get_candidate_scorer
+
+# Names of data sources that can be set in config
+DATA_SOURCES = ("cdse", "local", "stac")
+
+# Number of tiles of the AOI footprint queried at once
+QUERY_BATCH_SIZE = 50
+
+# Number of tiles queried at once by tile identifiers, by data sources supporting it
+TILE_ID_BATCH_SIZE = 150
+
+# CDSE OData API listing products, used to query products by tile identifiers
+ODATA_PRODUCTS_URL = "https://catalogue.dataspace.copernicus.eu/odata/v1/Products"
+
+# Maximum length of tile identifiers filters, longer lists are split into several requests
+ODATA_TILE_FILTER_MAX_LENGTH = 6000
+
+# Maximum number of batch queries running concurrently
+DEFAULT_QUERY_WORKERS = 4
+
+# Orders in which products are searched, newest first or least cloudy first
+SEARCH_ORDERS = ("date", "cloud_cover")
+
+# Number of products requested per search results page, pages are only fetched until a new
+# product is found
+SEARCH_PAGE_SIZE = 20
+
+# Overlap of consecutive catalogue syncs, covering products published while a sync is running
+CATALOGUE_SYNC_MARGIN = datetime.timedelta(hours=1)
+
+# Number of products requested per results page by queries fetching all results, catalogue syncs
+# and cached queries
+CATALOGUE_PAGE_SIZE = 1000
+
+# STAC API and collection of Sentinel-2 L2A products used by default
+DEFAULT_STAC_URL = "https://stac.dataspace.copernicus.eu/v1"
+DEFAULT_STAC_COLLECTION = "sentinel-2-l2a"
+
+# Maximum number of items returned by a STAC search request
+STAC_SEARCH_LIMIT = 100
+
+# Keys of STAC assets holding the TCI image, in order of preference
+STAC_TCI_ASSET_KEYS = ("visual", "TCI_10m", "TCI", "visual_10m")
+
+
+class DataSource(abc.ABC):
+    """
+    Source of Sentinel-2 products, queried by footprint and fetched by TCI file.
+    Features are dicts with the same structure as CDSE OpenSearch API features:
+    {"id": ..., "geometry": ..., "properties": {"title": ..., "completionDate": ..., ...}},
+    where geometry is the GeoJSON footprint of the product, if known.
+    """
+
+    # cache of query results, if any, see 'QueryCache'
+    query_cache = None
+
+    # whether products can be queried by tile identifiers, see 'query_tiles'
+    query_by_tile_id = False
+
+    # order of query results, one of SEARCH_ORDERS
+    sort_by = "date"
+
+    @abc.abstractmethod
+    def query_features(
+        self,
+        geometry,
+        start_date,
+        end_date,
+        cloud_cover_max,
+        published_after=None,
+        page_size=SEARCH_PAGE_SIZE,
+    ):
+        """
+        Query L2A products intersecting a geometry, sorted by sort_by. Results may be a lazy
+        iterable fetching pages of SEARCH_PAGE_SIZE products as it is consumed.
+        Input:
+            -geometry           shapely.geometry
+            -start_date         datetime.datetime
+            -end_date           datetime.datetime
+            -cloud_cover_max    int     percentage
+            -published_after    datetime.datetime or None   only query products published after
+                                    this date, ignored by sources without publication dates
+            -page_size          int     number of products per results page, ignored by sources
+                                    returning all results at once
+        Output:
+            -                   iterable[dict]
+        """
+
+    def query_tiles(
+        self,
+        tiles,
+        start_date,
+        end_date,
+        cloud_cover_max,
+        published_after=None,
+        page_size=SEARCH_PAGE_SIZE,
+    ):
+        """
+        Query L2A products of S2 tiles, by tile identifiers if supported by data source and set in
+        AOI, and otherwise by tile centroids.
+        Input:
+            -tiles              np.ndarray      S2 tiles of AOI, see 's2coastalbot.aoi'
+            -start_date         datetime.datetime
+            -end_date           datetime.datetime
+            -cloud_cover_max    int     percentage
+            -published_after    datetime.datetime or None
+            -page_size          int
+        Output:
+            -                   iterable[dict]
+        """
+        return self.query_features(
+            get_tiles_geometry(tiles),
+            start_date,
+            end_date,
+            cloud_cover_max,
+            published_after,
+            page_size,
+        )
+
+    def get_batch_size(self, tiles):
+        """
+        Get number of tiles queried at once.
+        Input:
+            -tiles      np.ndarray      S2 tiles of AOI, see 's2coastalbot.aoi'
+        Output:
+            -           int
+        """
+        if self.query_by_tile_id and has_tile_ids(tiles):
+            return TILE_ID_BATCH_SIZE
+        return QUERY_BATCH_SIZE
+
+    @abc.abstractmethod
+    def get_tci_file(self, feature, output_folder):
+        """
+        Make TCI file of a product available locally.
+        Input:
+            -feature            dict
+            -output_folder      Path
+        Output:
+            -                   Path or None    None if TCI file couldn't be fetched
+        """
+
+
+class CDSEDataSource(DataSource):
+    """
+    Products queried from CDSE OpenSearch API, or from CDSE OData API by tile identifiers, and
+    downloaded from CDSE OData API.
+    Input:
+        -config     configparser.ConfigParser
+            contains:
+                access: cdse_user, cdse_password, cdse_token_cache_file (optional)
+                download (optional): max_workers, pool_maxsize, timeout, max_attempts, segments,
+                    segment_size, remote_read, node_strategy, extra_patterns, engine
+                cache (optional): nodes_cache_dir, nodes_cache_ttl, download_cache_dir,
+                    download_cache_size, query_cache_file, query_cache_ttl
+    """
+
+    query_by_tile_id = True
+
+    def __init__(self, config):
+
+        # read config
+        self.cdse_user = config.get("access", "cdse_user")
+        self.cdse_password = config.get("access", "cdse_password")
+        self.token_cache_file = config.get("access", "cdse_token_cache_file", fallback=None)
+        self.max_workers = config.getint("download", "max_workers", fallback=DEFAULT_MAX_WORKERS)
+        self.pool_maxsize = config.getint("download", "pool_maxsize", fallback=DEFAULT_POOL_MAXSIZE)
+        self.timeout = config.getfloat("download", "timeout", fallback=DEFAULT_TIMEOUT[1])
+        self.max_attempts = config.getint("download", "max_attempts", fallback=DEFAULT_MAX_ATTEMPTS)
+        self.segments = config.getint("download", "segments", fallback=DEFAULT_SEGMENTS)
+        self.segment_size = config.getint(  # in MiB
+            "download", "segment_size", fallback=DEFAULT_SEGMENT_SIZE // 2**20
+        )
+        self.remote_read = config.getboolean("download", "remote_read", fallback=False)
+        self.node_strategy = config.get("download", "node_strategy", fallback="manifest")
+        extra_patterns = config.get("download", "extra_patterns", fallback="")
+        self.engine = config.get("download", "engine", fallback="threads")
+        if self.engine not in ("threads", "asyncio"):
+            raise Exception(f"Unknown download engine: {self.engine}")
+        self.nodefilter_patterns = ["*_TCI_10m.jp2"] + [
+            pattern.strip() for pattern in extra_patterns.split(",") if pattern.strip()
+        ]
+        nodes_cache_dir = config.get("cache", "nodes_cache_dir", fallback=None)
+        nodes_cache_ttl = config.getfloat(  # in hours
+            "cache", "nodes_cache_ttl", fallback=DEFAULT_NODES_CACHE_TTL / 3600
+        )
+        download_cache_dir = config.get("cache", "download_cache_dir", fallback=None)
+        download_cache_size = config.getfloat(  # in GiB
+            "cache", "download_cache_size", fallback=DEFAULT_DOWNLOAD_CACHE_SIZE / 2**30
+        )
+        query_cache_file = config.get("cache", "query_cache_file", fallback=None)
+        query_cache_ttl = config.getfloat(  # in minutes
+            "cache", "query_cache_ttl", fallback=DEFAULT_QUERY_CACHE_TTL / 60
+        )
+
+        self.node_cache = (
+            None
+            if nodes_cache_dir is None
+            else NodeCache(Path(nodes_cache_dir), ttl=nodes_cache_ttl * 3600)
+        )
+        self.download_cache = (
+            None
+            if download_cache_dir is None
+            else DownloadCache(Path(download_cache_dir), max_size=int(download_cache_size * 2**30))
+        )
+        self.query_cache = (
+            None
+            if query_cache_file is None
+            else QueryCache(Path(query_cache_file), ttl=query_cache_ttl * 60)
+        )
+
+    def query_features(
+        self,
+        geometry,
+        start_date,
+        end_date,
+        cloud_cover_max,
+        published_after=None,
+        page_size=SEARCH_PAGE_SIZE,
+    ):
+
+        # look up results of same query sent within current date bucket
+        if self.query_cache is not None:
+            key = self.query_cache.get_key(
+                hashlib.sha256(geometry.wkb).hexdigest(),
+                "S2MSI2A",
+                cloud_cover_max,
+                (end_date - start_date).days,
+                None if published_after is None else published_after.isoformat(),
+                self.sort_by,
+            )
+            features = self.query_cache.get(key)
+            if features is not None:
+                return features
+
+            # cached results are all fetched, in as few requests as possible
+            page_size = max(page_size, CATALOGUE_PAGE_SIZE)
+
+        search_terms = {
+            "startDate": start_date,
+            "completionDate": end_date,
+            "productType": "S2MSI2A",
+            "geometry": geometry,
+            "cloudCover": f"[0,{cloud_cover_max}]",
+            "sortParam": "startDate" if self.sort_by == "date" else "cloudCover",
+            "sortOrder": "descending" if self.sort_by == "date" else "ascending",
+            "maxRecords": page_size,
+        }
+        if published_after is not None:
+            search_terms["publishedAfter"] = published_after
+        get_governor().acquire_request()
+        features = query_features("Sentinel2", search_terms)
+
+        # cached results are stored, others are fetched page by page while consumed
+        if self.query_cache is not None:
+            features = list(features)
+            self.query_cache.set(key, features)
+        return features
+
+    def query_tiles(
+        self,
+        tiles,
+        start_date,
+        end_date,
+        cloud_cover_max,
+        published_after=None,
+        page_size=SEARCH_PAGE_SIZE,
+    ):
+        if not has_tile_ids(tiles):
+            return super().query_tiles(
+                tiles, start_date, end_date, cloud_cover_max, published_after, page_size
+            )
+        tile_ids = sorted(set(tiles["tile_id"]))
+
+        # look up results of same query sent within current date bucket
+        if self.query_cache is not None:
+            key = self.query_cache.get_key(
+                ",".join(tile_ids),
+                "S2MSI2A",
+                cloud_cover_max,
+                (end_date - start_date).days,
+                None if published_after is None else published_after.isoformat(),
+                self.sort_by,
+            )
+            features = self.query_cache.get(key)
+            if features is not None:
+                return features
+
+            # cached results are all fetched, in as few requests as possible
+            page_size = max(page_size, CATALOGUE_PAGE_SIZE)
+
+        filters = [
+            "Collection/Name eq 'SENTINEL-2'",
+            "Attributes/OData.CSC.StringAttribute/any(att:att/Name eq 'productType' and "
+            "att/OData.CSC.StringAttribute/Value eq 'S2MSI2A')",
+            "Attributes/OData.CSC.DoubleAttribute/any(att:att/Name eq 'cloudCover' and "
+            f"att/OData.CSC.DoubleAttribute/Value le {cloud_cover_max})",
+            f"ContentDate/Start ge {format_odata_date(start_date)}",
+            f"ContentDate/End le {format_odata_date(end_date)}",
+        ]
+        if published_after is not None:
+            filters.append(f"PublicationDate gt {format_odata_date(published_after)}")
+
+        # one request per chunk of tile identifiers fitting in URL, followed by its next pages
+        features = self.iter_odata_features(
+            [
+                " and ".join(filters + [f"({tile_filter})"])
+                for tile_filter in get_tile_id_filters(tile_ids)
+            ],
+            page_size,
+        )
+
+        # cached results are stored, others are fetched page by page while consumed
+        if self.query_cache is not None:
+            features = list(features)
+            self.query_cache.set(key, features)
+        return features
+
+    def iter_odata_features(self, odata_filters, page_size):
+        """
+        Lazily query products from CDSE OData API, sorted by sort_by. Products can't be sorted
+        by attribute values such as cloud cover by the API, they are only sorted within each
+        results page then.
+        Input:
+            -odata_filters  list[str]   one query per filter, whose results are chained
+            -page_size      int
+        Output:
+            -               iterator[dict]
+        """
+        order_by = "ContentDate/Start desc" if self.sort_by == "date" else None
+        with CDSEClient() as client:
+            for odata_filter in odata_filters:
+                params = {
+                    "$filter": odata_filter,
+                    "$expand": "Attributes",
+                    "$top": page_size,
+                }
+                if order_by is not None:
+                    params["$orderby"] = order_by
+                url = f"{ODATA_PRODUCTS_URL}?{urlencode(params)}"
+                while url is not None:
+                    response = client.get_json(url)
+                    features = [get_odata_feature(product) for product in response["value"]]
+                    if order_by is None:
+                        features.sort(key=lambda f: f["properties"]["cloudCover"])
+                    yield from features
+                    url = response.get("@odata.nextLink")
+
+    def get_tci_file(self, feature, output_folder):
+        logger = logging.getLogger()
+
+        # reproduce product tree in download cache if any, where files from previous runs are reused
+        if self.download_cache is None:
+            product_folder = output_folder
+        else:
+            product_folder = self.download_cache.get_product_path(feature["id"])
+
+        # download only TCI band and extra files, or only reference them remotely to read windows of it later on
+        with CDSEClient(
+            self.cdse_user,
+            self.cdse_password,
+            pool_maxsize=max(self.pool_maxsize, self.max_workers, self.segments),
+            timeout=(DEFAULT_TIMEOUT[0], self.timeout),
+            token_cache_file=None if self.token_cache_file is None else Path(self.token_cache_file),
+        ) as client:
+            if self.remote_read:
+                logger.info(
+                    f"Referencing remote TCI file for product {feature['properties']['title']}"
+                )
+                feature_id = odata_vrt_with_nodefilter(
+                    feature["id"],
+                    product_folder,
+                    self.cdse_user,
+                    self.cdse_password,
+                    self.nodefilter_patterns,
+                    max_workers=self.max_workers,
+                    client=client,
+                    node_cache=self.node_cache,
+                    node_strategy=self.node_strategy,
+                )
+            elif self.engine == "asyncio":
+                logger.info(f"Downloading TCI file for product {feature['properties']['title']}")
+                feature_id = asyncio_odata_download_with_nodefilter(
+                    feature["id"],
+                    product_folder,
+                    self.cdse_user,
+                    self.cdse_password,
+                    self.nodefilter_patterns,
+                    max_workers=self.max_workers,
+                    client=AsyncCDSEClient(
+                        self.cdse_user,
+                        self.cdse_password,
+                        pool_maxsize=max(self.pool_maxsize, self.max_workers, self.segments),
+                        timeout=(DEFAULT_TIMEOUT[0], self.timeout),
+                        token_cache_file=client.token_manager.cache_file,
+                    ),
+                    node_cache=self.node_cache,
+                    node_strategy=self.node_strategy,
+                    max_attempts=self.max_attempts,
+                    segments=self.segments,
+                    segment_size=self.segment_size * 2**20,
+                )
+            else:
+                logger.info(f"Downloading TCI file for product {feature['properties']['title']}")
+                feature_id = odata_download_with_nodefilter(
+                    feature["id"],
+                    product_folder,
+                    self.cdse_user,
+                    self.cdse_password,
+                    self.nodefilter_patterns,
+                    max_workers=self.max_workers,
+                    client=client,
+                    node_cache=self.node_cache,
+                    node_strategy=self.node_strategy,
+                    max_attempts=self.max_attempts,
+                    segments=self.segments,
+                    segment_size=self.segment_size * 2**20,
+                )
+
+        # keep download cache within its size budget
+        if self.download_cache is not None:
+            self.download_cache.evict(keep=[feature["id"]])
+
+        # report time spent waiting because of CDSE quotas
+        throttled_time = get_governor().get_throttled_time()
+        if any(throttled_time.values()):
+            throttled_summary = ", ".join(f"{k} {v:.1f}s" for k, v in throttled_time.items())
+            logger.info(f"Time throttled by CDSE quotas: {throttled_summary}")
+
+        if feature_id is None:
+            return None
+
+        # find tci file path
+        safe_path = product_folder / feature["properties"]["title"]
+        return next(safe_path.rglob("*_TCI_10m.vrt" if self.remote_read else "*_TCI_10m.jp2"), None)
+
+
+class LocalArchiveDataSource(DataSource):
+    """
+    Products mirrored in a local folder, such as a network share, served without network requests.
+    SAFE products found in the archive folder are described in an index file, from their metadata
+    file, which is updated with products added to or removed from the archive at each run.
+    TCI files are linked into the output folder, so that the archive is never modified.
+    Input:
+        -archive_dir    Path
+        -index_file     Path
+    """
+
+    def __init__(self, archive_dir, index_file):
+        self.archive_dir = archive_dir
+        self.index_file = index_file
+        self.products = None
+        self.lock = threading.Lock()
+
+    def query_features(
+        self,
+        geometry,
+        start_date,
+        end_date,
+        cloud_cover_max,
+        published_after=None,
+        page_size=SEARCH_PAGE_SIZE,
+    ):
+        with self.lock:  # queries may run concurrently, index is only updated once
+            if self.products is None:
+                self.products = self.update_index()
+
+        features = []
+        for product in self.products.values():
+            start = datetime.datetime.fromisoformat(product["start"])
+            if start.tzinfo is None:  # metadata times are UTC
+                start = start.replace(tzinfo=datetime.timezone.utc)
+            if not start_date.astimezone() <= start <= end_date.astimezone():
+                continue
+            if product["cloud_cover"] > cloud_cover_max:
+                continue
+            if not Polygon(product["footprint"]).intersects(geometry):
+                continue
+            features.append(
+                {
+                    "id": product["path"],
+                    "geometry": mapping(Polygon(product["footprint"])),
+                    "properties": {
+                        "title": product["title"],
+                        "startDate": product["start"],
+                        "completionDate": product["stop"],
+                        "cloudCover": product["cloud_cover"],
+                        "tileId": product["tile"],
+                    },
+                }
+            )
+        if self.sort_by == "date":
+            return sorted(features, key=lambda f: f["properties"]["startDate"], reverse=True)
+        return sorted(features, key=lambda f: f["properties"]["cloudCover"])
+
+    def get_tci_file(self, feature, output_folder):
+        with self.lock:
+            if self.products is None:
+                self.products = self.update_index()
+
+        # product may have left archive since it was found, for instance by a local catalogue
+        product = self.products.get(feature["id"])
+        if product is None:
+            logger = logging.getLogger()
+            logger.error(f"Product not found in archive: {feature['properties']['title']}")
+            return None
+        archive_tci_file = self.archive_dir / product["path"] / product["tci"]
+        if not archive_tci_file.exists():
+            return None
+        tci_file = output_folder / product["title"] / archive_tci_file.name
+        tci_file.parent.mkdir(exist_ok=True, parents=True)
+        tci_file.unlink(missing_ok=True)
+        tci_file.symlink_to(archive_tci_file.resolve())
+        return tci_file
+
+    def update_index(self):
+        """
+        Update index file with products currently found in archive folder.
+        Only metadata files of products missing from the index are read.
+        Output:
+            -products   dict[str, dict]     product descriptions by path relative to archive
+        """
+        logger = logging.getLogger()
+
+        try:
+            with open(self.index_file) as file:
+                indexed_products = json.load(file)
+        except (OSError, ValueError):
+            indexed_products = {}
+
+        # list SAFE folders of archive, without walking through their contents
+        safe_paths = []
+        for dirpath, dirnames, _ in os.walk(self.archive_dir):
+            for dirname in [d for d in dirnames if d.endswith(".SAFE")]:
+                safe_paths.append(Path(dirpath, dirname).relative_to(self.archive_dir).as_posix())
+                dirnames.remove(dirname)
+
+        products = {}
+        for safe_path in safe_paths:
+            if safe_path in indexed_products:
+                products[safe_path] = indexed_products[safe_path]
+                continue
+            product = read_safe_metadata(self.archive_dir / safe_path)
+            if product is not None:
+                products[safe_path] = dict(product, path=safe_path)
+
+        if products != indexed_products:
+            logger.info(f"Indexed {len(products)} products of local archive")
+            self.index_file.parent.mkdir(exist_ok=True, parents=True)
+            tmp_file = self.index_file.with_name(f"{self.index_file.name}.{os.getpid()}.tmp")
+            with open(tmp_file, "w") as file:
+                json.dump(products, file, separators=(",", ":"))
+            os.replace(tmp_file, self.index_file)
+        return products
+
+
+class STACDataSource(DataSource):
+    """
+    Products searched with a STAC API, whose items hold direct links to their TCI image.
+    Each query is a single search request. TCI images are read remotely through VRT files, so
+    that windowed reads only fetch the parts of the image they cover, which for Cloud-Optimized
+    GeoTIFF assets are their internal tiles.
+    Input:
+        -stac_url       str
+        -collection     str
+        -username       str or None     CDSE credentials, if assets require authentication
+        -password       str or None
+    """
+
+    query_by_tile_id = True
+
+    def __init__(self, stac_url, collection, username=None, password=None):
+        self.stac_url = stac_url.rstrip("/")
+        self.collection = collection
+        self.username = username
+        self.password = password
+
+    def query_features(
+        self,
+        geometry,
+        start_date,
+        end_date,
+        cloud_cover_max,
+        published_after=None,
+        page_size=SEARCH_PAGE_SIZE,
+    ):
+        return self.search({"intersects": mapping(geometry)}, start_date, end_date, cloud_cover_max)
+
+    def query_tiles(
+        self,
+        tiles,
+        start_date,
+        end_date,
+        cloud_cover_max,
+        published_after=None,
+        page_size=SEARCH_PAGE_SIZE,
+    ):
+        if not has_tile_ids(tiles):
+            return super().query_tiles(
+                tiles, start_date, end_date, cloud_cover_max, published_after, page_size
+            )
+        grid_codes = [f"MGRS-{tile_id}" for tile_id in sorted(set(tiles["tile_id"]))]
+        return self.search(
+            {"query": {"grid:code": {"in": grid_codes}}}, start_date, end_date, cloud_cover_max
+        )
+
+    def search(self, search_filter, start_date, end_date, cloud_cover_max):
+        """
+        Send a search request, and convert returned items to features.
+        Input:
+            -search_filter      dict    spatial part of search request, with 'intersects' or
+                                    'query' parameters
+            -start_date         datetime.datetime
+            -end_date           datetime.datetime
+            -cloud_cover_max    int
+        Output:
+            -                   list[dict]
+        """
+        payload = {
+            "collections": [self.collection],
+            "datetime": f"{start_date.astimezone().isoformat()}/{end_date.astimezone().isoformat()}",
+            "limit": STAC_SEARCH_LIMIT,
+            "sortby": [
+                (
+                    {"field": "properties.datetime", "direction": "desc"}
+                    if self.sort_by == "date"
+                    else {"field": "properties.eo:cloud_cover", "direction": "asc"}
+                )
+            ],
+            **search_filter,
+        }
+        payload["query"] = {
+            **payload.get("query", {}),
+            "eo:cloud_cover": {"lte": cloud_cover_max},
+        }
+        with CDSEClient() as client:
+            items = client.post_json(f"{self.stac_url}/search", payload)["features"]
+
+        features = []
+        for item in items:
+            properties = item["properties"]
+            asset = select_tci_asset(item["assets"])
+            if asset is None or properties.get("eo:cloud_cover", 0) > cloud_cover_max:
+                continue
+            features.append(
+                {
+                    "id": item["id"],
+                    "geometry": item.get("geometry"),
+                    "properties": {
+                        "title": (
+                            item["id"] if item["id"].endswith(".SAFE") else f"{item['id']}.SAFE"
+                        ),
+                        "startDate": properties.get("start_datetime", properties["datetime"]),
+                        "completionDate": properties.get("end_datetime", properties["datetime"]),
+                        "cloudCover": properties.get("eo:cloud_cover"),
+                        "tciHref": asset["href"],
+                    },
+                }
+            )
+        return features
+
+    def get_tci_file(self, feature, output_folder):
+        logger = logging.getLogger()
+        logger.info(f"Referencing remote TCI file for product {feature['properties']['title']}")
+
+        headers = None
+        if self.username is not None:
+            with CDSEClient(self.username, self.password) as client:
+                headers = {"Authorization": f"Bearer {client.token_manager.get_token()}"}
+
+        href = feature["properties"]["tciHref"]
+        vrt_file = output_folder / feature["properties"]["title"] / f"{Path(href).stem}.vrt"
+        try:
+            return write_remote_vrt(href, vrt_file, headers)
+        except Exception as error_msg:
+            logger.error(f"Failed to reference remote TCI file: {error_msg}")
+            return None
+
+
+def select_tci_asset(assets):
+    """
+    Select asset of a STAC item holding its TCI image, preferring Cloud-Optimized GeoTIFFs.
+    Input:
+        -assets     dict[str, dict]     STAC item assets by key
+    Output:
+        -           dict or None        None if item has no TCI asset readable over HTTP
+    """
+    ranked_assets = []
+    for key, asset in assets.items():
+        if key not in STAC_TCI_ASSET_KEYS and "visual" not in asset.get("roles", []):
+            continue
+        if not asset.get("href", "").startswith(("http://", "https://")):
+            continue
+        is_cog = "cloud-optimized" in asset.get("type", "")
+        is_cog |= asset["href"].lower().endswith((".tif", ".tiff"))
+        key_rank = (
+            STAC_TCI_ASSET_KEYS.index(key)
+            if key in STAC_TCI_ASSET_KEYS
+            else len(STAC_TCI_ASSET_KEYS)
+        )
+        ranked_assets.append(((not is_cog, key_rank), asset))
+    if not ranked_assets:
+        return None
+    return min(ranked_assets, key=lambda ranked_asset: ranked_asset[0])[1]
+
+
+def read_safe_metadata(safe_path):
+    """
+    Describe a SAFE product from its metadata file.
+    Input:
+        -safe_path  Path
+    Output:
+        -           dict or None    None if product has no readable metadata file or TCI file
+    """
+    logger = logging.getLogger()
+
+    mtd_file = next(safe_path.glob("MTD_MSIL*.xml"), None)
+    tci_file = next(safe_path.glob("GRANULE/*/IMG_DATA/R10m/*_TCI_10m.jp2"), None)
+    if mtd_file is None or tci_file is None:
+        logger.warning(f"Skipping incomplete product of local archive: {safe_path.name}")
+        return None
+    try:
+        metadata = {
+            element.tag.rsplit("}", 1)[-1]: element.text
+            for element in ET.parse(mtd_file).iter()
+            if element.text is not None
+        }
+        coords = [float(v) for v in metadata["EXT_POS_LIST"].split()]
+        return {
+            "title": safe_path.name,
+            "tci": tci_file.relative_to(safe_path).as_posix(),
+            "tile": safe_path.name.split("_")[5],
+            "start": metadata["PRODUCT_START_TIME"],
+            "stop": metadata["PRODUCT_STOP_TIME"],
+            "cloud_cover": float(metadata["Cloud_Coverage_Assessment"]),
+            "footprint": list(zip(coords[1::2], coords[0::2])),  # lat/lon pairs to lon/lat
+        }
+    except (ET.ParseError, KeyError, ValueError, IndexError) as error_msg:
+        logger.warning(f"Failed to read metadata of {safe_path.name}: {error_msg}")
+        return None
+
+
+def get_data_source(config):
+    """
+    Create data source set in config.
+    Input:
+        -config     configparser.ConfigParser
+            contains:
+                search (optional): data_source, sort_by
+                local_archive: archive_dir, index_file (optional), if data source is "local"
+                stac (optional): url, collection, authenticated, if data source is "stac"
+                see 'CDSEDataSource' if data source is "cdse"
+    Output:
+        -           DataSource
+    """
+    data_source = config.get("search", "data_source", fallback="cdse")
+    sort_by = config.get("search", "sort_by", fallback=DataSource.sort_by)
+    if sort_by not in SEARCH_ORDERS:
+        raise Exception(f"Unknown search order '{sort_by}', expected one of {SEARCH_ORDERS}")
+    if data_source == "cdse":
+        source = CDSEDataSource(config)
+    elif data_source == "local":
+        project_path = Path(__file__).parents[1]
+        source = LocalArchiveDataSource(
+            Path(config.get("local_archive", "archive_dir")),
+            Path(
+                config.get(
+                    "local_archive",
+                    "index_file",
+                    fallback=project_path / "data" / "local_archive_index.json",
+                )
+            ),
+        )
+    elif data_source == "stac":
+        authenticated = config.getboolean("stac", "authenticated", fallback=False)
+        source = STACDataSource(
+            config.get("stac", "url", fallback=DEFAULT_STAC_URL),
+            config.get("stac", "collection", fallback=DEFAULT_STAC_COLLECTION),
+            config.get("access", "cdse_user") if authenticated else None,
+            config.get("access", "cdse_password") if authenticated else None,
+        )
+    else:
+        raise Exception(f"Unknown data source '{data_source}', expected one of {DATA_SOURCES}")
+    source.sort_by = sort_by
+    return source
+
+
+def set_governor_from_config(config):
+    """
+    Apply CDSE quotas set in config to all queries and downloads of the process, whatever the
+    data source. Meant to be called once per process, so that pauses requested by CDSE and
+    throttling counters are kept across attempts.
+    Input:
+        -config     configparser.ConfigParser
+            contains:
+                download (optional): requests_per_second, max_transfers, max_bandwidth
+    """
+    requests_per_second = config.getfloat("download", "requests_per_second", fallback=None)
+    max_transfers = config.getint("download", "max_transfers", fallback=None)
+    max_bandwidth = config.getfloat("download", "max_bandwidth", fallback=None)  # in MiB/s
+    set_governor(
+        Governor(
+            requests_per_second=requests_per_second,
+            max_transfers=max_transfers,
+            bytes_per_second=None if max_bandwidth is None else max_bandwidth * 2**20,
+        )
+    )
+
+
+def search_new_feature(
+    data_source,
+    tiles,
+    start_date,
+    end_date,
+    cloud_cover_max,
+    ledger,
+    query_workers=DEFAULT_QUERY_WORKERS,
+    scorer=None,
+):
+    """
+    Search a product that wasn't processed yet, querying batches of tiles concurrently.
+    Batches are submitted in the order of AOI tiles, with at most query_workers of them
+    running at once. The first batch query to return a new product wins, batches that are not
+    started yet are cancelled, and running ones stop before fetching their next results page.
+    Running queries are waited for, so that none runs once the search is over. If a scorer is
+    given, new products without coastline in their valid data area are skipped, and the best
+    scored product of the winning batch results page is selected.
+    Input:
+        -data_source            DataSource
+        -tiles                  np.ndarray      S2 tiles of AOI in search order
+        -start_date             datetime.datetime
+        -end_date               datetime.datetime
+        -cloud_cover_max        int
+        -ledger                 s2coastalbot.ledger.Ledger  products to skip
+        -query_workers          int
+        -scorer                 s2coastalbot.scoring.CandidateScorer or None
+    Output:
+        -                       dict or None    None if no batch yields a new product
+    """
+    logger = logging.getLogger()
+    stop = threading.Event()
+
+    def query_batch(tiles_subset):
+        logger.info("Querying Sentinel-2 products")
+        features = iter(
+            data_source.query_tiles(tiles_subset, start_date, end_date, cloud_cover_max)
+        )
+
+        # filter out images that were already processed, one page of results at a time so that
+        # following pages are only fetched if all products of previous ones were processed, and
+        # as long as no other batch found a new product
+        while not stop.is_set():
+            page = list(itertools.islice(features, SEARCH_PAGE_SIZE))
+            if len(page) == 0:
+                return []
+            new_features = ledger.filter_new(page)
+            if scorer is not None:
+                new_features = scorer.rank(new_features)
+            if len(new_features) > 0:
+                return new_features
+        return []
+
+    # use sliding window of tiles to query products on all footprint
+    batch_size = data_source.get_batch_size(tiles)
+    batches = iter(
+        tiles[count * batch_size : (count + 1) * batch_size]  # noqa E203
+        for count in range((len(tiles) - 1) // batch_size + 1)
+    )
+
+    executor = ThreadPoolExecutor(max_workers=query_workers)
+    try:
+        running = {
+            executor.submit(query_batch, batch) for _, batch in zip(range(query_workers), batches)
+        }
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                features = future.result()
+                if len(features) > 0:
+                    # select first product that satisfies criteria, best scored one if scorer is
+                    # given, and otherwise newest or least cloudy one
+                    return features[0]
+                batch = next(batches, None)
+                if batch is not None:
+                    running.add(executor.submit(query_batch, batch))
+        return None
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+class Catalogue:
+    """
+    Local catalogue of candidate products, kept in a SQLite file and updated incrementally.
+    Each sync only queries products published since the previous sync, its high-water mark, and
+    drops products acquired before the search time range. Products and high-water marks are
+    scoped by AOI tiles and cloud cover bound, so that a config change triggers a full sync.
+    Input:
+        -catalogue_file     Path
+    """
+
+    def __init__(self, catalogue_file):
+        self.catalogue_file = catalogue_file
+        self.catalogue_file.parent.mkdir(exist_ok=True, parents=True)
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS products (scope TEXT NOT NULL, id TEXT NOT NULL, "
+                "title TEXT NOT NULL, start REAL NOT NULL, feature TEXT NOT NULL, "
+                "PRIMARY KEY (scope, id))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS syncs (scope TEXT PRIMARY KEY, high_water_mark TEXT)"
+            )
+
+    def sync(self, data_source, tiles, timerange, cloud_cover_max, query_workers=1):
+        """
+        Add products published since last sync, and drop products older than time range.
+        Input:
+            -data_source        DataSource
+            -tiles              np.ndarray      S2 tiles of AOI, see 's2coastalbot.aoi'
+            -timerange          int     days
+            -cloud_cover_max    int
+            -query_workers      int     maximum number of batch queries running concurrently
+        Output:
+            -                   int     number of products added or updated
+        """
+        logger = logging.getLogger()
+
+        scope = self.get_scope(tiles, cloud_cover_max)
+        sync_start = datetime.datetime.now(datetime.timezone.utc)
+        start_date = datetime.datetime.now() - datetime.timedelta(days=timerange)
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT high_water_mark FROM syncs WHERE scope = ?", (scope,)
+            ).fetchone()
+        published_after = None if row is None else datetime.datetime.fromisoformat(row[0])
+
+        # query all batches of tiles, keeping high-water mark if any of them fails
+        logger.info(f"Syncing catalogue with products published after {published_after}")
+        batch_size = data_source.get_batch_size(tiles)
+        batches = [
+            tiles[count * batch_size : (count + 1) * batch_size]  # noqa E203
+            for count in range((len(tiles) - 1) // batch_size + 1)
+        ]
+        with ThreadPoolExecutor(max_workers=query_workers) as executor:
+            results = executor.map(
+                lambda batch: data_source.query_tiles(
+                    batch,
+                    start_date,
+                    datetime.datetime.now(),
+                    cloud_cover_max,
+                    published_after=published_after,
+                    page_size=CATALOGUE_PAGE_SIZE,
+                ),
+                batches,
+            )
+            features = {f["id"]: f for batch_features in results for f in batch_features}
+
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        scope,
+                        feature["id"],
+                        feature["properties"]["title"],
+                        get_timestamp(feature["properties"]["startDate"]),
+                        json.dumps(feature, default=str),
+                    )
+                    for feature in features.values()
+                ],
+            )
+            connection.execute(
+                "DELETE FROM products WHERE start < ?", (start_date.astimezone().timestamp(),)
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO syncs VALUES (?, ?)",
+                (scope, (sync_start - CATALOGUE_SYNC_MARGIN).isoformat()),
+            )
+        return len(features)
+
+    def select(
+        self,
+        tiles,
+        timerange,
+        cloud_cover_max,
+        ledger,
+        scorer=None,
+        tile_stats=None,
+        exploration_floor=DEFAULT_EXPLORATION_FLOOR,
+    ):
+        """
+        Select a random product of catalogue that wasn't processed yet, favouring products of
+        tiles whose products were often posted if tile statistics are given, or the best scored
+        one if a scorer is given.
+        Input:
+            -tiles                  np.ndarray      S2 tiles of AOI, see 's2coastalbot.aoi'
+            -timerange              int     days
+            -cloud_cover_max        int
+            -ledger                 s2coastalbot.ledger.Ledger  products to skip
+            -scorer                 s2coastalbot.scoring.CandidateScorer or None
+            -tile_stats             s2coastalbot.ledger.TileStats or None
+            -exploration_floor      float   minimum sampling weight of tiles
+        Output:
+            -                       dict or None    None if catalogue holds no new product
+        """
+        start_date = datetime.datetime.now() - datetime.timedelta(days=timerange)
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT title, feature FROM products WHERE scope = ? AND start >= ?",
+                (
+                    self.get_scope(tiles, cloud_cover_max),
+                    start_date.astimezone().timestamp(),
+                ),
+            ).fetchall()
+
+        # draw a random order of products, weighted by the historical yield of their tile
+        rng = np.random.default_rng()
+        if tile_stats is None:
+            order = rng.permutation(len(rows))
+        else:
+            weights = tile_stats.get_weights(
+                [get_tile_id(title) or "" for title, _ in rows], exploration_floor
+            )
+            order = get_weighted_permutation(rng, weights)
+
+        # look up products in ledger one page at a time, until a new one is found if there is no
+        # scorer
+        candidates = []
+        for page_start in range(0, len(order), SEARCH_PAGE_SIZE):
+            page = [
+                json.loads(rows[index][1])
+                for index in order[page_start : page_start + SEARCH_PAGE_SIZE]  # noqa E203
+            ]
+            candidates.extend(ledger.filter_new(page))
+            if scorer is None and len(candidates) > 0:
+                return candidates[0]
+        ranked_candidates = [] if scorer is None else scorer.rank(candidates)
+        return ranked_candidates[0] if ranked_candidates else None
+
+    @staticmethod
+    def get_scope(tiles, cloud_cover_max):
+        """
+        Identify AOI footprint and cloud cover bound of catalogue products.
+        Input:
+            -tiles              np.ndarray      S2 tiles of AOI, see 's2coastalbot.aoi'
+            -cloud_cover_max    int
+        Output:
+            -                   str
+        """
+        scope_hash = hashlib.sha256(str(cloud_cover_max).encode())
+        scope_hash.update(np.sort(tiles, order=["lon", "lat", "tile_id"]).tobytes())
+        return scope_hash.hexdigest()
+
+    def _connect(self):
+        return sqlite3.connect(self.catalogue_file, timeout=30.0)
+
+
+def get_tiles_geometry(tiles):
+    """
+    Get query geometry of S2 tiles.
+    Input:
+        -tiles      np.ndarray      S2 tiles of AOI, see 's2coastalbot.aoi'
+    Output:
+        -           shapely.geometry.MultiPoint     tiles centroids
+    """
+    return MultiPoint(np.column_stack((tiles["lon"], tiles["lat"])))
+
+
+def get_tile_weights(tiles, tile_stats, exploration_floor, query_cache=None):
+    """
+    Get sampling weights of S2 tiles from the historical yield of their products. With a query
+    cache, weights are only computed once per date bucket of the cache, so that downloads counted
+    in the meantime don't change the order of tiles, and repeated attempts send the same batch
+    queries.
+    Input:
+        -tiles              np.ndarray      S2 tiles of AOI with identifiers
+        -tile_stats         s2coastalbot.ledger.TileStats
+        -exploration_floor  float
+        -query_cache        s2coastalbot.cache.QueryCache or None
+    Output:
+        -                   np.ndarray      in the order of tiles
+    """
+    tile_ids = [str(tile_id) for tile_id in tiles["tile_id"]]
+    if query_cache is None:
+        return tile_stats.get_weights(tile_ids, exploration_floor)
+
+    key = query_cache.get_key("tile_weights", sorted(set(tile_ids)), exploration_floor)
+    snapshot = query_cache.get(key)
+    if snapshot is None:
+        weights = tile_stats.get_weights(tile_ids, exploration_floor)
+        snapshot = [{"tile_id": t, "weight": w} for t, w in zip(tile_ids, weights.tolist())]
+        query_cache.set(key, snapshot)
+    weight_by_tile = {item["tile_id"]: item["weight"] for item in snapshot}
+    return np.array([weight_by_tile[tile_id] for tile_id in tile_ids])
+
+
+def has_tile_ids(tiles):
+    """
+    Check if all S2 tiles have an identifier, so that they can be queried by tile identifiers.
+    Input:
+        -tiles      np.ndarray      S2 tiles of AOI, see 's2coastalbot.aoi'
+    Output:
+        -           bool
+    """
+    return len(tiles) > 0 and bool(np.all(tiles["tile_id"] != ""))
+
+
+def get_tile_id_filters(tile_ids):
+    """
+    Build CDSE OData API filters matching product names of S2 tiles, in chunks short enough to fit
+    in request URLs.
+    Input:
+        -tile_ids   list[str]   MGRS tile identifiers, such as '31TCJ'
+    Output:
+        -           list[str]
+    """
+    filters = []
+    conditions = []
+    for tile_id in tile_ids:
+        condition = f"contains(Name,'_T{tile_id}_')"
+        if len(" or ".join(conditions + [condition])) > ODATA_TILE_FILTER_MAX_LENGTH:
+            filters.append(" or ".join(conditions))
+            conditions = []
+        conditions.append(condition)
+    if conditions:
+        filters.append(" or ".join(conditions))
+    return filters
+
+
+def get_odata_feature(product):
+    """
+    Convert product returned by CDSE OData API to a feature, as returned by CDSE OpenSearch API.
+    Input:
+        -product    dict
+    Output:
+        -           dict
+    """
+    attributes = {attribute["Name"]: attribute["Value"] for attribute in product["Attributes"]}
+    return {
+        "id": product["Id"],
+        "geometry": product.get("GeoFootprint"),
+        "properties": {
+            "title": product["Name"],
+            "startDate": product["ContentDate"]["Start"],
+            "completionDate": product["ContentDate"]["End"],
+            "published": product["PublicationDate"],
+            "cloudCover": attributes.get("cloudCover"),
+        },
+    }
+
+
+def format_odata_date(date):
+    """
+    Format date for CDSE OData API filters, assuming local time if no timezone is set.
+    Input:
+        -date   datetime.datetime
+    Output:
+        -       str
+    """
+    return date.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def get_timestamp(date):
+    """
+    Convert ISO 8601 date of a feature to a POSIX timestamp, assuming UTC if no timezone is set.
+    Input:
+        -date   str or datetime.datetime
+    Output:
+        -       float
+    """
+    if isinstance(date, str):
+        date = datetime.datetime.fromisoformat(date)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date.timestamp()
 
 
 def download_tci_image(config, output_folder=None):
@@ -23,103 +1239,105 @@ def download_tci_image(config, output_folder=None):
     Input:
         -config                 configparser.ConfigParser
             contains:
-                access: cdse_user, cdse_password
                 misc: aoi_file_downloading, cleaning
+                search: cloud_cover_max, timerange, data_source (optional),
+                    query_workers (optional), catalogue_file (optional),
+                    score_candidates (optional), exploration_floor (optional)
+                misc: aoi_file_postprocessing, if candidates are scored
+                see 'get_data_source' for data source options
         -output_folder          Path or None
     Output:
         -tci_file_path          Path
         -                       datetime.datetime
     """
-    logger = logging.getLogger()
-
     project_path = Path(__file__).parents[1]
 
     # read config
-    cdse_user = config.get("access", "cdse_user")
-    cdse_password = config.get("access", "cdse_password")
     aoi_file = Path(config.get("misc", "aoi_file_downloading"))
     cloud_cover_max = config.getint("search", "cloud_cover_max")
     timerange = config.getint("search", "timerange")
+    query_workers = config.getint("search", "query_workers", fallback=DEFAULT_QUERY_WORKERS)
+    catalogue_file = config.get("search", "catalogue_file", fallback=None)
+    score_candidates = config.getboolean("search", "score_candidates", fallback=False)
+    exploration_floor = config.getfloat(
+        "search", "exploration_floor", fallback=DEFAULT_EXPLORATION_FLOOR
+    )
+    data_source = get_data_source(config)
 
     # create output folder if necessary
     if output_folder is None:
         output_folder = project_path / "data"
     output_folder.mkdir(exist_ok=True, parents=True)
 
-    # read list of already downloaded images
-    downloaded_images_file = project_path / "data" / "downloaded_images.csv"
-    if not downloaded_images_file.exists():  # initiate file if necessary
-        downloaded_images = pd.DataFrame(columns=["date", "product"])
-    else:
-        downloaded_images = pd.read_csv(downloaded_images_file)
+    # read list of already downloaded images, and outcomes of previous products of each tile
+    downloaded_images = get_ledger(project_path / "data", "downloaded_images")
+    tile_stats = get_tile_stats(project_path / "data")
 
-    # read and shuffle S2 tiles centroids
-    footprint_df = gpd.read_file(aoi_file)
-    footprint_df = footprint_df.sample(frac=1).reset_index(drop=True)
+    # read and shuffle S2 tiles, in the same order within a date bucket of the query cache so
+    # that repeated attempts send the same batch queries, favouring tiles whose products were
+    # often posted if tiles are identified
+    tiles = load_aoi(aoi_file)
+    random_state = (
+        None if data_source.query_cache is None else data_source.query_cache.get_date_bucket()
+    )
+    rng = np.random.default_rng(random_state)
+    if has_tile_ids(tiles):
+        weights = get_tile_weights(tiles, tile_stats, exploration_floor, data_source.query_cache)
+        tiles = tiles[get_weighted_permutation(rng, weights)]
+    else:
+        tiles = tiles[rng.permutation(len(tiles))]
 
-    # search for suitable product
-    count = 0
-    found_suitable_product = False
-    while not found_suitable_product and count + 1 < len(footprint_df) / 50:
+    # estimate coastline shown by candidate products, to skip those that postprocessing would
+    # reject after download
+    scorer = (
+        get_candidate_scorer(Path(config.get("misc", "aoi_file_postprocessing")))
+        if score_candidates
+        else None
+    )
 
-        # use 50 tiles sliding window to query products on all footprint
-        footprint_subset = footprint_df[count * 50 : (count + 1) * 50]  # noqa E203
-        footprint_subset.reset_index(inplace=True)
-        count += 1
+    # search for suitable product, in local catalogue synced with new products if any
+    if catalogue_file is None:
+        feature = search_new_feature(
+            data_source,
+            tiles,
+            datetime.datetime.now() - datetime.timedelta(days=timerange),
+            datetime.datetime.now(),
+            cloud_cover_max,
+            downloaded_images,
+            query_workers,
+            scorer,
+        )
+    else:
+        catalogue = Catalogue(Path(catalogue_file))
+        catalogue.sync(data_source, tiles, timerange, cloud_cover_max, query_workers)
+        feature = catalogue.select(
+            tiles,
+            timerange,
+            cloud_cover_max,
+            downloaded_images,
+            scorer,
+            tile_stats if has_tile_ids(tiles) else None,
+            exploration_floor,
+        )
 
-        # search images
-        logger.info("Querying Sentinel-2 products")
-        features = query_features(
-            "Sentinel2",
-            {
-                "startDate": datetime.datetime.now() - datetime.timedelta(days=timerange),
-                "completionDate": datetime.datetime.now(),
-                "productType": "S2MSI2A",
-                "geometry": MultiPoint(footprint_subset["geometry"]),
-                "cloudCover": f"[0,{cloud_cover_max}]",
-            },
-        )
-
-        # filter out images that were already processed
-        features = filter(
-            lambda f: f["properties"]["title"][:-5] not in downloaded_images["product"].to_list(),
-            features,
-        )
-
-        features = list(features)
-        if len(features) > 0:
-            # arbitrarily select first product that satisfies criteria
-            feature = features[0]
-            found_suitable_product = True
-
-    if not found_suitable_product:  # case where while loop above didn't generate suitable product
+    if feature is None:  # case where no batch query above generated suitable product
         raise Exception("No suitable product found in any tile within the footprint")
 
-    # download only TCI band
-    logger.info(f"Downloading TCI file for product {feature['properties']['title']}")
-    feature_id = odata_download_with_nodefilter(
-        feature["id"],
-        output_folder / feature["properties"]["title"],
-        cdse_user,
-        cdse_password,
-        "*_TCI_10m.jp2",
-    )
+    # count bytes actually downloaded, none for products read remotely or found locally
+    transferred_bytes = get_governor().get_transferred_bytes()
+    tci_file_path = data_source.get_tci_file(feature, output_folder)
+    transferred_bytes = get_governor().get_transferred_bytes() - transferred_bytes
 
-    if feature_id is None:
+    if tci_file_path is None:
         raise Exception("Failed Sentinel-2 image download")
 
     else:
 
-        # update list of downloaded images
-        downloaded_images.loc[len(downloaded_images)] = [
-            datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
-            feature["properties"]["title"][:-5],
-        ]
-        downloaded_images.to_csv(downloaded_images_file, index=False)
-
-        # find tci file path
-        safe_path = output_folder / feature["properties"]["title"]
-        tci_file_path = next(safe_path.rglob("*_TCI_10m.jp2"))
+        # update list of downloaded images and tile statistics
+        downloaded_images.add(feature["properties"]["title"])
+        tile_id = get_tile_id(feature["properties"]["title"])
+        if tile_id is not None:
+            tile_stats.record(tile_id, "downloaded", transferred_bytes)
 
         return tci_file_path, datetime.datetime.fromisoformat(
             feature["properties"]["completionDate"]
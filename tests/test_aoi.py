@@ -0,0 +1,93 @@
+"""Test compiled AOI tile catalogues."""
+
+# standard library
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+# third party
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import Point
+from shapely.geometry import box
+
+# current project
+from s2coastalbot.aoi import AOI_DTYPE
+from s2coastalbot.aoi import compile_aoi
+from s2coastalbot.aoi import get_weighted_permutation
+from s2coastalbot.aoi import load_aoi
+
+
+@pytest.fixture
+def tmp_dir():
+    """Create and provide temporary directory."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield Path(temp_dir)
+
+
+@pytest.fixture
+def mock_aoi_file(tmp_dir):
+    """Mock AOI file of Sentinel-2 tile centroids."""
+    aoi_file = tmp_dir / "mock_aoi_file.geojson"
+    gdf = gpd.GeoDataFrame(
+        {"Name": ["31TCJ", "T31TDJ"]}, geometry=[Point(1.0, 43.5), Point(2.5, 43.5)], crs=4326
+    )
+    gdf.to_file(aoi_file, driver="GeoJSON")
+    return aoi_file
+
+
+def test_compile_aoi(mock_aoi_file):
+    """Test that compiled AOI catalogue is memory-mapped instead of reading the AOI file."""
+    compiled_file = compile_aoi(mock_aoi_file)
+
+    with mock.patch("s2coastalbot.aoi.read_aoi") as mock_read_aoi:
+        tiles = load_aoi(mock_aoi_file)
+
+    mock_read_aoi.assert_not_called()
+    assert compiled_file == mock_aoi_file.with_suffix(".npy")
+    assert isinstance(tiles, np.memmap)
+    assert tiles.dtype == AOI_DTYPE
+    assert list(tiles["tile_id"]) == ["31TCJ", "31TDJ"]
+    assert list(tiles["lon"]) == [1.0, 2.5]
+    assert np.array_equal(load_aoi(compiled_file), tiles)
+
+
+def test_load_aoi_outdated(tmp_dir, mock_aoi_file):
+    """Test that AOI files more recent than their compiled catalogue are read directly."""
+    compiled_file = compile_aoi(mock_aoi_file)
+    os.utime(compiled_file, (0, 0))
+    gpd.GeoDataFrame(geometry=[box(0, 0, 2, 2)], crs=4326).to_file(mock_aoi_file, driver="GeoJSON")
+
+    tiles = load_aoi(mock_aoi_file)
+
+    assert not isinstance(tiles, np.memmap)
+    assert list(tiles["tile_id"]) == [""]
+    assert (tiles["lon"][0], tiles["lat"][0]) == (1.0, 1.0)
+
+
+def test_read_aoi_invalid_tile_ids(tmp_dir):
+    """Test that names of AOI features that aren't tile identifiers are left empty."""
+    aoi_file = tmp_dir / "mock_named_aoi_file.geojson"
+    gpd.GeoDataFrame(
+        {"name": ["T31TCJ", "Toulouse", "TT31TDJ", None]},
+        geometry=[Point(1.0, 43.5)] * 4,
+        crs=4326,
+    ).to_file(aoi_file, driver="GeoJSON")
+
+    tiles = load_aoi(aoi_file)
+
+    assert list(tiles["tile_id"]) == ["31TCJ", "", "", ""]
+
+
+def test_get_weighted_permutation():
+    """Test that tiles with higher weights tend to come first, and that all tiles are kept."""
+    rng = np.random.default_rng(0)
+    weights = np.array([1.0, 0.1, 0.1, 0.1])
+
+    orders = [get_weighted_permutation(rng, weights) for _ in range(1000)]
+
+    assert all(sorted(order) == [0, 1, 2, 3] for order in orders)
+    first_tile_ratio = np.mean([order[0] == 0 for order in orders])
+    assert first_tile_ratio == pytest.approx(1.0 / 1.3, abs=0.05)
@@ -0,0 +1,95 @@
+"""Tests for the local caches of s2coastalbot."""
+
+# standard library
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+# third party
+import pytest
+
+# current project
+from s2coastalbot.cache import DownloadCache
+from s2coastalbot.cache import NodeCache
+from s2coastalbot.cache import QueryCache
+
+MOCK_NODES = [
+    {
+        "Id": "T57MWM_20240827T234739_TCI_10m.jp2",
+        "Name": "T57MWM_20240827T234739_TCI_10m.jp2",
+        "ContentLength": 135468439,
+        "ChildrenNumber": 0,
+        "Nodes": {"uri": "https://mocked-uri/TCI_10m.jp2/Nodes"},
+    }
+]
+
+
+@pytest.fixture
+def tmp_dir():
+    """Create and provide temporary directory."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield Path(temp_dir)
+
+
+def test_node_cache(tmp_dir):
+    """Test that node trees are stored per product with only relevant metadata."""
+    cache = NodeCache(tmp_dir / "nodes")
+    assert cache.get("mock_feature_id") is None
+
+    cache.set("mock_feature_id", MOCK_NODES)
+
+    assert cache.get("mock_feature_id") == [
+        {
+            "Name": "T57MWM_20240827T234739_TCI_10m.jp2",
+            "ContentLength": 135468439,
+            "Nodes": {"uri": "https://mocked-uri/TCI_10m.jp2/Nodes"},
+        }
+    ]
+    assert cache.get("other_feature_id") is None
+
+
+def test_node_cache_expiry(tmp_dir):
+    """Test that entries older than TTL are dropped."""
+    cache = NodeCache(tmp_dir, ttl=60)
+    with mock.patch("s2coastalbot.cache.time.time", return_value=1000.0):
+        cache.set("mock_feature_id", MOCK_NODES)
+    with mock.patch("s2coastalbot.cache.time.time", return_value=1050.0):
+        assert cache.get("mock_feature_id") is not None
+    with mock.patch("s2coastalbot.cache.time.time", return_value=1070.0):
+        assert cache.get("mock_feature_id") is None
+    assert list(tmp_dir.iterdir()) == []
+
+
+def test_download_cache_eviction(tmp_dir):
+    """Test that least recently used products are evicted once the size budget is exceeded."""
+    cache = DownloadCache(tmp_dir, max_size=250)
+    for i, key in enumerate(["oldest_id", "kept_id", "recent_id"]):
+        tci_file = cache.get_product_path(key) / "product.SAFE" / "GRANULE" / "TCI_10m.jp2"
+        tci_file.parent.mkdir(parents=True)
+        tci_file.write_bytes(b"0" * 100)
+        os.utime(cache.get_product_path(key), (i, i))
+
+    assert cache.evict(keep=["kept_id"]) == ["oldest_id"]
+    assert sorted(path.name for path in tmp_dir.iterdir()) == ["kept_id", "recent_id"]
+
+    # Products in use are kept even when the cache exceeds its budget
+    cache.max_size = 0
+    assert cache.evict(keep=["kept_id", "recent_id"]) == []
+
+
+def test_query_cache(tmp_dir):
+    """Test that query results are shared within a date bucket and expire after TTL."""
+    features = [{"id": "mock_feature_id", "properties": {"title": "mock_product.SAFE"}}]
+    with mock.patch("s2coastalbot.cache.time.time", return_value=7300.0):
+        cache = QueryCache(tmp_dir / "queries.sqlite", ttl=3600)
+        key = cache.get_key("mock_geometry_hash", "S2MSI2A", 30, 10)
+        assert cache.get(key) is None
+        cache.set(key, features)
+    with mock.patch("s2coastalbot.cache.time.time", return_value=7900.0):
+        assert cache.get_key("mock_geometry_hash", "S2MSI2A", 30, 10) == key
+        assert cache.get_key("mock_geometry_hash", "S2MSI2A", 20, 10) != key
+        assert QueryCache(tmp_dir / "queries.sqlite", ttl=3600).get(key) == features
+    with mock.patch("s2coastalbot.cache.time.time", return_value=11000.0):
+        assert cache.get_key("mock_geometry_hash", "S2MSI2A", 30, 10) != key
+        assert cache.get(key) is None
@@ -1,15 +1,38 @@
 """Test functionalities to download data using CDSE's OData API."""
 
 # standard library
-import json
+import hashlib
+import http.server
+import stat
 import tempfile
+import threading
 from pathlib import Path
 from unittest import mock
 
+# third party
+import numpy as np
+import pytest
+import rasterio
+import requests
+from rasterio.windows import Window
+
 # current project
+from s2coastalbot.cache import NodeCache
+from s2coastalbot.cdse import DEFAULT_MAX_WORKERS
+from s2coastalbot.cdse import DEFAULT_TIMEOUT
+from s2coastalbot.cdse import CDSEClient
+from s2coastalbot.cdse import NodeFilter
+from s2coastalbot.cdse import PartialDownload
+from s2coastalbot.cdse import TokenManager
+from s2coastalbot.cdse import download_node
+from s2coastalbot.cdse import download_node_segmented
+from s2coastalbot.cdse import get_node_path
 from s2coastalbot.cdse import odata_download_with_nodefilter
+from s2coastalbot.cdse import parse_manifest_file_nodes
 from s2coastalbot.cdse import search_nodes
+from s2coastalbot.cdse import write_remote_vrt
 from s2coastalbot.custom_logger import get_custom_logger
+from s2coastalbot.governor import Governor
 
 MOCK_TCI_NODE = {
     "Id": "T57MWM_20240827T234739_TCI_10m.jp2",
@@ -44,21 +67,53 @@ MOCK_NESTED_MTD_NODE = {
     "Nodes": {"uri": "https://mocked-uri/folder/nested_mtd_file.xml/Nodes"},
 }
 
+MOCK_TOKENS = {
+    "access_token": "mock_access",
+    "expires_in": 600,
+    "refresh_token": "mock_refresh",
+    "refresh_expires_in": 3600,
+}
+
+MOCK_SAFE_NODE = {
+    "Name": "S2A_MSIL2A_20240827T234739_N0511_R130_T57MWM_20240828T012345.SAFE",
+    "ContentLength": 0,
+    "ChildrenNumber": 6,
+    "Nodes": {"uri": "https://mocked-uri/Nodes(product.SAFE)/Nodes"},
+}
+MOCK_MANIFEST = b"""<?xml version="1.0" encoding="UTF-8"?>
+<xfdu:XFDU xmlns:xfdu="urn:ccsds:schema:xfdu:1" version="esa/safe/sentinel/1.1/sentinel-2/msi">
+  <dataObjectSection>
+    <dataObject ID="IMG_DATA_Band_TCI_10m_Tile1_Data">
+      <byteStream mimeType="application/octet-stream" size="135468439">
+        <fileLocation locatorType="URL" href="./GRANULE/L2A_T57MWM/IMG_DATA/R10m/T57MWM_TCI_10m.jp2"/>
+        <checksum checksumName="MD5">0123456789abcdef0123456789abcdef</checksum>
+      </byteStream>
+    </dataObject>
+    <dataObject ID="S2_Level-2A_Product_Metadata">
+      <byteStream mimeType="text/xml" size="54321">
+        <fileLocation locatorType="URL" href="./MTD_MSIL2A.xml"/>
+        <checksum checksumName="MD5">fedcba9876543210fedcba9876543210</checksum>
+      </byteStream>
+    </dataObject>
+  </dataObjectSection>
+</xfdu:XFDU>
+"""
+
 
 def test_search_nodes():
 
     # Mock OData API request
     mock_response = mock.MagicMock()
-    mock_response.text = json.dumps({"result": [MOCK_TCI_NODE, MOCK_B8_NODE]})
+    mock_response.json.return_value = {"result": [MOCK_TCI_NODE, MOCK_B8_NODE]}
     mock_odata = mock.MagicMock(return_value=mock_response)
 
     # Call search_nodes while patching odata request and assert that only expected node is returned
-    with mock.patch("s2coastalbot.cdse.requests.get", mock_odata):
+    with mock.patch("s2coastalbot.cdse.requests.Session.get", mock_odata):
         filtered_nodes = search_nodes(node_url="", pattern="*TCI_10m.jp2")
     assert filtered_nodes == [MOCK_TCI_NODE]
 
     # Perform same test with 'exclude' option
-    with mock.patch("s2coastalbot.cdse.requests.get", mock_odata):
+    with mock.patch("s2coastalbot.cdse.requests.Session.get", mock_odata):
         filtered_nodes = search_nodes(node_url="", pattern="*TCI_10m.jp2", exclude=True)
     assert filtered_nodes == [MOCK_B8_NODE]
 
@@ -68,13 +123,15 @@ def test_search_nodes_with_folder():
 
     # Mock OData API requests: first at root folder level, then at nested file level
     mock_response_nested = mock.MagicMock()
-    mock_response_nested.text = json.dumps({"result": [MOCK_NESTED_IMG_NODE, MOCK_NESTED_MTD_NODE]})
+    mock_response_nested.json.return_value = {
+        "result": [MOCK_NESTED_IMG_NODE, MOCK_NESTED_MTD_NODE]
+    }
     mock_response_root = mock.MagicMock()
-    mock_response_root.text = json.dumps({"result": [MOCK_FOLDER_NODE, MOCK_TCI_NODE]})
+    mock_response_root.json.return_value = {"result": [MOCK_FOLDER_NODE, MOCK_TCI_NODE]}
     mock_odata = mock.MagicMock(side_effect=[mock_response_root, mock_response_nested])
 
     # Call search_nodes while patching the odata request
-    with mock.patch("s2coastalbot.cdse.requests.get", mock_odata):
+    with mock.patch("s2coastalbot.cdse.requests.Session.get", mock_odata):
         filtered_nodes = search_nodes(node_url="", pattern="*.jp2")
 
     # Ensure that both the root node and the nested node are returned
@@ -84,22 +141,262 @@ def test_search_nodes_with_folder():
     assert MOCK_NESTED_IMG_NODE in filtered_nodes
 
 
+def test_search_nodes_with_sibling_folders():
+    """Test that sibling folders are all listed and that nodes keep the product tree order."""
+
+    # Mock OData API responses depending on requested url
+    second_folder_node = {
+        "Name": "second_folder",
+        "ContentLength": 0,
+        "ChildrenNumber": 1,
+        "Nodes": {"uri": "https://mocked-uri/second_folder/Nodes"},
+    }
+    second_nested_node = dict(MOCK_NESTED_IMG_NODE, Name="second_nested_raster_file.jp2")
+    listings = {
+        "root": [MOCK_FOLDER_NODE, MOCK_TCI_NODE, second_folder_node],
+        MOCK_FOLDER_NODE["Nodes"]["uri"]: [MOCK_NESTED_IMG_NODE, MOCK_NESTED_MTD_NODE],
+        second_folder_node["Nodes"]["uri"]: [second_nested_node],
+    }
+
+    def mock_get(url, **kwargs):
+        mock_response = mock.MagicMock()
+        mock_response.json.return_value = {"result": listings[url]}
+        return mock_response
+
+    # Call search_nodes while patching the odata request
+    with mock.patch("s2coastalbot.cdse.requests.Session.get", side_effect=mock_get) as mock_odata:
+        filtered_nodes = search_nodes(node_url="root", pattern="*.jp2", max_workers=2)
+
+    # Ensure that each folder was listed once and that depth-first order is preserved
+    assert mock_odata.call_count == 3
+    assert filtered_nodes == [MOCK_NESTED_IMG_NODE, MOCK_TCI_NODE, second_nested_node]
+
+
+def test_node_filter():
+    """Test matching of several include and exclude patterns compiled at once."""
+    node_filter = NodeFilter(["*_TCI_10m.jp2", "*_SCL_20m.jp2", "*.jp2"], "*_B08_*")
+
+    assert node_filter.match(MOCK_TCI_NODE["Name"]) == "*_TCI_10m.jp2"
+    assert node_filter.match("T57MWM_20240827T234739_SCL_20m.jp2") == "*_SCL_20m.jp2"
+    assert node_filter.match(MOCK_B8_NODE["Name"]) is None
+    assert node_filter.match(MOCK_NESTED_MTD_NODE["Name"]) is None
+
+
+def test_search_nodes_with_several_patterns():
+    """Test that a single traversal returns nodes matching any of several patterns."""
+
+    mock_client = mock.MagicMock()
+    mock_client.get_json.side_effect = [
+        {"result": [MOCK_FOLDER_NODE, MOCK_TCI_NODE, MOCK_B8_NODE]},
+        {"result": [MOCK_NESTED_IMG_NODE, MOCK_NESTED_MTD_NODE]},
+    ]
+
+    filtered_nodes = search_nodes("", ["*TCI_10m.jp2", "*.xml"], client=mock_client)
+
+    assert mock_client.get_json.call_count == 2
+    assert filtered_nodes == [MOCK_NESTED_MTD_NODE, MOCK_TCI_NODE]
+
+
+def test_search_nodes_with_cache():
+    """Test that cached node trees are used without request, whatever the pattern."""
+
+    mock_response = mock.MagicMock()
+    mock_response.json.return_value = {"result": [MOCK_TCI_NODE, MOCK_B8_NODE]}
+    mock_odata = mock.MagicMock(return_value=mock_response)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = NodeCache(Path(tmp_dir))
+        with mock.patch("s2coastalbot.cdse.requests.Session.get", mock_odata):
+            tci_nodes = search_nodes("", "*TCI_10m.jp2", cache=cache, cache_key="mock_feature_id")
+            b8_nodes = search_nodes("", "*B08_10m.jp2", cache=cache, cache_key="mock_feature_id")
+
+    assert mock_odata.call_count == 1
+    assert tci_nodes == [MOCK_TCI_NODE]
+    assert b8_nodes[0]["Nodes"]["uri"] == MOCK_B8_NODE["Nodes"]["uri"]
+
+
+def test_search_nodes_with_manifest():
+    """Test that file nodes are built from the product manifest without traversal."""
+
+    mock_client = mock.MagicMock()
+    mock_client.get_json.return_value = {"result": [MOCK_SAFE_NODE]}
+    mock_client.get.return_value = mock.MagicMock(status_code=200, content=MOCK_MANIFEST)
+
+    filtered_nodes = search_nodes(
+        "https://mocked-uri/Nodes", "*TCI_10m.jp2", client=mock_client, strategy="manifest"
+    )
+
+    mock_client.get_json.assert_called_once_with("https://mocked-uri/Nodes")
+    mock_client.get.assert_called_once_with(
+        "https://mocked-uri/Nodes(product.SAFE)/Nodes(manifest.safe)/$value", authenticated=True
+    )
+    assert filtered_nodes == [
+        {
+            "Name": "T57MWM_TCI_10m.jp2",
+            "ContentLength": 135468439,
+            "Nodes": {
+                "uri": "https://mocked-uri/Nodes(product.SAFE)/Nodes(GRANULE)/Nodes(L2A_T57MWM)/"
+                "Nodes(IMG_DATA)/Nodes(R10m)/Nodes(T57MWM_TCI_10m.jp2)/Nodes"
+            },
+            "Checksum": [{"Algorithm": "MD5", "Value": "0123456789abcdef0123456789abcdef"}],
+        }
+    ]
+
+
+def test_get_node_path():
+    """Test that node paths reproduce the product tree, from their OData API uri."""
+    manifest_node = {
+        "Name": "T57MWM_TCI_10m.jp2",
+        "Nodes": {
+            "uri": "https://mocked-uri/Products(mock_feature_id)/Nodes(product.SAFE)/"
+            "Nodes(GRANULE)/Nodes(T57MWM_TCI_10m.jp2)/Nodes"
+        },
+    }
+    unsafe_node = dict(manifest_node, Nodes={"uri": "https://mocked-uri/Nodes(..)/Nodes(a.jp2)"})
+
+    assert get_node_path(manifest_node) == Path("product.SAFE/GRANULE/T57MWM_TCI_10m.jp2")
+    assert get_node_path(MOCK_TCI_NODE) == Path(MOCK_TCI_NODE["Name"])
+    assert get_node_path(unsafe_node) == Path("T57MWM_TCI_10m.jp2")
+
+
+def test_search_nodes_without_manifest():
+    """Test that node tree is traversed if product manifest is missing."""
+
+    mock_client = mock.MagicMock()
+    mock_client.get_json.side_effect = [
+        {"result": [MOCK_SAFE_NODE]},
+        {"result": [MOCK_SAFE_NODE]},
+        {"result": [MOCK_TCI_NODE, MOCK_B8_NODE]},
+    ]
+    mock_client.get.return_value = mock.MagicMock(status_code=404)
+
+    filtered_nodes = search_nodes(
+        "https://mocked-uri/Nodes", "*TCI_10m.jp2", client=mock_client, strategy="manifest"
+    )
+
+    assert filtered_nodes == [MOCK_TCI_NODE]
+    assert mock_client.get_json.call_count == 3
+
+
+def test_parse_manifest_file_nodes_with_unexpected_byte_stream():
+    """Test that manifests with incomplete byte streams can't be used, instead of crashing."""
+    safe_url = "https://mocked-uri/Nodes(product.SAFE)/"
+    without_location = MOCK_MANIFEST.replace(
+        b'<fileLocation locatorType="URL" href="./MTD_MSIL2A.xml"/>', b""
+    )
+    without_size = MOCK_MANIFEST.replace(b' size="54321"', b"")
+
+    assert len(parse_manifest_file_nodes(MOCK_MANIFEST, safe_url)) == 2
+    assert parse_manifest_file_nodes(without_location, safe_url) is None
+    assert parse_manifest_file_nodes(without_size, safe_url) is None
+    assert parse_manifest_file_nodes(b"<xfdu:XFDU", safe_url) is None
+
+
+def test_cdse_client_authenticates_once():
+    """Test that authenticated requests share the client session and access token."""
+
+    mock_token_response = mock.MagicMock(status_code=200)
+    mock_token_response.json.return_value = MOCK_TOKENS
+    mock_session_post = mock.MagicMock(return_value=mock_token_response)
+    mock_session_get = mock.MagicMock()
+
+    with mock.patch("s2coastalbot.cdse.requests.Session.post", mock_session_post), mock.patch(
+        "s2coastalbot.cdse.requests.Session.get", mock_session_get
+    ):
+        with CDSEClient("mock_user", "mock_pwd", timeout=5.0) as client:
+            client.get("https://mocked-uri/first", authenticated=True)
+            client.get("https://mocked-uri/second", authenticated=True)
+            client.get("https://mocked-uri/third")
+
+    mock_session_post.assert_called_once()
+    assert mock_session_get.call_count == 3
+    mock_session_get.assert_any_call(
+        "https://mocked-uri/second", headers={"Authorization": "Bearer mock_access"}, timeout=5.0
+    )
+    mock_session_get.assert_called_with("https://mocked-uri/third", timeout=5.0)
+
+
+def test_cdse_client_retry_after():
+    """Test that throttling responses are retried once the governor pause is over."""
+
+    throttled_response = mock.MagicMock(status_code=429, headers={"Retry-After": "0"})
+    mock_response = mock.MagicMock(status_code=200)
+    mock_session_get = mock.MagicMock(side_effect=[throttled_response, mock_response])
+    governor = Governor()
+
+    with mock.patch("s2coastalbot.cdse.requests.Session.get", mock_session_get):
+        with CDSEClient(governor=governor) as client:
+            response = client.get("https://mocked-uri/throttled")
+
+    assert response is mock_response
+    assert mock_session_get.call_count == 2
+    throttled_response.close.assert_called_once()
+    assert governor.throttled_responses == 1
+
+
+def test_token_manager_refresh():
+    """Test that access token is cached, then renewed using refresh token once expired."""
+
+    mock_session = mock.MagicMock()
+    mock_session.post.return_value.status_code = 200
+    mock_session.post.return_value.json.return_value = MOCK_TOKENS
+    token_manager = TokenManager("mock_user", "mock_pwd", session=mock_session)
+
+    with mock.patch("s2coastalbot.cdse.time.time", return_value=1000.0):
+        assert token_manager.get_token() == "mock_access"
+        assert token_manager.get_token() == "mock_access"
+    assert mock_session.post.call_count == 1
+    assert mock_session.post.call_args[1]["data"]["grant_type"] == "password"
+
+    # Access token expires after 600 s, it is refreshed before expiry
+    with mock.patch("s2coastalbot.cdse.time.time", return_value=1000.0 + 590):
+        token_manager.get_token()
+    assert mock_session.post.call_count == 2
+    assert mock_session.post.call_args[1]["data"] == {
+        "grant_type": "refresh_token",
+        "refresh_token": "mock_refresh",
+        "client_id": "cdse-public",
+    }
+
+
+def test_token_manager_cache_file():
+    """Test that tokens are shared between runs through a private cache file."""
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_file = Path(tmp_dir) / "tokens" / "cdse_token.json"
+
+        mock_session = mock.MagicMock()
+        mock_session.post.return_value.status_code = 200
+        mock_session.post.return_value.json.return_value = MOCK_TOKENS
+        TokenManager("mock_user", "mock_pwd", cache_file, mock_session).get_token()
+        assert stat.S_IMODE(cache_file.stat().st_mode) == 0o600
+
+        # A new manager reads token from cache file without requesting identity provider
+        mock_session.reset_mock()
+        assert TokenManager("mock_user", "mock_pwd", cache_file, mock_session).get_token() == (
+            "mock_access"
+        )
+        mock_session.post.assert_not_called()
+
+        # Tokens of another user are ignored
+        TokenManager("other_user", "mock_pwd", cache_file, mock_session).get_token()
+        mock_session.post.assert_called_once()
+
+
 def test_odata_download_with_nodefilter():
 
     # Create temporary dir for output path
     with tempfile.TemporaryDirectory() as tmp_dir:
         tmp_dir = Path(tmp_dir)
 
-        # Mock download request, nodes search, and open()
+        # Mock download request and nodes search
+        tci_node = dict(MOCK_TCI_NODE, ContentLength=len(b"data_chunk"))
         mock_download_response = mock.MagicMock()
         mock_download_response.status_code = 200
         mock_download_response.iter_content.return_value = [b"data_chunk"]
-        mock_session = mock.MagicMock()
-        mock_session.get.return_value = mock_download_response
-        mock_credentials = mock.MagicMock()
-        mock_credentials.return_value.get_session.return_value = mock_session
-        mock_nodes_search = mock.MagicMock(return_value=[MOCK_TCI_NODE])
-        mock_open_file = mock.mock_open()
+        mock_session_get = mock.MagicMock(return_value=mock_download_response)
+        mock_get_token = mock.MagicMock(return_value="mock_token")
+        mock_nodes_search = mock.MagicMock(return_value=[tci_node])
 
         # Call download function with mock args
         feature_id = "mock_feature_id"
@@ -107,9 +404,9 @@ def test_odata_download_with_nodefilter():
         username = "mock_user"
         password = "mock_pwd"
         nodefilter_pattern = "*TCI_10m.jp2"
-        with mock.patch("s2coastalbot.cdse.Credentials", mock_credentials), mock.patch(
-            "s2coastalbot.cdse.search_nodes", mock_nodes_search
-        ), mock.patch("s2coastalbot.cdse.open", mock_open_file):
+        with mock.patch("s2coastalbot.cdse.TokenManager.get_token", mock_get_token), mock.patch(
+            "s2coastalbot.cdse.requests.Session.get", mock_session_get
+        ), mock.patch("s2coastalbot.cdse.search_nodes", mock_nodes_search):
             result = odata_download_with_nodefilter(
                 feature_id, output_path, username, password, nodefilter_pattern=nodefilter_pattern
             )
@@ -119,10 +416,20 @@ def test_odata_download_with_nodefilter():
             f"https://download.dataspace.copernicus.eu/odata/v1/Products({feature_id})/Nodes",
             nodefilter_pattern,
             False,
+            DEFAULT_MAX_WORKERS,
+            mock.ANY,
+            None,
+            feature_id,
+            "traversal",
+        )
+        mock_session_get.assert_called_with(
+            "https://mocked-uri/TCI_10m.jp2/$value",
+            stream=True,
+            headers={"Accept-Encoding": "identity", "Authorization": "Bearer mock_token"},
+            timeout=DEFAULT_TIMEOUT,
         )
-        mock_session.get.assert_called_with("https://mocked-uri/TCI_10m.jp2/$value", stream=True)
-        mock_opened_file = mock_open_file()
-        mock_opened_file.write.assert_called_with(b"data_chunk")
+        assert (tmp_dir / tci_node["Name"]).read_bytes() == b"data_chunk"
+        assert list(tmp_dir.glob("*.part")) == []
 
 
 def test_odata_download_with_nodefilter_failure(caplog):
@@ -138,10 +445,8 @@ def test_odata_download_with_nodefilter_failure(caplog):
         # Mock download request, nodes search, and open()
         mock_download_response = mock.MagicMock()
         mock_download_response.status_code = 404
-        mock_session = mock.MagicMock()
-        mock_session.get.return_value = mock_download_response
-        mock_credentials = mock.MagicMock()
-        mock_credentials.return_value.get_session.return_value = mock_session
+        mock_session_get = mock.MagicMock(return_value=mock_download_response)
+        mock_get_token = mock.MagicMock(return_value="mock_token")
         mock_nodes_search = mock.MagicMock(return_value=[MOCK_TCI_NODE])
         mock_open_file = mock.mock_open()
 
@@ -150,13 +455,313 @@ def test_odata_download_with_nodefilter_failure(caplog):
         output_path = tmp_dir
         username = "mock_user"
         password = "mock_pwd"
-        with mock.patch("s2coastalbot.cdse.Credentials", mock_credentials), mock.patch(
-            "s2coastalbot.cdse.search_nodes", mock_nodes_search
-        ), mock.patch("s2coastalbot.cdse.open", mock_open_file):
+        with mock.patch("s2coastalbot.cdse.TokenManager.get_token", mock_get_token), mock.patch(
+            "s2coastalbot.cdse.requests.Session.get", mock_session_get
+        ), mock.patch("s2coastalbot.cdse.search_nodes", mock_nodes_search), mock.patch(
+            "s2coastalbot.cdse.open", mock_open_file
+        ):
             result = odata_download_with_nodefilter(
                 feature_id, output_path, username, password, nodefilter_pattern="*TCI_10m.jp2"
             )
 
-        assert result == feature_id
+        assert result is None
         assert "Failed to download file. Status code: 404" in caplog.text
         mock_open_file.assert_not_called()
+        mock_download_response.close.assert_called_once()
+
+
+def test_download_node_resume():
+    """Test that an interrupted download is resumed from the partially downloaded file."""
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_file = Path(tmp_dir) / "TCI_10m.jp2"
+        node = dict(MOCK_TCI_NODE, ContentLength=len(b"first_chunk_second_chunk"))
+
+        # Mock a first response interrupted after one chunk, then a partial content response
+        def interrupted_content(chunk_size):
+            yield b"first_chunk_"
+            raise requests.exceptions.ChunkedEncodingError("Connection broken")
+
+        interrupted_response = mock.MagicMock(status_code=200)
+        interrupted_response.iter_content.side_effect = interrupted_content
+        partial_response = mock.MagicMock(status_code=206)
+        partial_response.iter_content.return_value = [b"second_chunk"]
+        mock_client = mock.MagicMock()
+        mock_client.get.side_effect = [interrupted_response, partial_response]
+
+        assert download_node(node, output_file, mock_client)
+
+        assert output_file.read_bytes() == b"first_chunk_second_chunk"
+        assert not output_file.with_name("TCI_10m.jp2.part").exists()
+        assert mock_client.get.call_args[1]["headers"]["Range"] == "bytes=12-"
+
+        # Complete files are not downloaded again
+        mock_client.reset_mock()
+        assert download_node(node, output_file, mock_client)
+        mock_client.get.assert_not_called()
+
+
+def test_download_node_checksum():
+    """Test checksum computed across resumed attempts, and new download of corrupted files."""
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_file = Path(tmp_dir) / "TCI_10m.jp2"
+        contents = b"first_chunk_second_chunk"
+        node = dict(
+            MOCK_TCI_NODE,
+            ContentLength=len(contents),
+            Checksum=[
+                {"Algorithm": "BLAKE3", "Value": "not_supported_by_hashlib"},
+                {"Algorithm": "MD5", "Value": hashlib.md5(contents).hexdigest().upper()},
+            ],
+        )
+
+        # Mock a corrupted response, then an interrupted one, then a partial content response
+        def interrupted_content(chunk_size):
+            yield b"first_chunk_"
+            raise requests.exceptions.ChunkedEncodingError("Connection broken")
+
+        corrupted_response = mock.MagicMock(status_code=200)
+        corrupted_response.iter_content.return_value = [b"first_chunk_second_chunc"]
+        interrupted_response = mock.MagicMock(status_code=200)
+        interrupted_response.iter_content.side_effect = interrupted_content
+        partial_response = mock.MagicMock(status_code=206)
+        partial_response.iter_content.return_value = [b"second_chunk"]
+        mock_client = mock.MagicMock()
+        mock_client.get.side_effect = [corrupted_response, interrupted_response, partial_response]
+
+        assert download_node(node, output_file, mock_client)
+
+        assert output_file.read_bytes() == contents
+        assert mock_client.get.call_count == 3
+        assert "Range" not in mock_client.get.call_args_list[1][1]["headers"]
+
+        # Corrupted files are not kept
+        output_file.unlink()
+        mock_client.get.side_effect = [corrupted_response] * 2
+        assert not download_node(node, output_file, mock_client, max_attempts=2)
+        assert list(Path(tmp_dir).iterdir()) == []
+
+
+def test_partial_download():
+    """Test resume offsets of partial files left by segmented and sequential downloads."""
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_file = Path(tmp_dir) / "TCI_10m.jp2"
+        contents = bytes(range(256)) * 4
+        node = dict(MOCK_TCI_NODE, ContentLength=len(contents))
+
+        # Segmented download writing its first and third ranges only
+        download = PartialDownload(node, output_file)
+        assert download.start_segments(300) == [(0, 299), (300, 599), (600, 899), (900, 1023)]
+        for start, end in [(0, 299), (600, 899)]:
+            download.write_at(contents[start : end + 1], start)  # noqa E203
+            download.add_segment((start, end))
+        download.close()
+
+        # Segmented download resumes missing ranges, sequential download its leading bytes
+        download = PartialDownload(node, output_file)
+        assert download.start_segments(300) == [(300, 599), (900, 1023)]
+        download.close()
+        download = PartialDownload(node, output_file)
+        assert download.get_offset() == 300
+        assert download.get_headers(300) == {"Accept-Encoding": "identity", "Range": "bytes=300-"}
+        assert not download.segments_file.exists()
+        with download.open(206) as file:
+            download.write(file, contents[300:])
+        assert download.finish(1, 1)
+        assert output_file.read_bytes() == contents
+
+
+def test_download_node_segmented():
+    """Test that byte ranges are downloaded concurrently and written in place."""
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_file = Path(tmp_dir) / "TCI_10m.jp2"
+        contents = bytes(range(256)) * 4
+        node = dict(MOCK_TCI_NODE, ContentLength=len(contents))
+        interrupted_ranges = []
+
+        # Mock partial content responses, interrupting the first request of the second range
+        def mock_get(url, **kwargs):
+            start, end = map(int, kwargs["headers"]["Range"].split("=")[1].split("-"))
+            response = mock.MagicMock(status_code=206)
+            if start == 300 and not interrupted_ranges:
+                interrupted_ranges.append(start)
+
+                def interrupted_content(chunk_size):
+                    yield contents[start:310]
+                    raise requests.exceptions.ConnectionError("Connection reset")
+
+                response.iter_content.side_effect = interrupted_content
+            else:
+                response.iter_content.return_value = [contents[start : end + 1]]  # noqa E203
+            return response
+
+        mock_client = mock.MagicMock()
+        mock_client.get.side_effect = mock_get
+
+        assert download_node_segmented(node, output_file, mock_client, 3, 300)
+
+        assert output_file.read_bytes() == contents
+        assert not output_file.with_name("TCI_10m.jp2.part").exists()
+        requested_ranges = [c[1]["headers"]["Range"] for c in mock_client.get.call_args_list]
+        assert sorted(requested_ranges) == [
+            "bytes=0-299",
+            "bytes=300-599",
+            "bytes=310-599",
+            "bytes=600-899",
+            "bytes=900-1023",
+        ]
+        assert not output_file.with_name("TCI_10m.jp2.segments").exists()
+
+
+def test_download_node_segmented_resume():
+    """Test that only missing byte ranges are downloaded after an interrupted download."""
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_file = Path(tmp_dir) / "TCI_10m.jp2"
+        part_file = output_file.with_name("TCI_10m.jp2.part")
+        contents = bytes(range(256)) * 4
+        node = dict(MOCK_TCI_NODE, ContentLength=len(contents))
+
+        # Mock partial content responses, failing for the second range in the first download
+        def mock_get(url, **kwargs):
+            start, end = map(int, kwargs["headers"]["Range"].split("=")[1].split("-"))
+            response = mock.MagicMock(status_code=206)
+            if start == 400 and mock_client.fail:
+                response.status_code = 503
+            response.iter_content.return_value = [contents[start : end + 1]]  # noqa E203
+            return response
+
+        mock_client = mock.MagicMock()
+        mock_client.get.side_effect = mock_get
+
+        # Partial file of a sequential download is kept, as well as downloaded segments
+        part_file.write_bytes(contents[:100])
+        mock_client.fail = True
+        assert not download_node_segmented(node, output_file, mock_client, 3, 300)
+        assert part_file.exists()
+
+        mock_client.fail = False
+        mock_client.get.reset_mock()
+        assert download_node_segmented(node, output_file, mock_client, 3, 300)
+
+        assert output_file.read_bytes() == contents
+        assert not part_file.exists()
+        assert not output_file.with_name("TCI_10m.jp2.segments").exists()
+        requested_ranges = [c[1]["headers"]["Range"] for c in mock_client.get.call_args_list]
+        assert requested_ranges == ["bytes=400-699"]
+
+
+def test_download_node_segmented_without_range_support():
+    """Test sequential download from a server ignoring range requests."""
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_file = Path(tmp_dir) / "TCI_10m.jp2"
+        contents = bytes(range(256)) * 4
+        node = dict(MOCK_TCI_NODE, ContentLength=len(contents))
+        mock_response = mock.MagicMock(status_code=200)
+        mock_response.iter_content.return_value = [contents]
+        mock_client = mock.MagicMock()
+        mock_client.get.return_value = mock_response
+
+        assert download_node_segmented(node, output_file, mock_client, 3, 300)
+
+        assert output_file.read_bytes() == contents
+        assert "Range" not in mock_client.get.call_args[1]["headers"]
+        mock_response.close.assert_called()
+
+
+@pytest.fixture
+def http_stand_in():
+    """Serve files over HTTP from a local server supporting range requests.
+
+    Returns:
+        files (dict[str, bytes]): Served files contents by url path, to be filled by tests
+        requests_log (list[dict]): Path, headers and response size of each request
+        base_url (str)
+    """
+    files = {}
+    requests_log = []
+
+    class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            self.send_response(200 if self.path in files else 404)
+            self.send_header("Content-Length", str(len(files.get(self.path, b""))))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+
+        def do_GET(self):
+            if self.path not in files:
+                self.send_response(404)
+                self.end_headers()
+                return
+            data = files[self.path]
+            byte_range = self.headers.get("Range")
+            if byte_range is None:
+                body = data
+                self.send_response(200)
+            else:
+                start, end = byte_range.split("=")[1].split("-")
+                start, end = int(start), min(int(end or len(data) - 1), len(data) - 1)
+                body = data[start : end + 1]  # noqa E203
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            requests_log.append({"path": self.path, "headers": self.headers, "size": len(body)})
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield files, requests_log, f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_write_remote_vrt(http_stand_in):
+    """Test that a window of a remote JP2 file is read without fetching the whole file."""
+
+    files, requests_log, base_url = http_stand_in
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+
+        # Create tiled JP2 fixture and serve it as a CDSE node value
+        image = np.random.default_rng(0).integers(0, 255, (3, 2048, 2048), dtype=np.uint8)
+        with rasterio.open(
+            tmp_dir / "TCI_10m.jp2",
+            "w",
+            driver="JP2OpenJPEG",
+            width=2048,
+            height=2048,
+            count=3,
+            dtype=np.uint8,
+            crs="EPSG:32622",
+            transform=rasterio.transform.from_origin(400000, 7200000, 10, 10),
+            BLOCKXSIZE=256,
+            BLOCKYSIZE=256,
+        ) as dataset:
+            dataset.write(image)
+        jp2_data = (tmp_dir / "TCI_10m.jp2").read_bytes()
+        files["/Nodes(TCI_10m.jp2)/$value"] = jp2_data
+
+        vrt_file = write_remote_vrt(
+            f"{base_url}/Nodes(TCI_10m.jp2)/$value",
+            tmp_dir / "product" / "TCI_10m.vrt",
+            {"Authorization": "Bearer mock_token"},
+        )
+        with rasterio.open(vrt_file) as dataset:
+            assert dataset.shape == (2048, 2048)
+            array = dataset.read(window=Window(1000, 1000, 100, 100))
+
+        # Check read window and that only parts of the file were requested, with authorization
+        with rasterio.open(tmp_dir / "TCI_10m.jp2") as dataset:
+            assert (array == dataset.read(window=Window(1000, 1000, 100, 100))).all()
+        assert stat.S_IMODE(vrt_file.with_suffix(".headers").stat().st_mode) == 0o600
+        assert "mock_token" not in vrt_file.read_text()
+        assert all(r["headers"]["Authorization"] == "Bearer mock_token" for r in requests_log)
+        assert all(r["path"] == "/Nodes(TCI_10m.jp2)/$value" for r in requests_log)
+        assert sum(r["size"] for r in requests_log) < len(jp2_data) / 2
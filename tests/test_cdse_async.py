@@ -0,0 +1,189 @@
+"""Test functionalities to download data using CDSE's OData API on an asyncio event loop."""
+
+# standard library
+import asyncio
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+# third party
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+# current project
+from s2coastalbot.cdse import TokenManager
+from s2coastalbot.cdse_async import AsyncCDSEClient
+from s2coastalbot.cdse_async import async_download_node
+from s2coastalbot.cdse_async import async_download_node_segmented
+from s2coastalbot.cdse_async import async_search_nodes
+from s2coastalbot.governor import Governor
+
+CONTENTS = bytes(range(256)) * 4
+
+
+async def serve(handler, test, governor=None):
+    """Run a test coroutine against a local stand-in of CDSE OData API."""
+    app = web.Application()
+    app.router.add_get("/{path:.*}", handler)
+    async with TestServer(app) as server:
+        with mock.patch.object(TokenManager, "get_token", return_value="mock_access"):
+            async with AsyncCDSEClient("user", "password", governor=governor) as client:
+                return await test(server, client)
+
+
+def get_file_node(server, contents=CONTENTS):
+    return {
+        "Name": "TCI_10m.jp2",
+        "ContentLength": len(contents),
+        "Nodes": {"uri": str(server.make_url("/TCI_10m.jp2/Nodes"))},
+        "Checksum": [{"Algorithm": "MD5", "Value": hashlib.md5(contents).hexdigest()}],
+    }
+
+
+def serve_contents(requests_log):
+    """Build a handler serving CONTENTS with support of range requests."""
+
+    async def handler(request):
+        requests_log.append(request.headers.copy())
+        if "Range" not in request.headers:
+            return web.Response(body=CONTENTS)
+        start, end = request.headers["Range"].split("=")[1].split("-")
+        end = int(end) if end else len(CONTENTS) - 1
+        return web.Response(status=206, body=CONTENTS[int(start) : end + 1])  # noqa E203
+
+    return handler
+
+
+def test_async_search_nodes():
+    """Test that folders are listed concurrently and that nodes keep the product tree order."""
+
+    async def handler(request):
+        base = f"http://{request.host}"
+        listings = {
+            "/root": [
+                {"Name": "folder", "ContentLength": 0, "Nodes": {"uri": f"{base}/folder"}},
+                {"Name": "TCI_10m.jp2", "ContentLength": 10, "Nodes": {"uri": ""}},
+                {"Name": "second_folder", "ContentLength": 0, "Nodes": {"uri": f"{base}/second"}},
+            ],
+            "/folder": [
+                {"Name": "nested.jp2", "ContentLength": 10, "Nodes": {"uri": ""}},
+                {"Name": "nested.xml", "ContentLength": 10, "Nodes": {"uri": ""}},
+            ],
+            "/second": [{"Name": "second_nested.jp2", "ContentLength": 10, "Nodes": {"uri": ""}}],
+        }
+        return web.json_response({"result": listings[request.path]})
+
+    async def test(server, client):
+        return await async_search_nodes(str(server.make_url("/root")), "*.jp2", client=client)
+
+    filtered_nodes = asyncio.run(serve(handler, test))
+
+    assert [node["Name"] for node in filtered_nodes] == [
+        "nested.jp2",
+        "TCI_10m.jp2",
+        "second_nested.jp2",
+    ]
+
+
+def test_async_client_retry_after():
+    """Test that throttling responses are retried once the governor pause is over."""
+
+    requests_log = []
+
+    async def handler(request):
+        requests_log.append(request.path)
+        if len(requests_log) == 1:
+            return web.Response(status=429, headers={"Retry-After": "0"})
+        return web.json_response({"result": []})
+
+    async def test(server, client):
+        return await client.get_json(str(server.make_url("/root")))
+
+    governor = Governor()
+
+    assert asyncio.run(serve(handler, test, governor)) == {"result": []}
+    assert requests_log == ["/root", "/root"]
+    assert governor.throttled_responses == 1
+
+
+def test_async_download_node_resume():
+    """Test that a partially downloaded file is resumed and checked against its checksum."""
+
+    requests_log = []
+
+    async def test(server, client):
+        return await async_download_node(get_file_node(server), output_file, client)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_file = Path(tmp_dir) / "TCI_10m.jp2"
+        output_file.with_name("TCI_10m.jp2.part").write_bytes(CONTENTS[:100])
+
+        assert asyncio.run(serve(serve_contents(requests_log), test))
+
+        assert output_file.read_bytes() == CONTENTS
+        assert not output_file.with_name("TCI_10m.jp2.part").exists()
+        assert requests_log[0]["Range"] == "bytes=100-"
+        assert requests_log[0]["Authorization"] == "Bearer mock_access"
+
+
+def test_async_download_node_checksum():
+    """Test that corrupted files are not kept."""
+
+    async def test(server, client):
+        node = dict(get_file_node(server), Checksum=[{"Algorithm": "MD5", "Value": "0" * 32}])
+        return await async_download_node(node, output_file, client, max_attempts=2)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_file = Path(tmp_dir) / "TCI_10m.jp2"
+
+        assert not asyncio.run(serve(serve_contents([]), test))
+
+        assert list(Path(tmp_dir).iterdir()) == []
+
+
+def test_async_download_node_segmented():
+    """Test that byte ranges are downloaded concurrently and written in place."""
+
+    requests_log = []
+
+    async def test(server, client):
+        return await async_download_node_segmented(
+            get_file_node(server), output_file, client, 3, 300
+        )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_file = Path(tmp_dir) / "TCI_10m.jp2"
+
+        assert asyncio.run(serve(serve_contents(requests_log), test))
+
+        assert output_file.read_bytes() == CONTENTS
+        assert not output_file.with_name("TCI_10m.jp2.part").exists()
+        assert sorted(headers["Range"] for headers in requests_log) == [
+            "bytes=0-299",
+            "bytes=300-599",
+            "bytes=600-899",
+            "bytes=900-1023",
+        ]
+
+
+def test_async_download_node_segmented_transfer_slots():
+    """Test segments waiting for fewer transfer slots than worker threads can't stall download."""
+
+    requests_log = []
+
+    async def test(server, client):
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2))
+        return await asyncio.wait_for(
+            async_download_node_segmented(get_file_node(server), output_file, client, 8, 100),
+            timeout=10,
+        )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_file = Path(tmp_dir) / "TCI_10m.jp2"
+
+        assert asyncio.run(serve(serve_contents(requests_log), test, Governor(max_transfers=1)))
+
+        assert output_file.read_bytes() == CONTENTS
+        assert len(requests_log) == 11
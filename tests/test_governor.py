@@ -0,0 +1,108 @@
+"""Test process-wide limits on requests sent to CDSE."""
+
+# standard library
+import asyncio
+import datetime
+import email.utils
+import threading
+from unittest import mock
+
+# third party
+import pytest
+
+# current project
+from s2coastalbot.governor import Governor
+from s2coastalbot.governor import parse_retry_after
+
+
+def test_governor_request_rate():
+    """Test that requests beyond the burst are delayed according to the request rate."""
+    governor = Governor(requests_per_second=10, burst=2)
+
+    with mock.patch("s2coastalbot.governor.time.sleep") as mock_sleep:
+        for _ in range(4):
+            governor.acquire_request()
+
+    delays = [c[0][0] for c in mock_sleep.call_args_list]
+    assert delays[:2] == [0.0, 0.0]
+    assert delays[2:] == pytest.approx([0.1, 0.2], abs=0.01)
+    assert governor.get_throttled_time()["requests"] == pytest.approx(0.3, abs=0.02)
+
+
+def test_governor_bandwidth():
+    """Test that downloaded bytes beyond one second worth of bandwidth are delayed."""
+    governor = Governor(bytes_per_second=1000)
+
+    with mock.patch("s2coastalbot.governor.time.sleep") as mock_sleep:
+        governor.consume(1000)
+        governor.consume(500)
+
+    delays = [c[0][0] for c in mock_sleep.call_args_list]
+    assert delays[0] == 0.0
+    assert delays[1] == pytest.approx(0.5, abs=0.01)
+    assert governor.get_transferred_bytes() == 1500
+
+
+def test_governor_transfers():
+    """Test that concurrent transfers wait for a free slot."""
+    governor = Governor(max_transfers=1)
+    second_transfer_started = threading.Event()
+
+    def second_transfer():
+        with governor.transfer():
+            second_transfer_started.set()
+
+    with governor.transfer():
+        thread = threading.Thread(target=second_transfer)
+        thread.start()
+        assert not second_transfer_started.wait(0.1)
+    thread.join()
+
+    assert second_transfer_started.is_set()
+    assert governor.get_throttled_time()["transfers"] >= 0.1
+
+
+def test_governor_async_transfers():
+    """Test that coroutines wait for a free slot without holding it once cancelled."""
+    governor = Governor(max_transfers=1)
+
+    async def second_transfer():
+        async with governor.async_transfer():
+            pass
+
+    async def test():
+        async with governor.async_transfer():
+            waiting_transfer = asyncio.create_task(second_transfer())
+            await asyncio.sleep(0.1)
+            assert not waiting_transfer.done()
+            waiting_transfer.cancel()
+        await asyncio.gather(waiting_transfer, return_exceptions=True)
+
+    asyncio.run(test())
+
+    assert governor._transfers.acquire(blocking=False)
+
+
+def test_governor_pause():
+    """Test that a pause delays following requests, and is accounted as retry_after."""
+    governor = Governor()
+    governor.pause(30)
+
+    with mock.patch("s2coastalbot.governor.time.sleep") as mock_sleep:
+        governor.acquire_request()
+
+    assert mock_sleep.call_args[0][0] == pytest.approx(30, abs=0.1)
+    assert governor.throttled_responses == 1
+    assert governor.get_throttled_time()["retry_after"] == pytest.approx(30, abs=0.1)
+
+
+def test_parse_retry_after():
+    """Test parsing of delays given in seconds or as HTTP dates."""
+    date = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=120)
+
+    assert parse_retry_after("5") == 5.0
+    assert parse_retry_after(email.utils.format_datetime(date, usegmt=True)) == pytest.approx(
+        120, abs=2
+    )
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
@@ -0,0 +1,104 @@
+"""Test ledgers of processed products."""
+
+# standard library
+import datetime
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+
+# third party
+import numpy as np
+import pytest
+
+# current project
+from s2coastalbot.ledger import Ledger
+from s2coastalbot.ledger import TileStats
+from s2coastalbot.ledger import get_ledger
+from s2coastalbot.ledger import get_tile_id
+
+
+@pytest.fixture
+def tmp_dir():
+    """Create and provide temporary directory."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield Path(temp_dir)
+
+
+def test_ledger(tmp_dir):
+    """Test that added products are appended to ledger database and found by later ledgers."""
+    ledger_file = tmp_dir / "data" / "ledger.sqlite"
+    ledger = Ledger(ledger_file, "downloaded_images")
+    assert not ledger.contains("product_001.SAFE")
+
+    ledger.add("product_001.SAFE", datetime.datetime(2024, 9, 1, 12))
+    ledger.add("product_002")
+
+    assert ledger.contains("product_001.SAFE")
+    assert ledger.contains("product_002")
+    assert Ledger(ledger_file, "downloaded_images").contains("product_001")
+    assert not Ledger(ledger_file, "posted_images").contains("product_001")
+    with closing(sqlite3.connect(ledger_file)) as connection:
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert connection.execute("SELECT date FROM downloaded_images").fetchone()[0] == (
+            "2024-09-01T12:00:00"
+        )
+
+    with pytest.raises(Exception, match="Unknown ledger"):
+        Ledger(ledger_file, "products; DROP TABLE downloaded_images")
+
+
+def test_ledger_filter_new(tmp_dir):
+    """Test that features of products in ledger are filtered out, keeping results order."""
+    ledger = Ledger(tmp_dir / "ledger.sqlite", "downloaded_images")
+    ledger.add("product_0002.SAFE")
+    features = [{"id": i, "properties": {"title": f"product_{i:04}.SAFE"}} for i in range(1200)]
+
+    assert ledger.filter_new(features[:4]) == [features[0], features[1], features[3]]
+    assert len(ledger.filter_new(features)) == 1199
+    assert ledger.filter_new([]) == []
+
+
+def test_ledger_migration(tmp_dir):
+    """Test that former CSV ledgers are imported once, including with concurrent processes."""
+    csv_file = tmp_dir / "downloaded_images.csv"
+    csv_file.write_text("date,product\n2023-09-01T12:00:00,product_001\n")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: get_ledger(tmp_dir, "downloaded_images"), range(4)))
+    ledger = get_ledger(tmp_dir, "downloaded_images")
+    ledger.add("product_002.SAFE")
+
+    assert ledger.get_products() == ["product_001", "product_002"]
+    assert get_ledger(tmp_dir, "posted_images").get_products() == []
+
+
+def test_tile_stats(tmp_dir):
+    """Test that tile outcomes are counted, and turned into weights with an exploration floor."""
+    tile_stats = TileStats(tmp_dir / "ledger.sqlite")
+    for _ in range(8):
+        tile_stats.record("31TCJ", "downloaded", 1000)
+        tile_stats.record("31TCJ", "posted")
+        tile_stats.record("31TDJ", "downloaded", 1000)
+        tile_stats.record("31TDJ", "all_nodata")
+
+    assert tile_stats.get("31TCJ") == {
+        "downloaded": 8,
+        "no_intersection": 0,
+        "all_nodata": 0,
+        "posted": 8,
+        "bytes": 8000,
+    }
+    weights = tile_stats.get_weights(["31TCJ", "31TDJ", "31TEJ"], exploration_floor=0.2)
+    assert weights == pytest.approx(np.array([0.9, 0.2, 0.5]))
+    with pytest.raises(Exception, match="Unknown tile outcome"):
+        tile_stats.record("31TCJ", "bytes")
+
+
+def test_get_tile_id():
+    """Test reading MGRS tile identifiers from product names."""
+    assert get_tile_id("S2A_MSIL2A_20240901T103021_N0511_R108_T31TCJ_20240901T141234.SAFE") == (
+        "31TCJ"
+    )
+    assert get_tile_id("mock_product") is None
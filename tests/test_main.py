@@ -13,6 +13,10 @@ from icecream import ic  # noqa F401
 
 # current project
 from s2coastalbot.custom_logger import get_custom_logger
+from s2coastalbot.ledger import get_ledger
+from s2coastalbot.ledger import get_tile_stats
+from s2coastalbot.main import get_product_path
+from s2coastalbot.main import record_tile_outcome
 from s2coastalbot.main import s2coastalbot_main
 
 
@@ -101,6 +105,66 @@ def test_process_tci_image(tmp_dir, mock_functions, mock_config, caplog):
     mock_functions["mock_clean_data"].assert_called_once_with(mock_functions["mock_tci_file"])
 
 
+def test_download_cache_replaces_cleaning(tmp_dir, mock_functions, mock_config):
+    """Test that products are not cleaned when they are kept in the download cache."""
+    mock_config["cache"] = {"download_cache_dir": str(tmp_dir)}
+
+    with mock.patch(
+        "s2coastalbot.main.download_tci_image", mock_functions["mock_download_tci_image"]
+    ), mock.patch(
+        "s2coastalbot.main.postprocess_tci_image",
+        mock_functions["mock_postprocess_tci_image"],
+    ), mock.patch(
+        "s2coastalbot.main.get_location_name", mock_functions["mock_get_location_name"]
+    ), mock.patch(
+        "s2coastalbot.main.clean_data_based_on_tci_file", mock_functions["mock_clean_data"]
+    ):
+        s2coastalbot_main(mock_config)
+
+    mock_functions["mock_clean_data"].assert_not_called()
+
+
+def test_cleaning_outside_download_cache(tmp_dir, mock_functions, mock_config):
+    """Test that products are cleaned when data source doesn't use the download cache."""
+    mock_config["cache"] = {"download_cache_dir": str(tmp_dir / "cache")}
+
+    with mock.patch(
+        "s2coastalbot.main.download_tci_image", mock_functions["mock_download_tci_image"]
+    ), mock.patch(
+        "s2coastalbot.main.postprocess_tci_image",
+        mock_functions["mock_postprocess_tci_image"],
+    ), mock.patch(
+        "s2coastalbot.main.get_location_name", mock_functions["mock_get_location_name"]
+    ), mock.patch(
+        "s2coastalbot.main.clean_data_based_on_tci_file", mock_functions["mock_clean_data"]
+    ):
+        s2coastalbot_main(mock_config)
+
+    mock_functions["mock_clean_data"].assert_called_once_with(mock_functions["mock_tci_file"])
+
+
+def test_get_product_path(tmp_dir):
+    """Test that product folder is the SAFE folder containing the TCI file."""
+    safe_path = tmp_dir / "mock_feature_id" / "mock_product.SAFE"
+    tci_file = safe_path / "GRANULE" / "L2A_T57MWM" / "IMG_DATA" / "R10m" / "T57MWM_TCI_10m.jp2"
+
+    assert get_product_path(tci_file) == safe_path
+    assert get_product_path(tmp_dir / "product" / "tci.tif") == tmp_dir / "product"
+
+
+def test_record_tile_outcome(tmp_dir):
+    """Test that outcomes are counted for the tile of the product, if it holds one."""
+    title = "S2A_MSIL2A_20240901T103021_N0511_R108_T31TCJ_20240901T141234.SAFE"
+
+    with mock.patch("s2coastalbot.main.Path", return_value=tmp_dir / "mock_subdir" / "mock_file"):
+        record_tile_outcome(tmp_dir / title / "T31TCJ_TCI_10m.jp2", "no_intersection")
+        record_tile_outcome(tmp_dir / "mock_product" / "tci.tif", "posted")
+
+    tile_stats = get_tile_stats(tmp_dir / "data").get("31TCJ")
+    assert tile_stats["no_intersection"] == 1
+    assert tile_stats["posted"] == 0
+
+
 def test_mastodon_post(tmp_dir, mock_functions, mock_config):
     """Test posting image to Mastodon."""
 
@@ -205,12 +269,8 @@ def test_error_in_posting(tmp_dir, mock_functions, mock_config, caplog):
     mock_functions["mock_clean_data"].assert_called_once()
 
 
-def test_update_posted_images_csv(tmp_dir, mock_functions, mock_config):
-    """Ensure that the CSV file is updated correctly when an image is posted."""
-
-    # Mock posted images file
-    mock_posted_images_file = tmp_dir / "data" / "posted_images.csv"
-    mock_posted_images_file.parent.mkdir(exist_ok=True, parents=True)
+def test_update_posted_images_ledger(tmp_dir, mock_functions, mock_config):
+    """Ensure that the posted images ledger is updated correctly when an image is posted."""
 
     with mock.patch(
         "s2coastalbot.main.download_tci_image", mock_functions["mock_download_tci_image"]
@@ -231,6 +291,5 @@ def test_update_posted_images_csv(tmp_dir, mock_functions, mock_config):
     ):
         s2coastalbot_main(mock_config)
 
-    assert mock_posted_images_file.exists()
-    with mock_posted_images_file.open() as f:
-        assert "mock_product_name" in f.read()
+    posted_images = get_ledger(tmp_dir / "data", "posted_images")
+    assert posted_images.get_products() == ["mock_product_name"]
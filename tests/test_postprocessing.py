@@ -12,6 +12,7 @@ import pytest
 from shapely.geometry import LineString
 
 # current project
+from s2coastalbot.postprocessing import NoIntersectionError
 from s2coastalbot.postprocessing import get_window
 from s2coastalbot.postprocessing import postprocess_tci_image
 
@@ -168,5 +169,5 @@ def test_postprocess_tci_image_no_intersection(mock_rasterio_open, mock_gpd_read
 
     with mock.patch("s2coastalbot.postprocessing.rasterio.open", mock_rasterio_open), mock.patch(
         "s2coastalbot.postprocessing.gpd.read_file", mock_gpd_read_file
-    ), pytest.raises(Exception, match="No intersection with coastline found"):
+    ), pytest.raises(NoIntersectionError):
         postprocess_tci_image(Path("tmp/fake/path/input.tif"), Path("tmp/fake/path/aoi.geojson"))
@@ -0,0 +1,76 @@
+"""Test scoring of candidate products before download."""
+
+# standard library
+import tempfile
+from pathlib import Path
+
+# third party
+import geopandas as gpd
+import pytest
+from shapely.geometry import LineString
+from shapely.geometry import box
+from shapely.geometry import mapping
+
+# current project
+from s2coastalbot.scoring import CandidateScorer
+from s2coastalbot.scoring import get_candidate_scorer
+
+
+@pytest.fixture
+def tmp_dir():
+    """Create and provide temporary directory."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield Path(temp_dir)
+
+
+@pytest.fixture
+def mock_coastline_file(tmp_dir):
+    """Mock coastline file with a single straight coastline along latitude 0.5."""
+    coastline_file = tmp_dir / "mock_coastline.geojson"
+    gdf = gpd.GeoDataFrame(geometry=[LineString([(0.0, 0.5), (3.0, 0.5)])], crs=4326)
+    gdf.to_file(coastline_file, driver="GeoJSON")
+    return coastline_file
+
+
+def get_feature(feature_id, footprint, cloud_cover=0.0):
+    return {
+        "id": feature_id,
+        "geometry": None if footprint is None else mapping(footprint),
+        "properties": {"title": f"{feature_id}.SAFE", "cloudCover": cloud_cover},
+    }
+
+
+def test_candidate_scorer_score(mock_coastline_file):
+    """Test that scores are the coastline length within valid data, weighted by cloud cover."""
+    scorer = CandidateScorer(mock_coastline_file)
+
+    full_tile = scorer.score(get_feature("full", box(0.0, 0.0, 1.0, 1.0)))
+    cloudy_tile = scorer.score(get_feature("cloudy", box(0.0, 0.0, 1.0, 1.0), cloud_cover=50.0))
+    swath_edge = scorer.score(get_feature("edge", box(0.0, 0.0, 0.3, 1.0)))
+
+    assert full_tile == pytest.approx(0.9 * 111320, rel=0.01)
+    assert cloudy_tile == pytest.approx(full_tile / 2)
+    assert swath_edge == pytest.approx(0.2 * 111320, rel=0.01)
+    assert scorer.score(get_feature("inland", box(0.0, 0.6, 1.0, 1.6))) == 0.0
+    assert scorer.score(get_feature("unknown", None)) is None
+
+
+def test_candidate_scorer_rank(mock_coastline_file):
+    """Test that candidates without coastline are dropped, and unknown ones are ranked last."""
+    scorer = CandidateScorer(mock_coastline_file)
+    features = [
+        get_feature("unknown", None),
+        get_feature("inland", box(0.0, 0.6, 1.0, 1.6)),
+        get_feature("edge", box(0.0, 0.0, 0.3, 1.0)),
+        get_feature("full", box(0.0, 0.0, 1.0, 1.0)),
+    ]
+
+    assert [f["id"] for f in scorer.rank(features)] == ["full", "edge", "unknown"]
+
+
+def test_get_candidate_scorer(mock_coastline_file):
+    """Test that coastline file is read once for all searches of the process."""
+    scorer = get_candidate_scorer(mock_coastline_file)
+
+    assert isinstance(scorer, CandidateScorer)
+    assert get_candidate_scorer(mock_coastline_file) is scorer
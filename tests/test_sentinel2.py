@@ -3,19 +3,72 @@
 # standard library
 import configparser
 import datetime
+import http.server
+import json
 import random
+import shutil
 import tempfile
+import threading
 from pathlib import Path
 from unittest import mock
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
 
 # third party
-import geopandas as gpd
+import numpy as np
 import pandas as pd
 import pytest
-from shapely.geometry import Point
+import rasterio
+import rasterio.shutil
+from rasterio.windows import Window
+from shapely.geometry import MultiPoint
 
 # current project
+from s2coastalbot.aoi import AOI_DTYPE
+from s2coastalbot.cache import QueryCache
+from s2coastalbot.governor import get_governor
+from s2coastalbot.governor import set_governor
+from s2coastalbot.ledger import Ledger
+from s2coastalbot.ledger import TileStats
+from s2coastalbot.ledger import get_ledger
+from s2coastalbot.ledger import get_tile_stats
+from s2coastalbot.sentinel2 import CATALOGUE_PAGE_SIZE
+from s2coastalbot.sentinel2 import ODATA_TILE_FILTER_MAX_LENGTH
+from s2coastalbot.sentinel2 import SEARCH_PAGE_SIZE
+from s2coastalbot.sentinel2 import Catalogue
+from s2coastalbot.sentinel2 import CDSEDataSource
+from s2coastalbot.sentinel2 import DataSource
+from s2coastalbot.sentinel2 import LocalArchiveDataSource
+from s2coastalbot.sentinel2 import STACDataSource
 from s2coastalbot.sentinel2 import download_tci_image
+from s2coastalbot.sentinel2 import get_tile_id_filters
+from s2coastalbot.sentinel2 import get_tile_weights
+from s2coastalbot.sentinel2 import search_new_feature
+from s2coastalbot.sentinel2 import select_tci_asset
+from s2coastalbot.sentinel2 import set_governor_from_config
+
+MOCK_MTD = """<?xml version="1.0" encoding="UTF-8"?>
+<n1:Level-2A_User_Product xmlns:n1="https://psd-14.sentinel2.eo.esa.int/PSD/User_Product_Level-2A.xsd">
+  <n1:General_Info>
+    <Product_Info>
+      <PRODUCT_START_TIME>{start}</PRODUCT_START_TIME>
+      <PRODUCT_STOP_TIME>{start}</PRODUCT_STOP_TIME>
+    </Product_Info>
+  </n1:General_Info>
+  <n1:Geometric_Info>
+    <Product_Footprint>
+      <Product_Footprint>
+        <Global_Footprint>
+          <EXT_POS_LIST>1.0 0.0 1.0 2.0 -1.0 2.0 -1.0 0.0 1.0 0.0</EXT_POS_LIST>
+        </Global_Footprint>
+      </Product_Footprint>
+    </Product_Footprint>
+  </n1:Geometric_Info>
+  <n1:Quality_Indicators_Info>
+    <Cloud_Coverage_Assessment>{cloud_cover}</Cloud_Coverage_Assessment>
+  </n1:Quality_Indicators_Info>
+</n1:Level-2A_User_Product>
+"""
 
 
 @pytest.fixture
@@ -40,19 +93,18 @@ def mock_config(tmp_dir):
     config = configparser.ConfigParser()
     config["access"] = {"cdse_user": "mock_user", "cdse_password": "mock_password"}
     config["misc"] = {"aoi_file_downloading": str(tmp_dir / "mock_aoi_file.geojson")}
-    config["search"] = {"cloud_cover_max": "30", "timerange": "10"}
+    # queries are sent one at a time, concurrent queries are tested in test_search_new_feature
+    config["search"] = {"cloud_cover_max": "30", "timerange": "10", "query_workers": "1"}
     return config
 
 
 @pytest.fixture
-def mock_footprint_df(tmp_dir):
-    """Fixture to mock GeoDataFrame representing Sentinel-2 tiles."""
-    gdf = gpd.GeoDataFrame(geometry=gpd.GeoSeries())
-    gdf.set_geometry(col="geometry", inplace=True)
-    for i in range(101):
-        gdf.loc[len(gdf)] = [Point(random.randint(0, 10), random.randint(0, 10))]
-    gdf.to_file(tmp_dir / "mock_aoi_file.geojson", driver="GeoJSON")
-    return gdf
+def mock_tiles():
+    """Fixture to mock compiled AOI catalogue of Sentinel-2 tiles."""
+    tiles = np.zeros(101, dtype=AOI_DTYPE)
+    tiles["lon"] = [random.randint(0, 10) for _ in range(101)]
+    tiles["lat"] = [random.randint(0, 10) for _ in range(101)]
+    return tiles
 
 
 @pytest.fixture
@@ -64,8 +116,16 @@ def mock_downloaded_images(tmp_dir):
     return downloaded_images_file
 
 
+def mock_ledger(ledger_file, *products):
+    """Create ledger of processed products."""
+    ledger = Ledger(ledger_file, "downloaded_images")
+    for product in products:
+        ledger.add(product)
+    return ledger
+
+
 def test_successful_tci_download(
-    tmp_dir, mock_tci_file, mock_config, mock_footprint_df, mock_downloaded_images
+    tmp_dir, mock_tci_file, mock_config, mock_tiles, mock_downloaded_images
 ):
     """Test successful TCI image download.."""
 
@@ -85,9 +145,7 @@ def test_successful_tci_download(
 
     with mock.patch(
         "s2coastalbot.sentinel2.Path", return_value=tmp_dir / "data" / "mock_subdir"
-    ), mock.patch(
-        "s2coastalbot.sentinel2.gpd.read_file", return_value=mock_footprint_df
-    ), mock.patch(
+    ), mock.patch("s2coastalbot.sentinel2.load_aoi", return_value=mock_tiles), mock.patch(
         "s2coastalbot.sentinel2.query_features", mock_query_features
     ), mock.patch(
         "s2coastalbot.sentinel2.odata_download_with_nodefilter", mock_odata_download
@@ -97,27 +155,62 @@ def test_successful_tci_download(
     mock_query_features.assert_called_once()
     assert tci_file_path == mock_tci_file
     assert completion_date == datetime.datetime(2023, 9, 1, 12, 0)
-    downloaded_images = pd.read_csv(mock_downloaded_images)
-    assert "mock_product_001" in downloaded_images["product"].values
+    downloaded_images = get_ledger(tmp_dir / "data", "downloaded_images")
+    assert "mock_product_001" in downloaded_images.get_products()
+
+
+def test_tci_download_tile_stats(tmp_dir, mock_config, mock_tiles):
+    """Test that bytes downloaded from CDSE are counted in statistics of product's tile."""
+    title = "S2A_MSIL2A_20240901T103021_N0511_R108_T31TCJ_20240901T141234.SAFE"
+    tci_file = tmp_dir / "data" / title / "T31TCJ_20240901T103021_TCI_10m.jp2"
+    tci_file.parent.mkdir(parents=True)
+    tci_file.touch()
+
+    # Mock CDSE query, and download of TCI and extra files going through the governor
+    mock_query_features = mock.MagicMock(
+        return_value=[
+            {
+                "properties": {"title": title, "completionDate": "2024-09-01T14:12:34"},
+                "id": "mock_feature_id",
+            }
+        ]
+    )
 
+    def mock_odata_download(feature_id, *args, **kwargs):
+        get_governor().consume(1000)
+        get_governor().consume(234)
+        return feature_id
 
-def test_no_suitable_product_found(tmp_dir, mock_config, mock_footprint_df):
+    with mock.patch(
+        "s2coastalbot.sentinel2.Path", return_value=tmp_dir / "data" / "mock_subdir"
+    ), mock.patch("s2coastalbot.sentinel2.load_aoi", return_value=mock_tiles), mock.patch(
+        "s2coastalbot.sentinel2.query_features", mock_query_features
+    ), mock.patch(
+        "s2coastalbot.sentinel2.odata_download_with_nodefilter", mock_odata_download
+    ):
+        tci_file_path, _ = download_tci_image(mock_config)
+
+    assert tci_file_path == tci_file
+    tile_stats = get_tile_stats(tmp_dir / "data").get("31TCJ")
+    assert tile_stats["downloaded"] == 1
+    assert tile_stats["bytes"] == 1234
+
+
+def test_no_suitable_product_found(tmp_dir, mock_config, mock_tiles):
     """Test case where no suitable Sentinel-2 product is found."""
 
     mock_query_features = mock.MagicMock(return_value=[])
 
     with mock.patch(
         "s2coastalbot.sentinel2.Path", return_value=tmp_dir / "data" / "mock_subdir"
-    ), mock.patch(
-        "s2coastalbot.sentinel2.gpd.read_file", return_value=mock_footprint_df
-    ), mock.patch(
+    ), mock.patch("s2coastalbot.sentinel2.load_aoi", return_value=mock_tiles), mock.patch(
         "s2coastalbot.sentinel2.query_features", mock_query_features
     ):
         with pytest.raises(Exception, match="No suitable product found"):
             download_tci_image(mock_config)
 
 
-def test_failed_tci_image_download(mock_config, tmp_dir, mock_footprint_df, mock_downloaded_images):
+def test_failed_tci_image_download(mock_config, tmp_dir, mock_tiles, mock_downloaded_images):
     """Test case where download fails."""
 
     # Mock CDSE query and download
@@ -136,9 +229,7 @@ def test_failed_tci_image_download(mock_config, tmp_dir, mock_footprint_df, mock
 
     with mock.patch(
         "s2coastalbot.sentinel2.Path", return_value=tmp_dir / "data" / "mock_subdir"
-    ), mock.patch(
-        "s2coastalbot.sentinel2.gpd.read_file", return_value=mock_footprint_df
-    ), mock.patch(
+    ), mock.patch("s2coastalbot.sentinel2.load_aoi", return_value=mock_tiles), mock.patch(
         "s2coastalbot.sentinel2.query_features", mock_query_features
     ), mock.patch(
         "s2coastalbot.sentinel2.odata_download_with_nodefilter", mock_odata_download
@@ -147,12 +238,10 @@ def test_failed_tci_image_download(mock_config, tmp_dir, mock_footprint_df, mock
             download_tci_image(mock_config)
 
 
-def test_skip_already_downloaded_images(
-    mock_config, tmp_dir, mock_footprint_df, mock_downloaded_images
-):
+def test_skip_already_downloaded_images(mock_config, tmp_dir, mock_tiles, mock_downloaded_images):
     """Test that already downloaded images are skipped."""
 
-    # Add a mock product to the downloaded_images.csv file
+    # Add a mock product to the former downloaded_images.csv file, imported into ledger
     downloaded_images = pd.read_csv(mock_downloaded_images)
     downloaded_images.loc[len(downloaded_images)] = ["2023-09-01T12:00:00", "mock_product_001"]
     downloaded_images.to_csv(mock_downloaded_images, index=False)
@@ -172,11 +261,541 @@ def test_skip_already_downloaded_images(
 
     with mock.patch(
         "s2coastalbot.sentinel2.Path", return_value=tmp_dir / "data" / "mock_subdir"
-    ), mock.patch(
-        "s2coastalbot.sentinel2.gpd.read_file", return_value=mock_footprint_df
-    ), mock.patch(
+    ), mock.patch("s2coastalbot.sentinel2.load_aoi", return_value=mock_tiles), mock.patch(
         "s2coastalbot.sentinel2.query_features", mock_query_features
     ):
         # Expect not to find any suitable product
         with pytest.raises(Exception, match="No suitable product found"):
             download_tci_image(mock_config, output_folder=tmp_dir)
+
+
+def test_cdse_query_cache(tmp_dir, mock_config):
+    """Test that repeated CDSE queries are served from query cache."""
+    mock_config["cache"] = {"query_cache_file": str(tmp_dir / "queries.sqlite")}
+    mock_features = [{"id": "mock_feature_id", "properties": {"title": "mock_product.SAFE"}}]
+    data_source = CDSEDataSource(mock_config)
+
+    with mock.patch(
+        "s2coastalbot.sentinel2.query_features", return_value=mock_features
+    ) as mock_query_features:
+        for geometry, sort_by in [
+            (MultiPoint([(1.0, 0.5)]), "date"),
+            (MultiPoint([(1.0, 0.5)]), "date"),
+            (MultiPoint([(2, 2)]), "date"),
+            (MultiPoint([(2, 2)]), "cloud_cover"),
+        ]:
+            data_source.sort_by = sort_by
+            features = data_source.query_features(
+                geometry,
+                datetime.datetime.now() - datetime.timedelta(days=10),
+                datetime.datetime.now(),
+                30,
+            )
+            assert features == mock_features
+
+    # cached queries fetch all results in large pages, and are keyed by search order
+    assert mock_query_features.call_count == 3
+    assert mock_query_features.call_args[0][1]["maxRecords"] == CATALOGUE_PAGE_SIZE
+
+
+def test_cdse_query_tiles(mock_config, mock_tiles):
+    """Test that tiles are queried by identifiers when set, and by centroids otherwise."""
+    tiles = np.zeros(2, dtype=AOI_DTYPE)
+    tiles["tile_id"] = ["31TCJ", "31TDJ"]
+    products = [
+        {
+            "Id": f"mock_feature_id_{i}",
+            "Name": f"S2A_MSIL2A_20240901T103021_N0511_R108_T31TCJ_2024090{i}T141234.SAFE",
+            "ContentDate": {"Start": "2024-09-01T10:30:21.024Z", "End": "2024-09-01T10:30:21.024Z"},
+            "PublicationDate": "2024-09-01T14:12:34.000Z",
+            "Attributes": [{"Name": "cloudCover", "Value": 10.0}],
+        }
+        for i in range(2)
+    ]
+    data_source = CDSEDataSource(mock_config)
+    start_date = datetime.datetime(2024, 8, 25, tzinfo=datetime.timezone.utc)
+    end_date = datetime.datetime(2024, 9, 4, tzinfo=datetime.timezone.utc)
+
+    with mock.patch("s2coastalbot.sentinel2.CDSEClient") as mock_client, mock.patch(
+        "s2coastalbot.sentinel2.query_features", return_value=[]
+    ) as mock_query_features:
+        mock_get_json = mock_client.return_value.__enter__.return_value.get_json
+        mock_get_json.side_effect = [
+            {"value": products[:1], "@odata.nextLink": "https://mock/next_page"},
+            {"value": products[1:]},
+        ]
+        features = list(data_source.query_tiles(tiles, start_date, end_date, 30))
+        list(data_source.query_tiles(mock_tiles, start_date, end_date, 30))
+
+    assert [f["id"] for f in features] == ["mock_feature_id_0", "mock_feature_id_1"]
+    assert features[0]["properties"]["title"] == products[0]["Name"]
+    assert features[0]["properties"]["cloudCover"] == 10.0
+    query = parse_qs(urlparse(mock_get_json.call_args_list[0][0][0]).query)
+    assert "(contains(Name,'_T31TCJ_') or contains(Name,'_T31TDJ_'))" in query["$filter"][0]
+    assert "ContentDate/Start ge 2024-08-25T00:00:00.000Z" in query["$filter"][0]
+    assert query["$orderby"] == ["ContentDate/Start desc"]
+    assert query["$top"] == ["20"]
+    assert mock_get_json.call_args_list[1][0][0] == "https://mock/next_page"
+    assert data_source.get_batch_size(tiles) > data_source.get_batch_size(mock_tiles)
+    mock_query_features.assert_called_once()
+    assert mock_query_features.call_args[0][1]["sortParam"] == "startDate"
+
+    # Products are sorted by cloud cover within each results page
+    products[0]["Attributes"] = [{"Name": "cloudCover", "Value": 20.0}]
+    data_source.sort_by = "cloud_cover"
+    with mock.patch("s2coastalbot.sentinel2.CDSEClient") as mock_client:
+        mock_get_json = mock_client.return_value.__enter__.return_value.get_json
+        mock_get_json.return_value = {"value": products}
+        features = list(data_source.query_tiles(tiles, start_date, end_date, 30))
+
+    assert [f["id"] for f in features] == ["mock_feature_id_1", "mock_feature_id_0"]
+    assert "$orderby" not in parse_qs(urlparse(mock_get_json.call_args[0][0]).query)
+
+
+def test_set_governor_from_config(mock_config):
+    """Test that CDSE quotas are installed once, and kept by data sources created afterwards."""
+    default_governor = get_governor()
+    mock_config["download"] = {"requests_per_second": "5", "max_transfers": "2"}
+    try:
+        set_governor_from_config(mock_config)
+        governor = get_governor()
+        assert governor is not default_governor
+        assert governor._requests.rate == 5
+
+        CDSEDataSource(mock_config)
+        STACDataSource("https://mock-stac", "mock-collection")
+        assert get_governor() is governor
+    finally:
+        set_governor(default_governor)
+
+
+def test_get_tile_weights(tmp_dir):
+    """Test that tile weights are kept within a date bucket of the query cache."""
+    tiles = np.zeros(2, dtype=AOI_DTYPE)
+    tiles["tile_id"] = ["31TCJ", "31TDJ"]
+    tile_stats = TileStats(tmp_dir / "ledger.sqlite")
+    query_cache = QueryCache(tmp_dir / "queries.sqlite")
+
+    weights = get_tile_weights(tiles, tile_stats, 0.1, query_cache)
+    tile_stats.record("31TCJ", "downloaded")
+
+    assert weights == pytest.approx([0.5, 0.5])
+    assert get_tile_weights(tiles, tile_stats, 0.1, query_cache) == pytest.approx(weights)
+    assert get_tile_weights(tiles, tile_stats, 0.1) == pytest.approx([1 / 3, 0.5])
+
+
+def test_get_tile_id_filters():
+    """Test that long lists of tile identifiers are split into filters of bounded length."""
+    tile_ids = [f"{i:02}ABC" for i in range(1000)]
+
+    filters = get_tile_id_filters(tile_ids)
+
+    assert len(filters) > 1
+    assert all(len(tile_filter) <= ODATA_TILE_FILTER_MAX_LENGTH for tile_filter in filters)
+    assert " or ".join(filters).count("contains(Name,") == 1000
+
+
+def test_search_new_feature(tmp_dir, mock_tiles):
+    """Test that batch queries run concurrently and that the first new product wins."""
+    tiles = np.concatenate([mock_tiles] * 3)  # 7 batches of 50 tiles
+    tiles["lon"] = np.arange(len(tiles))  # identify batches by their first tile
+    queried_batches = []
+    fetched_pages = []
+    processed_feature = {"id": 1, "properties": {"title": "processed_product.SAFE"}}
+
+    # Record stop event of the search, which is the first event it creates
+    events = []
+    event_class = threading.Event
+
+    def mock_event():
+        events.append(event_class())
+        return events[-1]
+
+    # Mock data source where first batch has many pages of processed products, the second one
+    # only being fetched once the search is stopped, second batch returns only a processed
+    # product once the search is stopped, and third one returns a new product once the second
+    # page of the first batch is requested
+    second_page_requested = threading.Event()
+
+    def pages():
+        for page_number in range(20):
+            if page_number == 1:
+                second_page_requested.set()
+                fetched_pages.append(events[0].wait(timeout=10))
+            else:
+                fetched_pages.append(True)
+            yield from [processed_feature] * SEARCH_PAGE_SIZE
+
+    def mock_query_tiles(tiles, start_date, end_date, cloud_cover_max):
+        batch = int(tiles["lon"][0]) // 50
+        queried_batches.append(batch)
+        if batch == 0:
+            return pages()
+        if batch == 1:
+            events[0].wait(timeout=10)
+            return [processed_feature]
+        if batch == 2:
+            second_page_requested.wait(timeout=10)
+            return [{"id": batch, "properties": {"title": "new_product.SAFE"}}]
+        return []
+
+    data_source = mock.MagicMock()
+    data_source.query_tiles.side_effect = mock_query_tiles
+    data_source.get_batch_size.return_value = 50
+
+    with mock.patch("s2coastalbot.sentinel2.threading.Event", side_effect=mock_event):
+        feature = search_new_feature(
+            data_source,
+            tiles,
+            datetime.datetime(2024, 8, 25),
+            datetime.datetime(2024, 9, 4),
+            30,
+            mock_ledger(tmp_dir / "ledger.sqlite", "processed_product"),
+            query_workers=3,
+        )
+
+    # First batches run at once, no other batch starts once the search is stopped, and the first
+    # batch doesn't fetch any page after the one in progress when the search stopped
+    assert feature == {"id": 2, "properties": {"title": "new_product.SAFE"}}
+    assert sorted(queried_batches) == [0, 1, 2]
+    assert fetched_pages == [True, True]
+
+
+def test_catalogue(tmp_dir, mock_tiles):
+    """Test incremental catalogue syncs, expiry of old products and selection of new ones."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    mock_features = {
+        "old": {"id": "old", "properties": {"title": "old.SAFE", "startDate": now.isoformat()}},
+        "new": {"id": "new", "properties": {"title": "new.SAFE", "startDate": now.isoformat()}},
+    }
+    data_source = mock.MagicMock()
+    data_source.get_batch_size.return_value = 50
+    catalogue = Catalogue(tmp_dir / "catalogue.sqlite")
+
+    # first sync queries every batch of tiles without publication date
+    data_source.query_tiles.return_value = [mock_features["old"]]
+    assert catalogue.sync(data_source, mock_tiles, 10, 30) == 1
+    assert data_source.query_tiles.call_count == 3
+    assert data_source.query_tiles.call_args[1]["published_after"] is None
+
+    # following syncs only query products published since previous sync
+    data_source.query_tiles.return_value = [mock_features["new"]]
+    catalogue.sync(data_source, mock_tiles, 10, 30)
+    published_after = data_source.query_tiles.call_args[1]["published_after"]
+    assert now - datetime.timedelta(hours=2) < published_after < now
+
+    ledger = mock_ledger(tmp_dir / "ledger.sqlite", "old")
+    assert catalogue.select(mock_tiles, 10, 30, ledger) == mock_features["new"]
+    assert catalogue.select(mock_tiles, 10, 20, ledger) is None
+    scorer = mock.MagicMock()
+    scorer.rank.side_effect = lambda features: features
+    assert catalogue.select(mock_tiles, 10, 30, ledger, scorer) == mock_features["new"]
+    scorer.rank.assert_called_once_with([mock_features["new"]])
+    ledger.add("new.SAFE")
+    assert catalogue.select(mock_tiles, 10, 30, ledger) is None
+
+    # products acquired before time range are dropped
+    mock_features["new"]["properties"]["startDate"] = (
+        now - datetime.timedelta(days=20)
+    ).isoformat()
+    data_source.query_tiles.return_value = [mock_features["new"]]
+    catalogue.sync(data_source, mock_tiles, 10, 30)
+    assert catalogue.select(mock_tiles, 10, 30, mock_ledger(tmp_dir / "old.sqlite", "old")) is None
+
+
+def test_catalogue_weighted_selection(tmp_dir, mock_tiles):
+    """Test that products of tiles whose products were often posted tend to be selected first."""
+    title = "S2A_MSIL2A_20240901T103021_N0511_R108_T{}_20240901T141234.SAFE"
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    features = [
+        {"id": tile_id, "properties": {"title": title.format(tile_id), "startDate": now}}
+        for tile_id in ("31TCJ", "31TDJ")
+    ]
+    data_source = mock.MagicMock()
+    data_source.get_batch_size.return_value = len(mock_tiles)
+    data_source.query_tiles.return_value = features
+    catalogue = Catalogue(tmp_dir / "catalogue.sqlite")
+    catalogue.sync(data_source, mock_tiles, 10, 30)
+
+    # Products of 31TCJ were always posted, those of 31TDJ never were
+    tile_stats = TileStats(tmp_dir / "ledger.sqlite")
+    for _ in range(100):
+        tile_stats.record("31TCJ", "downloaded")
+        tile_stats.record("31TCJ", "posted")
+        tile_stats.record("31TDJ", "downloaded")
+    ledger = mock_ledger(tmp_dir / "ledger.sqlite")
+
+    selected = [
+        catalogue.select(mock_tiles, 10, 30, ledger, None, tile_stats, 0.01)["id"]
+        for _ in range(100)
+    ]
+
+    assert selected.count("31TCJ") > 80
+
+
+def test_search_new_feature_pages(mock_tiles):
+    """Test that results are consumed one page at a time, until a new product is found."""
+    consumed = []
+
+    # Mock lazy query results, where the first 30 products were already processed
+    def mock_query_tiles(tiles, start_date, end_date, cloud_cover_max):
+        for i in range(100):
+            consumed.append(i)
+            yield {"id": i, "properties": {"title": f"product_{i}.SAFE"}}
+
+    data_source = mock.MagicMock()
+    data_source.query_tiles.side_effect = mock_query_tiles
+    data_source.get_batch_size.return_value = 150
+    ledger = mock.MagicMock()
+    ledger.filter_new.side_effect = lambda features: [f for f in features if f["id"] >= 30]
+
+    feature = search_new_feature(
+        data_source,
+        mock_tiles,
+        datetime.datetime(2024, 8, 25),
+        datetime.datetime(2024, 9, 4),
+        30,
+        ledger,
+        query_workers=1,
+    )
+
+    assert feature["id"] == 30
+    assert len(consumed) == 40
+
+
+def test_search_new_feature_scorer(mock_tiles):
+    """Test that the best scored new product is selected, when a scorer is given."""
+    features = [{"id": i, "properties": {"title": f"product_{i}.SAFE"}} for i in range(3)]
+    data_source = mock.MagicMock()
+    data_source.query_tiles.return_value = features
+    data_source.get_batch_size.return_value = 150
+    ledger = mock.MagicMock()
+    ledger.filter_new.side_effect = lambda features: features
+    scorer = mock.MagicMock()
+    scorer.rank.side_effect = lambda features: features[::-1]
+
+    feature = search_new_feature(
+        data_source,
+        mock_tiles,
+        datetime.datetime(2024, 8, 25),
+        datetime.datetime(2024, 9, 4),
+        30,
+        ledger,
+        query_workers=1,
+        scorer=scorer,
+    )
+
+    assert feature == features[2]
+    scorer.rank.assert_called_once_with(features)
+
+
+def create_mock_safe_product(archive_dir, title, start, cloud_cover):
+    """Create SAFE product folder with metadata and TCI files in mock local archive."""
+    safe_path = archive_dir / "2024" / title
+    tci_file = safe_path / "GRANULE" / "L2A_T31TCJ" / "IMG_DATA" / "R10m" / "T31TCJ_TCI_10m.jp2"
+    tci_file.parent.mkdir(parents=True)
+    tci_file.write_bytes(b"mock_tci")
+    (safe_path / "MTD_MSIL2A.xml").write_text(MOCK_MTD.format(start=start, cloud_cover=cloud_cover))
+    return tci_file
+
+
+def test_data_source_interface():
+    """Test that data sources must implement queries and TCI files fetching."""
+
+    class QueryOnlyDataSource(DataSource):
+        def query_features(self, geometry, start_date, end_date, cloud_cover_max, **kwargs):
+            return []
+
+    with pytest.raises(TypeError):
+        DataSource()
+    with pytest.raises(TypeError):
+        QueryOnlyDataSource()
+
+
+def test_local_archive_data_source(tmp_dir):
+    """Test that products of local archive are queried from index and linked to output folder."""
+    archive_dir = tmp_dir / "archive"
+    now = datetime.datetime.now(datetime.timezone.utc)
+    recent = (now - datetime.timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    old = (now - datetime.timedelta(days=30)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    title = "S2A_MSIL2A_20240901T103021_N0511_R108_T31TCJ_20240901T141234.SAFE"
+    tci_file = create_mock_safe_product(archive_dir, title, recent, 10.0)
+    create_mock_safe_product(archive_dir, title.replace("R108", "R008"), recent, 80.0)
+    create_mock_safe_product(archive_dir, title.replace("R108", "R051"), old, 10.0)
+
+    data_source = LocalArchiveDataSource(archive_dir, tmp_dir / "index.json")
+    features = data_source.query_features(
+        MultiPoint([(1.0, 0.5), (20.0, 20.0)]),
+        datetime.datetime.now() - datetime.timedelta(days=10),
+        datetime.datetime.now(),
+        30,
+    )
+
+    assert [f["properties"]["title"] for f in features] == [title]
+    assert features[0]["properties"]["tileId"] == "T31TCJ"
+    assert (tmp_dir / "index.json").exists()
+    linked_tci_file = data_source.get_tci_file(features[0], tmp_dir / "data")
+    assert linked_tci_file == tmp_dir / "data" / title / "T31TCJ_TCI_10m.jp2"
+    assert linked_tci_file.read_bytes() == b"mock_tci"
+    assert linked_tci_file.resolve() == tci_file.resolve()
+
+    # Products which left archive since they were found aren't available anymore
+    stale_feature = dict(features[0], id="removed_product.SAFE")
+    assert data_source.get_tci_file(stale_feature, tmp_dir / "data") is None
+
+
+def test_local_archive_index_update(tmp_dir):
+    """Test that only metadata of new products are read, and removed products are dropped."""
+    archive_dir = tmp_dir / "archive"
+    title = "S2A_MSIL2A_20240901T103021_N0511_R108_T31TCJ_20240901T141234.SAFE"
+    create_mock_safe_product(archive_dir, title, "2024-09-01T10:30:21.024Z", 10.0)
+    LocalArchiveDataSource(archive_dir, tmp_dir / "index.json").update_index()
+
+    # Add a product and remove the first one
+    new_title = title.replace("R108", "R008")
+    create_mock_safe_product(archive_dir, new_title, "2024-09-02T10:30:21.024Z", 10.0)
+    shutil.rmtree(archive_dir / "2024" / title)
+    with mock.patch(
+        "s2coastalbot.sentinel2.read_safe_metadata", return_value={"title": new_title}
+    ) as mock_read_safe_metadata:
+        products = LocalArchiveDataSource(archive_dir, tmp_dir / "index.json").update_index()
+
+    mock_read_safe_metadata.assert_called_once_with(archive_dir / "2024" / new_title)
+    assert products == {f"2024/{new_title}": {"title": new_title, "path": f"2024/{new_title}"}}
+
+
+@pytest.fixture
+def stac_stand_in():
+    """Serve a STAC API search endpoint and asset files from a local server.
+
+    Returns:
+        files (dict[str, bytes]): Served files contents by url path, to be filled by tests
+        searches (list[dict]): Search request payloads, search responses are "/search" file
+        requests_log (list[dict]): Path and response size of each file request
+        base_url (str)
+    """
+    files = {}
+    searches = []
+    requests_log = []
+
+    class StacRequestHandler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            self.send_response(200 if self.path in files else 404)
+            self.send_header("Content-Length", str(len(files.get(self.path, b""))))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+
+        def do_POST(self):
+            searches.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/geo+json")
+            self.end_headers()
+            self.wfile.write(files["/search"])
+
+        def do_GET(self):
+            data = files[self.path]
+            start, end = self.headers["Range"].split("=")[1].split("-")
+            start, end = int(start), min(int(end), len(data) - 1)
+            body = data[start : end + 1]  # noqa E203
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            requests_log.append({"path": self.path, "size": len(body)})
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StacRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield files, searches, requests_log, f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_select_tci_asset():
+    """Test that Cloud-Optimized GeoTIFF assets are preferred over JP2 assets."""
+    jp2_asset = {"href": "https://mock/TCI_10m.jp2", "type": "image/jp2", "roles": ["data"]}
+    cog_asset = {
+        "href": "https://mock/TCI.tif",
+        "type": "image/tiff; application=geotiff; profile=cloud-optimized",
+        "roles": ["visual"],
+    }
+    s3_asset = {"href": "s3://mock/TCI.tif", "type": "image/tiff", "roles": ["visual"]}
+
+    assert select_tci_asset({"TCI_10m": jp2_asset, "preview": cog_asset}) is cog_asset
+    assert select_tci_asset({"TCI_10m": jp2_asset, "visual": s3_asset}) is jp2_asset
+    assert select_tci_asset({"B02_10m": jp2_asset}) is None
+
+
+def test_stac_data_source(tmp_dir, stac_stand_in):
+    """Test that a STAC search yields features whose COG asset is read by windows."""
+    files, searches, requests_log, base_url = stac_stand_in
+
+    # Create and serve COG fixture and search response
+    image = np.random.default_rng(0).integers(0, 255, (3, 2048, 2048), dtype=np.uint8)
+    with rasterio.open(
+        tmp_dir / "TCI.tif",
+        "w",
+        driver="GTiff",
+        width=2048,
+        height=2048,
+        count=3,
+        dtype=np.uint8,
+        crs="EPSG:32622",
+        transform=rasterio.transform.from_origin(400000, 7200000, 10, 10),
+    ) as dataset:
+        dataset.write(image)
+    rasterio.shutil.copy(tmp_dir / "TCI.tif", tmp_dir / "TCI_cog.tif", driver="COG")
+    files["/assets/T22WES_TCI.tif"] = (tmp_dir / "TCI_cog.tif").read_bytes()
+    item = {
+        "id": "S2B_MSIL2A_20240901T150759_N0511_R025_T22WES_20240901T190025",
+        "properties": {"datetime": "2024-09-01T15:07:59Z", "eo:cloud_cover": 12.5},
+        "assets": {
+            "TCI_10m": {"href": f"{base_url}/assets/T22WES_TCI.jp2", "type": "image/jp2"},
+            "visual": {
+                "href": f"{base_url}/assets/T22WES_TCI.tif",
+                "type": "image/tiff; application=geotiff; profile=cloud-optimized",
+            },
+        },
+    }
+    files["/search"] = json.dumps({"type": "FeatureCollection", "features": [item]}).encode()
+
+    data_source = STACDataSource(f"{base_url}/", "sentinel-2-l2a")
+    features = data_source.query_features(
+        MultiPoint([(1.0, 0.5)]),
+        datetime.datetime(2024, 8, 25),
+        datetime.datetime(2024, 9, 4),
+        30,
+    )
+    tci_file = data_source.get_tci_file(features[0], tmp_dir / "data")
+
+    assert searches[0]["collections"] == ["sentinel-2-l2a"]
+    assert searches[0]["query"] == {"eo:cloud_cover": {"lte": 30}}
+    assert features[0]["properties"]["title"] == f"{item['id']}.SAFE"
+    assert features[0]["properties"]["completionDate"] == "2024-09-01T15:07:59Z"
+    assert tci_file.parent == tmp_dir / "data" / f"{item['id']}.SAFE"
+    with rasterio.open(tci_file) as dataset:
+        array = dataset.read(window=Window(1000, 1000, 100, 100))
+    assert (array == image[:, 1000:1100, 1000:1100]).all()
+    assert all(r["path"] == "/assets/T22WES_TCI.tif" for r in requests_log)
+    assert sum(r["size"] for r in requests_log) < len(files["/assets/T22WES_TCI.tif"]) / 2
+
+
+def test_stac_query_tiles(stac_stand_in):
+    """Test that STAC searches filter items by MGRS grid code when tile identifiers are set."""
+    files, searches, _, base_url = stac_stand_in
+    files["/search"] = json.dumps({"type": "FeatureCollection", "features": []}).encode()
+    tiles = np.zeros(2, dtype=AOI_DTYPE)
+    tiles["tile_id"] = ["31TDJ", "31TCJ"]
+
+    data_source = STACDataSource(base_url, "sentinel-2-l2a")
+    data_source.query_tiles(
+        tiles, datetime.datetime(2024, 8, 25), datetime.datetime(2024, 9, 4), 30
+    )
+
+    assert "intersects" not in searches[0]
+    assert searches[0]["query"] == {
+        "grid:code": {"in": ["MGRS-31TCJ", "MGRS-31TDJ"]},
+        "eo:cloud_cover": {"lte": 30},
+    }